@@ -1,8 +1,71 @@
 # Copyright (c) 2023, ALYF GmbH and contributors
 # For license information, please see license.txt
 import json
-from typing import Dict, Optional
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeout in seconds
+DEFAULT_TIMEOUT = (5, 120)
+POOL_MAXSIZE = 10
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+_metrics = {"requests": 0, "retries": 0, "errors": 0, "request_time": 0.0}
+_metrics_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+	"""
+	Return the process-wide HTTP session for the Admin app.
+
+	Connections are pooled and kept alive, so paginated syncs reuse the
+	TCP/TLS connection instead of opening a new one per page.
+	"""
+	global _session
+	if _session is None:
+		with _session_lock:
+			if _session is None:
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+				session.mount("https://", adapter)
+				session.mount("http://", adapter)
+				_session = session
+
+	return _session
+
+
+def count(metric: str, value: float = 1) -> None:
+	with _metrics_lock:
+		_metrics[metric] += value
+
+
+def get_pool_metrics() -> Dict:
+	"""Return request counters and the state of the connection pools."""
+	pools = []
+	for adapter in set(get_session().adapters.values()):
+		pool_manager = adapter.poolmanager
+		for key in pool_manager.pools.keys():
+			pool = pool_manager.pools.get(key)
+			if not pool:
+				continue
+
+			pools.append(
+				{
+					"host": f"{pool.scheme}://{pool.host}:{pool.port}",
+					"connections_opened": pool.num_connections,
+					"requests": pool.num_requests,
+					"idle_connections": pool.pool.qsize() if pool.pool else 0,
+					"maxsize": pool_manager.connection_pool_kw.get("maxsize"),
+				}
+			)
+
+	return {**_metrics, "pools": pools}
 
 
 class AdminRequest:
@@ -14,13 +77,21 @@ class AdminRequest:
 		url: str,
 		customer_id: str,
 		use_test_environment: bool,
+		timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+		on_request_time: Optional[Callable[[float], None]] = None,
 	) -> None:
+		"""
+		`on_request_time` is called with the duration of every request, from the
+		thread that sent it, e.g. to add it to a profile.
+		"""
 		self.ip_address = ip_address
 		self.user_agent = user_agent
 		self.api_token = api_token
 		self.url = url
 		self.customer_id = customer_id
 		self.use_test_environment = use_test_environment
+		self.timeout = timeout
+		self.on_request_time = on_request_time
 
 	@property
 	def headers(self):
@@ -35,6 +106,53 @@ class AdminRequest:
 			"use_test_environment": self.use_test_environment,
 		}
 
+	def post(
+		self, method: str, data: Dict, retry: bool = False, **kwargs
+	) -> requests.Response:
+		return self.send("POST", method, data=json.dumps(data), retry=retry, **kwargs)
+
+	def send(self, http_method: str, method: str, retry: bool = False, **kwargs):
+		"""
+		Send a request via the pooled session.
+
+		Only idempotent fetches may `retry`, with exponential backoff on connection
+		errors, timeouts and gateway errors. Consent API calls exchange the consent
+		token on every request and must not be repeated.
+		"""
+		attempts = MAX_RETRIES + 1 if retry else 1
+		for attempt in range(attempts):
+			if attempt:
+				count("retries")
+				time.sleep(BACKOFF_FACTOR * (2 ** (attempt - 1)))
+
+			start = time.monotonic()
+			try:
+				response = get_session().request(
+					http_method,
+					url=self.url + method,
+					headers=self.headers,
+					timeout=self.timeout,
+					**kwargs,
+				)
+			except (requests.ConnectionError, requests.Timeout):
+				count("errors")
+				if attempt == attempts - 1:
+					raise
+				continue
+			finally:
+				request_time = time.monotonic() - start
+				count("requests")
+				count("request_time", request_time)
+				if self.on_request_time:
+					self.on_request_time(request_time)
+
+			if response.status_code in RETRY_STATUS_CODES and attempt < attempts - 1:
+				# Release the connection to the pool, a streamed response holds on to it
+				response.close()
+				continue
+
+			return response
+
 	def get_client_token(
 		self,
 		current_flow: str,
@@ -55,18 +173,14 @@ class AdminRequest:
 		)
 
 		method = "banking_admin.api.get_client_token"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post(method, data)
 
 	def flow_accounts(self, session_id: str, flow_id: str):
 		data = self.data
 		data.update({"session_id": session_id, "flow_id": flow_id})
 
 		method = "banking_admin.api.fetch_accounts_and_bank"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post(method, data)
 
 	def flow_transactions(
 		self,
@@ -74,6 +188,7 @@ class AdminRequest:
 		flow_id: str,
 		url: Optional[str] = None,
 		offset: Optional[str] = None,
+		stream: bool = False,
 	):
 		data = self.data
 		data.update(
@@ -81,25 +196,21 @@ class AdminRequest:
 		)
 
 		method = "banking_admin.api.fetch_flow_transactions"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post(method, data, retry=True, stream=stream)
 
 	def end_session(self, session_id: str):
 		data = self.data
 		data.update({"session_id": session_id})
 
 		method = "banking_admin.api.end_session"
-		requests.post(url=self.url + method, headers=self.headers, data=json.dumps(data))
+		return self.post(method, data)
 
 	def consent_accounts(self, consent_id: str, consent_token: str):
 		data = self.data
 		data.update({"consent_id": consent_id, "consent_token": consent_token})
 
 		method = "banking_admin.api.fetch_consent_accounts"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post(method, data)
 
 	def consent_transactions(
 		self,
@@ -109,6 +220,7 @@ class AdminRequest:
 		consent_token: str,
 		url: Optional[str] = None,
 		offset: Optional[str] = None,
+		stream: bool = False,
 	):
 		data = self.data
 		data.update(
@@ -123,16 +235,12 @@ class AdminRequest:
 		)
 
 		method = "banking_admin.api.fetch_consent_transactions"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post(method, data, stream=stream)
 
 	def fetch_subscription(self):
 		method = "banking_admin.api.fetch_subscription_details"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(self.data)
-		)
+		return self.post(method, self.data, retry=True)
 
 	def get_customer_portal(self):
 		method = "banking_admin.api.get_customer_portal"
-		return requests.get(url=self.url + method)
+		return self.send("GET", method, retry=True)
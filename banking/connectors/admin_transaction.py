@@ -1,12 +1,18 @@
 # Copyright (c) 2022, ALYF GmbH and contributors
 # For license information, please see license.txt
+from contextlib import suppress
 from typing import Dict
 
 from frappe.utils import formatdate, today
 
+from banking.connectors.json_stream import JsonArrayStream
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 class AdminTransaction:
 	def __init__(self, response_value) -> None:
+		self.value = response_value
 		self.result = response_value.get("result", {})
 		self.pagination = self.result.get("pagination", {})
 		self.transaction_list = self.result.get("transactions", [])
@@ -30,3 +36,37 @@ class AdminTransaction:
 		}
 
 		return payload
+
+
+class StreamedAdminTransaction(AdminTransaction):
+	"""
+	AdminTransaction for a streamed response (`stream=True`).
+
+	`transaction_list` is an iterator that yields the transactions while the
+	response body is downloaded and parsed. The rest of the response (pagination,
+	consent token) is available once it is exhausted or `consume`d.
+	"""
+
+	def __init__(self, response) -> None:
+		self.stream = JsonArrayStream(
+			response.iter_content(STREAM_CHUNK_SIZE), ("message", "result", "transactions")
+		)
+		self.transaction_list = iter(self.stream)
+
+	@property
+	def value(self) -> Dict:
+		return (self.stream.document or {}).get("message", {})
+
+	@property
+	def result(self) -> Dict:
+		return self.value.get("result", {})
+
+	@property
+	def pagination(self) -> Dict:
+		return self.result.get("pagination", {})
+
+	def consume(self) -> None:
+		"""Read the rest of the response, skipping the remaining transactions."""
+		with suppress(Exception):
+			for _transaction in self.transaction_list:
+				pass
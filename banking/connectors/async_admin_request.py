@@ -0,0 +1,98 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import asyncio
+import json
+import time
+from typing import Dict
+
+import httpx
+import requests
+
+from banking.connectors.admin_request import (
+	BACKOFF_FACTOR,
+	MAX_RETRIES,
+	RETRY_STATUS_CODES,
+	AdminRequest,
+	count,
+)
+
+
+class AsyncAdminRequest(AdminRequest):
+	"""
+	Async counterpart of `AdminRequest`, based on an `httpx.AsyncClient`.
+
+	The request methods of `AdminRequest` return awaitables here. The client is
+	created on first use within the running event loop and has to be closed
+	with `aclose()` before the loop ends.
+	"""
+
+	def __init__(self, *args, max_connections: int = 10, **kwargs) -> None:
+		super().__init__(*args, **kwargs)
+		self.max_connections = max_connections
+		self._client = None
+
+	@property
+	def client(self) -> httpx.AsyncClient:
+		if self._client is None:
+			connect_timeout, read_timeout = self.timeout
+			self._client = httpx.AsyncClient(
+				timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+				limits=httpx.Limits(
+					max_connections=self.max_connections,
+					max_keepalive_connections=self.max_connections,
+				),
+			)
+
+		return self._client
+
+	async def aclose(self) -> None:
+		if self._client is not None:
+			await self._client.aclose()
+			self._client = None
+
+	def post(self, method: str, data: Dict, retry: bool = False, stream: bool = False):
+		# Responses are read completely, streaming is only supported by `AdminRequest`
+		return self.send("POST", method, content=json.dumps(data), retry=retry)
+
+	async def send(
+		self, http_method: str, method: str, retry: bool = False, **kwargs
+	) -> httpx.Response:
+		"""Send a request, retrying idempotent fetches like `AdminRequest.send`."""
+		attempts = MAX_RETRIES + 1 if retry else 1
+		for attempt in range(attempts):
+			if attempt:
+				count("retries")
+				await asyncio.sleep(BACKOFF_FACTOR * (2 ** (attempt - 1)))
+
+			start = time.monotonic()
+			try:
+				response = await self.client.request(
+					http_method, self.url + method, headers=self.headers, **kwargs
+				)
+			except httpx.TransportError:
+				count("errors")
+				if attempt == attempts - 1:
+					raise
+				continue
+			finally:
+				request_time = time.monotonic() - start
+				count("requests")
+				count("request_time", request_time)
+				if self.on_request_time:
+					self.on_request_time(request_time)
+
+			if response.status_code in RETRY_STATUS_CODES and attempt < attempts - 1:
+				continue
+
+			return response
+
+
+def raise_for_status(response: httpx.Response) -> None:
+	"""
+	Raise a `requests` HTTPError for an error response, so that the
+	`ExceptionHandler` treats it exactly like a response of `AdminRequest`.
+	"""
+	if response.is_error:
+		raise requests.exceptions.HTTPError(
+			f"{response.status_code} Error for url: {response.url}", response=response
+		)
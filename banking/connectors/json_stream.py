@@ -0,0 +1,175 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import codecs
+import json
+from typing import Dict, Iterable, Iterator, Tuple
+
+WHITESPACE = " \t\n\r"
+DELIMITERS = WHITESPACE + ",]"
+
+
+class JsonArrayStream:
+	"""
+	Incrementally parse a JSON document, yielding the elements of one array.
+
+	Iterating yields the elements of the array at `path` (a tuple of object keys)
+	while the document is read chunk by chunk, so only one element is held in
+	memory at a time. Once exhausted, `document` holds the rest of the parsed
+	document, with an empty list in place of the streamed array.
+
+	E.g. `JsonArrayStream(chunks, ("message", "result", "transactions"))`
+	"""
+
+	def __init__(self, chunks: Iterable[bytes], path: Tuple[str, ...]) -> None:
+		self.chunks = iter(chunks)
+		self.path = tuple(path)
+		self.decoder = json.JSONDecoder()
+		self.utf8 = codecs.getincrementaldecoder("utf-8")()
+		self.buffer = ""
+		self.pos = 0
+		self.eof = False
+		self.skeleton = []  # the document without the streamed array
+		self.stack = []  # per open container: [type, current key, expecting a key]
+		self.document = None
+
+	def __iter__(self) -> Iterator[Dict]:
+		if self.document is not None:
+			return
+
+		found = self.scan_until_array()
+		if found:
+			yield from self.iter_elements()
+			self.scan_until_array()
+
+		self.document = json.loads("".join(self.skeleton))
+
+	def read(self) -> bool:
+		"""Append the next chunk to the buffer. Returns False at the end of the input."""
+		if self.eof:
+			return False
+
+		# Drop what has been parsed already
+		self.buffer = self.buffer[self.pos :]
+		self.pos = 0
+
+		for chunk in self.chunks:
+			if chunk:
+				self.buffer += self.utf8.decode(chunk)
+				return True
+
+		self.buffer += self.utf8.decode(b"", final=True)
+		self.eof = True
+		return False
+
+	def next_char(self):
+		# A chunk may end within a multi-byte character and add nothing to the buffer
+		while self.pos >= len(self.buffer):
+			if not self.read():
+				return None
+
+		char = self.buffer[self.pos]
+		self.pos += 1
+		return char
+
+	def scan_until_array(self) -> bool:
+		"""
+		Copy the document to the skeleton until the array at `path` opens.
+		Returns False if the end of the document was reached instead.
+		"""
+		while (char := self.next_char()) is not None:
+			if char == '"':
+				string = self.scan_string()
+				self.skeleton.append(string)
+
+				top = self.stack[-1] if self.stack else None
+				if top and top[0] == "{" and top[2]:
+					top[1], top[2] = json.loads(string), False
+				continue
+
+			self.skeleton.append(char)
+			if char == "{":
+				self.stack.append(["{", None, True])
+			elif char == "[":
+				if self.is_target():
+					self.skeleton.append("]")
+					return True
+
+				self.stack.append(["[", None, False])
+			elif char in "}]":
+				self.stack.pop()
+			elif char == "," and self.stack and self.stack[-1][0] == "{":
+				self.stack[-1][2] = True
+
+		return False
+
+	def scan_string(self) -> str:
+		"""Return the raw JSON string starting after the opening quote, including quotes."""
+		chars = ['"']
+		while (char := self.next_char()) is not None:
+			chars.append(char)
+			if char == "\\":
+				chars.append(self.next_char() or "")
+			elif char == '"':
+				break
+
+		return "".join(chars)
+
+	def is_target(self) -> bool:
+		return len(self.stack) == len(self.path) and all(
+			container[0] == "{" and container[1] == key
+			for container, key in zip(self.stack, self.path)
+		)
+
+	def iter_elements(self) -> Iterator[Dict]:
+		"""Decode the array elements one by one, reading more input as needed."""
+		while True:
+			char = self.skip(WHITESPACE + ",")
+			if char is None:
+				raise ValueError("Unexpected end of JSON input in streamed array")
+
+			if char == "]":
+				self.pos += 1
+				return
+
+			if char not in '{["':
+				# A number or literal only ends at a delimiter, e.g. "2" may be "2.5"
+				self.read_until_delimiter()
+
+			while True:
+				try:
+					element, end = self.decoder.raw_decode(self.buffer, self.pos)
+				except json.JSONDecodeError:
+					# Element is incomplete, unless there is no more input
+					if self.eof:
+						raise
+
+					self.read()
+					continue
+
+				break
+
+			self.pos = end
+			yield element
+
+	def read_until_delimiter(self) -> None:
+		"""Read until a delimiter follows the current position or the input ends."""
+		scanned = self.pos
+		while not self.eof:
+			if any(char in DELIMITERS for char in self.buffer[scanned:]):
+				return
+
+			# read() drops the parsed input before the current position
+			scanned = len(self.buffer) - self.pos
+			self.read()
+
+	def skip(self, chars: str):
+		"""Skip `chars` and return the next character without consuming it."""
+		while True:
+			while self.pos < len(self.buffer) and self.buffer[self.pos] in chars:
+				self.pos += 1
+
+			if self.pos < len(self.buffer):
+				return self.buffer[self.pos]
+
+			if not self.read():
+				return None
@@ -0,0 +1,107 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import queue
+import threading
+from typing import Any, Callable, Optional
+
+_DONE = object()
+
+
+class PagePrefetcher:
+	"""
+	Iterate over paginated Admin app responses while the next page is fetched
+	in a background thread.
+
+	`fetch_page(cursor)` requests a page and returns it, `next_cursor(page, cursor)`
+	returns the cursor of the following page or `None` if there is none.
+	Only network I/O happens in the background thread. Pages are handed to the
+	caller in order through a bounded queue, so the caller can do the DB work.
+	Pages that were fetched but not consumed when the prefetcher is closed are
+	kept in `unconsumed`, in order, e.g. to persist the tokens they returned.
+
+	Usage:
+		with PagePrefetcher(fetch_page, next_cursor, cursor) as pages:
+			for page in pages:
+				...
+	"""
+
+	def __init__(
+		self,
+		fetch_page: Callable[[Any], Any],
+		next_cursor: Callable[[Any, Any], Optional[Any]],
+		cursor: Any = None,
+		max_prefetch: int = 2,
+	) -> None:
+		self.fetch_page = fetch_page
+		self.next_cursor = next_cursor
+		self.cursor = cursor
+		self.pages = queue.Queue(maxsize=max_prefetch)
+		self.stopped = threading.Event()
+		self.unconsumed = []
+		self.unqueued = _DONE
+		self.thread = threading.Thread(target=self.produce, daemon=True)
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __iter__(self):
+		while True:
+			page = self.pages.get()
+			if page is _DONE:
+				return
+
+			if isinstance(page, BaseException):
+				raise page
+
+			yield page
+
+	def produce(self) -> None:
+		cursor = self.cursor
+		try:
+			while not self.stopped.is_set():
+				page = self.fetch_page(cursor)
+				if not self.put(page):
+					return
+
+				cursor = self.next_cursor(page, cursor)
+				if cursor is None:
+					break
+		except Exception as exc:
+			self.put(exc)
+			return
+
+		self.put(_DONE)
+
+	def put(self, item) -> bool:
+		"""Wait for space in the queue. Returns False if the consumer stopped meanwhile."""
+		while not self.stopped.is_set():
+			try:
+				self.pages.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+
+		self.unqueued = item
+		return False
+
+	def close(self) -> None:
+		"""Stop prefetching, e.g. if the consumer failed on a page."""
+		self.stopped.set()
+		if self.thread.is_alive():
+			self.thread.join()
+
+		items = []
+		while not self.pages.empty():
+			items.append(self.pages.get_nowait())
+
+		items.append(self.unqueued)
+		self.unqueued = _DONE
+		self.unconsumed.extend(
+			item
+			for item in items
+			if not (item is _DONE or isinstance(item, BaseException))
+		)
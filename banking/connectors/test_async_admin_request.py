@@ -0,0 +1,143 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from frappe.tests.utils import FrappeTestCase
+
+from banking.connectors.admin_transaction import AdminTransaction
+from banking.connectors.async_admin_request import AsyncAdminRequest, raise_for_status
+from banking.demo_responses.test_responses import transactions_consent_response
+
+
+class StubAdminHandler(BaseHTTPRequestHandler):
+	"""Answers like the Banking Admin App, failing once per path when asked to."""
+
+	failures = {}
+	requests = []
+
+	def do_POST(self):
+		body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+		self.requests.append((self.path, body))
+
+		method = self.path.rsplit("/", 1)[-1]
+		if self.failures.get(method):
+			self.failures[method] -= 1
+			return self.respond(503, b"Service Unavailable", "text/html")
+
+		if method == "banking_admin.api.fetch_consent_transactions":
+			message = dict(transactions_consent_response, consent_token=f"token-{len(self.requests)}")
+			return self.respond(200, json.dumps({"message": message}).encode())
+
+		self.respond(403, json.dumps({"message": "Forbidden"}).encode())
+
+	def respond(self, status, content, content_type="application/json"):
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def log_message(self, *args):
+		pass
+
+
+class TestAsyncAdminRequest(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubAdminHandler)
+		threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+		cls.url = f"http://127.0.0.1:{cls.server.server_port}/api/method/"
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		super().tearDownClass()
+
+	def setUp(self):
+		StubAdminHandler.failures = {}
+		StubAdminHandler.requests = []
+
+	def get_request(self):
+		return AsyncAdminRequest(
+			ip_address=None,
+			user_agent=None,
+			api_token="xabsttcpQr5",
+			url=self.url,
+			customer_id="ADCB8A",
+			use_test_environment=True,
+			timeout=(1, 5),
+		)
+
+	def test_concurrent_consent_transactions(self):
+		"""Fetch transactions of many accounts at once on one event loop."""
+		admin_request = self.get_request()
+
+		async def fetch_all():
+			try:
+				return await asyncio.gather(
+					*(
+						admin_request.consent_transactions(
+							f"account-{i}", "2024-01-01", "consent", "token"
+						)
+						for i in range(5)
+					)
+				)
+			finally:
+				await admin_request.aclose()
+
+		responses = asyncio.run(fetch_all())
+
+		self.assertEqual(len(StubAdminHandler.requests), 5)
+		for response in responses:
+			raise_for_status(response)
+			transaction = AdminTransaction(response.json()["message"])
+			self.assertEqual(len(transaction.transaction_list), 17)
+
+		account_ids = {body["account_id"] for _path, body in StubAdminHandler.requests}
+		self.assertEqual(account_ids, {f"account-{i}" for i in range(5)})
+
+	def test_retry_idempotent_fetch(self):
+		"""Flow transactions are retried on gateway errors, consent calls are not."""
+		StubAdminHandler.failures = {
+			"banking_admin.api.fetch_flow_transactions": 1,
+			"banking_admin.api.fetch_consent_transactions": 1,
+		}
+		admin_request = self.get_request()
+
+		async def fetch():
+			try:
+				flow = await admin_request.flow_transactions("session", "flow")
+				consent = await admin_request.consent_transactions(
+					"account", "2024-01-01", "consent", "token"
+				)
+				return flow, consent
+			finally:
+				await admin_request.aclose()
+
+		flow_response, consent_response = asyncio.run(fetch())
+
+		# retried once, then answered by the stub
+		self.assertEqual(flow_response.status_code, 403)
+		self.assertEqual(consent_response.status_code, 503)
+		self.assertEqual(len(StubAdminHandler.requests), 3)
+
+	def test_error_response_is_requests_http_error(self):
+		"""Error responses raise the same exception type as `AdminRequest`."""
+		admin_request = self.get_request()
+
+		async def fetch():
+			try:
+				return await admin_request.fetch_subscription()
+			finally:
+				await admin_request.aclose()
+
+		response = asyncio.run(fetch())
+		with self.assertRaises(requests.exceptions.HTTPError) as context:
+			raise_for_status(response)
+
+		self.assertEqual(context.exception.response.json()["message"], "Forbidden")
@@ -0,0 +1,88 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import json
+
+from frappe.tests.utils import FrappeTestCase
+
+from banking.connectors.json_stream import JsonArrayStream
+from banking.demo_responses.test_responses import transactions_consent_response
+
+PATH = ("message", "result", "transactions")
+
+
+def chunked(data: bytes, size: int):
+	return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+class TestJsonArrayStream(FrappeTestCase):
+	def test_transactions_are_streamed(self):
+		document = {"message": transactions_consent_response}
+		expected = json.loads(json.dumps(document))
+		expected["message"]["result"]["transactions"] = []
+
+		for indent in (None, 2):
+			data = json.dumps(document, indent=indent, ensure_ascii=False).encode()
+			for size in (1, 7, 64, len(data)):
+				stream = JsonArrayStream(chunked(data, size), PATH)
+
+				self.assertEqual(list(stream), transactions_consent_response["result"]["transactions"])
+				self.assertEqual(stream.document, expected)
+
+	def test_nested_and_escaped_values(self):
+		document = {
+			"message": {
+				"consent_token": 'to"ken',
+				"other": {"transactions": [1]},
+				"result": {
+					"transactions": [{"reference": "ä [x] {y} \\ ☃", "n": [1.5, None]}, 12345],
+					"pagination": {"next": {"offset": "1"}},
+				},
+			}
+		}
+		stream = JsonArrayStream(chunked(json.dumps(document).encode(), 3), PATH)
+
+		self.assertEqual(list(stream), document["message"]["result"]["transactions"])
+		self.assertEqual(stream.document["message"]["consent_token"], 'to"ken')
+		self.assertEqual(stream.document["message"]["other"], {"transactions": [1]})
+		self.assertEqual(stream.document["message"]["result"]["pagination"]["next"]["offset"], "1")
+
+	def test_scalars_split_across_chunks(self):
+		elements = [2.5, -3e5, 10, True, None]
+		document = {"message": {"result": {"transactions": elements}}}
+		for indent in (None, 2):
+			data = json.dumps(document, indent=indent).encode()
+			stream = JsonArrayStream(chunked(data, 1), PATH)
+
+			self.assertEqual(list(stream), elements)
+
+		# a number at the end of the input
+		data = b'{"message": {"result": {"transactions": [2.5'
+		stream = JsonArrayStream(chunked(data, 1), PATH)
+		with self.assertRaises(ValueError):
+			list(stream)
+
+	def test_multi_byte_characters_split_across_chunks(self):
+		document = {
+			"message": {
+				"consent_token": "Müller ☃",
+				"result": {"transactions": [{"name": "Müller"}], "note": "Grüße"},
+			}
+		}
+		data = json.dumps(document, ensure_ascii=False).encode()
+		stream = JsonArrayStream(chunked(data, 1), PATH)
+
+		self.assertEqual(list(stream), [{"name": "Müller"}])
+		self.assertEqual(stream.document["message"]["consent_token"], "Müller ☃")
+		self.assertEqual(stream.document["message"]["result"]["note"], "Grüße")
+
+	def test_missing_array(self):
+		stream = JsonArrayStream([b'{"message": {"result": {}}}'], PATH)
+
+		self.assertEqual(list(stream), [])
+		self.assertEqual(stream.document, {"message": {"result": {}}})
+
+	def test_truncated_input(self):
+		data = json.dumps({"message": {"result": {"transactions": [{"a": 1}, {"b": 2}]}}})
+
+		with self.assertRaises(ValueError):
+			list(JsonArrayStream([data[:-20].encode()], PATH))
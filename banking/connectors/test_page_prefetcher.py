@@ -0,0 +1,50 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import threading
+
+from frappe.tests.utils import FrappeTestCase
+
+from banking.connectors.page_prefetcher import PagePrefetcher
+
+
+def next_cursor(page, cursor):
+	return cursor + 1 if cursor < 5 else None
+
+
+class TestPagePrefetcher(FrappeTestCase):
+	def test_pages_in_order(self):
+		with PagePrefetcher(lambda cursor: f"page {cursor}", next_cursor, 1) as pages:
+			self.assertEqual(list(pages), [f"page {i}" for i in range(1, 6)])
+
+		self.assertEqual(pages.unconsumed, [])
+
+	def test_unconsumed_pages_are_kept(self):
+		"""Page 1 fails while later pages are prefetched: they are kept in order."""
+		fetched_ahead = threading.Event()
+
+		def fetch_page(cursor):
+			if cursor == 3:
+				fetched_ahead.set()
+			return f"page {cursor}"
+
+		with self.assertRaises(ValueError):
+			with PagePrefetcher(fetch_page, next_cursor, 1, max_prefetch=1) as pages:
+				for page in pages:
+					# page 2 is queued, page 3 is waiting for space in the queue
+					fetched_ahead.wait(timeout=5)
+					raise ValueError(page)
+
+		self.assertEqual(pages.unconsumed, ["page 2", "page 3"])
+
+	def test_fetch_error(self):
+		def fetch_page(cursor):
+			if cursor == 2:
+				raise ConnectionError
+			return f"page {cursor}"
+
+		with self.assertRaises(ConnectionError):
+			with PagePrefetcher(fetch_page, next_cursor, 1) as pages:
+				self.assertEqual(next(iter(pages)), "page 1")
+				list(pages)
+
+		self.assertEqual(pages.unconsumed, [])
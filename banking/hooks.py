@@ -105,19 +105,43 @@ override_doctype_class = {
 
 doc_events = {
 	"Bank Transaction": {
-		"on_update_after_submit": "banking.overrides.bank_transaction.on_update_after_submit",
-	}
+		"on_submit": "banking.reconciliation.counterparty.clear_counterparty",
+		"on_update_after_submit": [
+			"banking.overrides.bank_transaction.on_update_after_submit",
+			"banking.reconciliation.counterparty.clear_counterparty",
+		],
+	},
+	"Bank Account": {
+		"on_update": "banking.reconciliation.counterparty.clear_counterparty_cache",
+		"after_rename": "banking.reconciliation.counterparty.clear_counterparty_cache",
+		"on_trash": [
+			"banking.klarna_kosma_integration.doctype.bank_account_sync_state.bank_account_sync_state.delete_sync_state",
+			"banking.reconciliation.counterparty.clear_counterparty_cache",
+		],
+	},
+	("Sales Invoice", "Purchase Invoice", "Payment Entry", "Journal Entry"): {
+		"on_submit": "banking.reconciliation.reference_index.update_reference_index",
+		"on_cancel": "banking.reconciliation.reference_index.update_reference_index",
+	},
 }
 
 # Scheduled Tasks
 # ---------------
 
 scheduler_events = {
+	"hourly": [
+		"banking.klarna_kosma_integration.doctype.bank_transaction_backfill.bank_transaction_backfill.resume_interrupted_backfills"
+	],
 	"daily": [
 		"banking.klarna_kosma_integration.doctype.banking_settings.banking_settings.sync_all_accounts_and_transactions"
 	],
 }
 
+default_log_clearing_doctypes = {
+	"Bank Sync Run": 90,
+	"Banking Profile Log": 7,
+}
+
 # Testing
 # -------
 
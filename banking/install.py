@@ -3,12 +3,21 @@ import frappe
 from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
 from frappe.custom.doctype.property_setter.property_setter import make_property_setter
 
+from banking.patches.add_bank_transaction_id_index import (
+	execute as add_bank_transaction_id_index,
+)
+from banking.patches.add_reconciliation_indexes import (
+	execute as add_reconciliation_indexes,
+)
+
 
 def after_install():
 	click.echo("Installing Banking Customizations ...")
 
 	create_custom_fields(frappe.get_hooks("kosma_custom_fields"))
 	make_property_setters()
+	add_bank_transaction_id_index()
+	add_reconciliation_indexes()
 
 
 def make_property_setters():
@@ -1,16 +1,29 @@
 # Copyright (c) 2023, ALYF GmbH and contributors
 # For license information, please see license.txt
-from typing import Dict, Optional
+import time
+from contextlib import closing
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 
 import frappe
+from frappe.utils import flt
 
-from banking.connectors.admin_request import AdminRequest
-from banking.connectors.admin_transaction import AdminTransaction
+from banking.connectors.admin_request import DEFAULT_TIMEOUT, AdminRequest
+from banking.connectors.admin_transaction import AdminTransaction, StreamedAdminTransaction
+from banking.connectors.page_prefetcher import PagePrefetcher
+from banking.klarna_kosma_integration.doctype.bank_account_sync_state.bank_account_sync_state import (
+	get_sync_state,
+)
+from banking.klarna_kosma_integration.doctype.bank_sync_run.bank_sync_run import new_sync_run
+from banking.klarna_kosma_integration.doctype.banking_profile_log.banking_profile_log import (
+	get_http_timer,
+	profile,
+)
 from banking.klarna_kosma_integration.exception_handler import ExceptionHandler
 from banking.klarna_kosma_integration.utils import (
-	account_last_sync_date,
 	add_bank,
 	create_bank_transactions,
+	create_bank_transactions_in_chunks,
 	create_session_doc,
 	exchange_consent_token,
 	get_account_data_for_request,
@@ -19,11 +32,17 @@ from banking.klarna_kosma_integration.utils import (
 	get_country_code,
 	get_current_ip,
 	get_from_to_date,
+	get_known_transaction_ids,
 	get_session_flow_ids,
+	get_sync_start,
+	is_json_response,
 	set_session_state,
 	to_json,
 )
 
+if TYPE_CHECKING:
+	from frappe.model.document import Document
+
 
 class Admin:
 	"""A class that directly communicates with the Banking Admin App."""
@@ -37,8 +56,15 @@ class Admin:
 		self.api_token = settings.get_password("api_token")
 		self.customer_id = settings.customer_id
 		self.url = settings.admin_endpoint + "/api/method/"
+		self.timeout = (
+			flt(settings.connect_timeout) or DEFAULT_TIMEOUT[0],
+			flt(settings.read_timeout) or DEFAULT_TIMEOUT[1],
+		)
+		self.stream_pages = settings.stream_transaction_pages
+		# requests may be sent from background threads, which can't see the profiler
+		self.on_request_time = get_http_timer()
 
-	@property
+	@cached_property
 	def request(self):
 		return AdminRequest(
 			ip_address=self.ip_address,
@@ -47,6 +73,8 @@ class Admin:
 			url=self.url,
 			customer_id=self.customer_id,
 			use_test_environment=self.use_test_environment,
+			timeout=self.timeout,
+			on_request_time=self.on_request_time,
 		)
 
 	def get_client_token(
@@ -110,69 +138,292 @@ class Admin:
 			set_session_state(session_id_short, accounts_response)
 
 	def flow_transactions(self, account: str, session_id_short: str):
-		next_page, url, offset, transactions_value = True, None, None, None
+		transactions_value = None
+		sync_run = new_sync_run("Flow API", account)
 		try:
 			session_id, flow_id = get_session_flow_ids(session_id_short)
-			while next_page:
+			known_ids = get_known_transaction_ids(
+				account, get_consent_start_date(session_id_short)
+			)
+
+			if self.stream_pages:
+				# Pages are parsed while they are downloaded, so they can't be prefetched
+				url = offset = None
+				while True:
+					response = self.request.flow_transactions(
+						session_id, flow_id, url, offset, stream=True
+					)
+					transaction, stats = self.process_streamed_page(
+						response, account, known_ids, via_flow_api=True
+					)
+					sync_run.add_page(stats, response.elapsed.total_seconds())
+					transactions_value = transaction.value
+					if not transaction.is_next_page():
+						break
+
+					url, offset = transaction.next_page_request()
+
+				sync_run.finish()
+				return
+
+			def fetch_page(cursor):
+				start = time.monotonic()
+				url, offset = cursor
+				response = self.request.flow_transactions(session_id, flow_id, url, offset)
+				transactions_value = response.json().get("message", {}) if response.ok else {}
+				return response, transactions_value, time.monotonic() - start
+
+			def next_cursor(page, cursor):
+				response, transactions_value, _http_time = page
+				transaction = AdminTransaction(transactions_value)
+				if not (response.ok and transaction.is_next_page()):
+					return None
+
+				return transaction.next_page_request()
+
+			# The next page is fetched in the background while the current one is inserted
+			with PagePrefetcher(fetch_page, next_cursor, (None, None)) as pages:
+				for response, transactions_value, http_time in pages:
+					response.raise_for_status()
+
+					# Process Request Response
+					transaction = AdminTransaction(transactions_value)
+					stats = None
+					if transaction.transaction_list:
+						stats = create_bank_transactions(
+							account, transaction.transaction_list, via_flow_api=True, known_ids=known_ids
+						)
+
+					sync_run.add_page(stats, http_time)
+
+			sync_run.finish()
+		except Exception as exc:
+			frappe.db.rollback()
+			sync_run.finish("Failed", str(exc))
+			ExceptionHandler(exc)
+		finally:
+			set_session_state(session_id_short, transactions_value)
+
+	def backfill_transactions(self, backfill: "Document"):
+		"""
+		Fetch and insert the Flow API transactions of a Bank Transaction Backfill.
+
+		Every page is committed along with a checkpoint of the next page, so an
+		interrupted backfill resumes there. Transactions that fail to insert
+		are logged and skipped.
+		"""
+		transactions_value = None
+		sync_run = new_sync_run("Backfill", backfill.bank_account)
+		try:
+			session_id, flow_id = get_session_flow_ids(backfill.session_id_short)
+			known_ids = get_known_transaction_ids(
+				backfill.bank_account, get_consent_start_date(backfill.session_id_short)
+			)
+			backfill.start()
+
+			url, offset = backfill.next_url, backfill.next_offset
+			while True:
+				start = time.monotonic()
 				response = self.request.flow_transactions(session_id, flow_id, url, offset)
 				response.raise_for_status()
 				transactions_value = response.json().get("message", {})
+				http_time = time.monotonic() - start
 
-				# Process Request Response
 				transaction = AdminTransaction(transactions_value)
-				next_page = transaction.is_next_page()
-				if next_page:
-					url, offset = transaction.next_page_request()
-
+				stats = None
 				if transaction.transaction_list:
-					create_bank_transactions(account, transaction.transaction_list, via_flow_api=True)
+					stats = create_bank_transactions(
+						backfill.bank_account,
+						transaction.transaction_list,
+						via_flow_api=True,
+						known_ids=known_ids,
+						skip_failed=True,
+					)
+
+				sync_run.add_page(stats, http_time)
+				next_page = transaction.next_page_request() if transaction.is_next_page() else None
+				backfill.checkpoint(stats, next_page)
+				if not next_page:
+					break
+
+				url, offset = next_page
+
+			sync_run.finish()
 		except Exception as exc:
+			frappe.db.rollback()
+			backfill.fail(str(exc))
+			sync_run.finish("Failed", str(exc))
 			ExceptionHandler(exc)
 		finally:
-			set_session_state(session_id_short, transactions_value)
+			set_session_state(backfill.session_id_short, transactions_value)
 
 	def consent_accounts(self, bank: str, company: str):
 		try:
 			consent_id, consent_token = get_consent_data(bank, company)
 
 			accounts_response = self.request.consent_accounts(consent_id, consent_token)
-			accounts_response_value = to_json(accounts_response).get("message", {})
-
-			exchange_consent_token(accounts_response_value, bank, company)
-			accounts_response.raise_for_status()
-
-			return accounts_response_value.get("result", {}).get("accounts", [])
+			return self.process_consent_accounts(accounts_response, bank, company)
 		except Exception as exc:
 			ExceptionHandler(exc)
 
-	def consent_transactions(self, account: str, start_date: str):
-		next_page, url, offset = True, None, None
+	def process_consent_accounts(
+		self, accounts_response, bank: str, company: str, sync_run: Optional["Document"] = None
+	) -> list:
+		"""Store the exchanged consent token and return the accounts of a consent."""
+		accounts_response_value = to_json(accounts_response).get("message", {})
+
+		token_exchanged = exchange_consent_token(accounts_response_value, bank, company)
+		if sync_run:
+			sync_run.add_page(
+				http_time=accounts_response.elapsed.total_seconds(),
+				token_exchanged=bool(token_exchanged),
+			)
+
+		accounts_response.raise_for_status()
+
+		return accounts_response_value.get("result", {}).get("accounts", [])
+
+	def consent_transactions(
+		self,
+		account: str,
+		start_date: str,
+		url: Optional[str] = None,
+		offset: Optional[str] = None,
+	):
+		"""
+		Fetch and insert the transactions of an Account since `start_date`.
+		Pass `url` and `offset` of a page to resume an interrupted sync there.
+
+		The Account's sync state is committed after every page, so that a later
+		sync can resume from the next page if this one is interrupted.
+		"""
+		sync_state = get_sync_state(account)
+		sync_run = new_sync_run("Consent API", account)
+		resumed = bool(url)
+		prefetcher = None
 		try:
 			account_id, bank, company = frappe.db.get_value(
 				"Bank Account", account, ["kosma_account_id", "bank", "company"]
 			)
 			consent_id, consent_token = get_consent_data(bank, company)
-			while next_page:
+			known_ids = get_known_transaction_ids(account, start_date)
+			sync_state.start(start_date, url, offset)
+
+			if self.stream_pages:
+				# Pages are parsed while they are downloaded, so they can't be prefetched
+				while True:
+					response = self.request.consent_transactions(
+						account_id, start_date, consent_id, consent_token, url, offset, stream=True
+					)
+					transaction, stats = self.process_streamed_page(
+						response, account, known_ids, bank=bank, company=company
+					)
+					# Every response may exchange the consent token for the next request
+					new_consent_token = transaction.value.get("consent_token")
+					consent_token = new_consent_token or consent_token
+					sync_run.add_page(stats, response.elapsed.total_seconds(), bool(new_consent_token))
+
+					next_page = transaction.next_page_request() if transaction.is_next_page() else None
+					sync_state.update_progress(stats, next_page)
+					if not next_page:
+						break
+
+					url, offset = next_page
+
+				sync_run.finish()
+				return
+
+			def fetch_page(cursor):
+				start = time.monotonic()
+				url, offset, consent_token = cursor
 				response = self.request.consent_transactions(
 					account_id, start_date, consent_id, consent_token, url, offset
 				)
-				transactions_value = to_json(response).get("message", {})
+				return response, to_json(response).get("message", {}), time.monotonic() - start
 
-				new_consent_token = exchange_consent_token(transactions_value, bank, company)
-				response.raise_for_status()
-
-				# Process Request Response
+			def next_cursor(page, cursor):
+				response, transactions_value, _http_time = page
 				transaction = AdminTransaction(transactions_value)
-				next_page = transaction.is_next_page()
-				if next_page:
-					url, offset = transaction.next_page_request()
-					consent_token = new_consent_token
+				if not (response.ok and transaction.is_next_page()):
+					return None
 
-				if transaction.transaction_list:
-					create_bank_transactions(account, transaction.transaction_list)
+				# Every response may exchange the consent token for the next request
+				url, offset = transaction.next_page_request()
+				return url, offset, transactions_value.get("consent_token") or cursor[2]
+
+			# The next page is fetched in the background while the current one is inserted.
+			# New consent tokens are persisted here, in order, before the page is processed.
+			prefetcher = PagePrefetcher(
+				fetch_page, next_cursor, (url, offset, consent_token)
+			)
+			with prefetcher as pages:
+				for response, transactions_value, http_time in pages:
+					token_exchanged = exchange_consent_token(transactions_value, bank, company)
+					response.raise_for_status()
+
+					# Process Request Response
+					transaction = AdminTransaction(transactions_value)
+					stats = None
+					if transaction.transaction_list:
+						stats = create_bank_transactions(
+							account, transaction.transaction_list, known_ids=known_ids
+						)
+
+					sync_run.add_page(stats, http_time, bool(token_exchanged))
+					sync_state.update_progress(
+						stats, transaction.next_page_request() if transaction.is_next_page() else None
+					)
+
+			sync_run.finish()
 		except Exception as exc:
+			# Keep the inserted pages, drop the failed one
+			frappe.db.rollback()
+			if prefetcher:
+				# Pages fetched in advance have exchanged the consent token as well
+				for _response, transactions_value, _http_time in prefetcher.unconsumed:
+					exchange_consent_token(transactions_value, bank, company)
+
+			sync_state.fail(resumed=resumed)
+			sync_run.finish("Failed", str(exc))
 			ExceptionHandler(exc)
 
+	def process_streamed_page(
+		self,
+		response,
+		account: str,
+		known_ids: Set[str],
+		bank: Optional[str] = None,
+		company: Optional[str] = None,
+		via_flow_api: bool = False,
+	) -> Tuple[AdminTransaction, Optional[Dict]]:
+		"""
+		Insert the transactions of a streamed response while it is downloaded.
+		Returns the page and the insert statistics.
+
+		The consent token (if `bank` and `company` are passed) is only known once
+		the whole response is read, so the rest of the response is read and the
+		token is exchanged even if inserting the transactions fails.
+		"""
+		with closing(response):
+			if not (response.ok and is_json_response(response)):
+				transactions_value = to_json(response).get("message", {})
+				if bank:
+					exchange_consent_token(transactions_value, bank, company)
+				response.raise_for_status()
+				return AdminTransaction(transactions_value), None
+
+			transaction = StreamedAdminTransaction(response)
+			try:
+				stats = create_bank_transactions_in_chunks(
+					account, transaction.transaction_list, via_flow_api=via_flow_api, known_ids=known_ids
+				)
+			finally:
+				transaction.consume()
+				if bank:
+					exchange_consent_token(transaction.value, bank, company)
+
+		return transaction, stats
+
 	def end_session(self, session_id: str, session_id_short: str) -> None:
 		self.request.end_session(session_id)
 		frappe.db.set_value("Klarna Kosma Session", session_id_short, "status", "Closed")
@@ -218,10 +469,26 @@ class Admin:
 
 
 @frappe.whitelist()
+@profile
 def sync_kosma_transactions(account: str, session_id_short: Optional[str] = None):
 	"""Fetch and insert paginated Kosma transactions"""
 	if session_id_short:
 		Admin().flow_transactions(account, session_id_short)
 	else:
-		start_date = account_last_sync_date(account)
-		Admin().consent_transactions(account, start_date)
+		Admin().consent_transactions(account, *get_sync_start(account))
+
+
+def sync_kosma_consent_transactions(accounts: List[str]):
+	"""
+	Fetch and insert Kosma transactions for Bank Accounts that share a consent.
+
+	The accounts are synced one after another, as each request exchanges the
+	consent token. A failing account does not stop the sync of the others.
+	"""
+	for account in accounts:
+		try:
+			sync_kosma_transactions(account)
+			frappe.db.commit()
+		except Exception:
+			# already logged by the ExceptionHandler
+			frappe.db.rollback()
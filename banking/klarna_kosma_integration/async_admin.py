@@ -0,0 +1,253 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import asyncio
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import suppress
+from functools import cached_property
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import frappe
+
+from banking.connectors.admin_transaction import AdminTransaction
+from banking.connectors.async_admin_request import AsyncAdminRequest, raise_for_status
+from banking.klarna_kosma_integration.admin import Admin
+from banking.klarna_kosma_integration.doctype.bank_account_sync_state.bank_account_sync_state import (
+	get_sync_state,
+)
+from banking.klarna_kosma_integration.doctype.bank_sync_run.bank_sync_run import new_sync_run
+from banking.klarna_kosma_integration.exception_handler import ExceptionHandler
+from banking.klarna_kosma_integration.utils import (
+	create_bank_transactions,
+	exchange_consent_token,
+	get_consent_data,
+	get_known_transaction_ids,
+	get_sync_start,
+	to_json,
+)
+
+Consent = Tuple[str, str]  # (bank, company)
+Job = Callable[[Callable[[object], Awaitable]], Awaitable]
+
+_DONE = object()
+
+
+class SyncStopped(Exception):
+	pass
+
+
+class AsyncAdmin(Admin):
+	"""
+	Communicates with the Banking Admin App for many accounts at once.
+
+	Requests run concurrently on one event loop in a background thread, which
+	does no database access. Results are handed to the calling thread in the
+	order they arrive and are written to the database synchronously there.
+	"""
+
+	def __init__(self, max_concurrency: int = 8) -> None:
+		super().__init__()
+		self.max_concurrency = max(max_concurrency, 1)
+
+	@cached_property
+	def async_request(self) -> AsyncAdminRequest:
+		return AsyncAdminRequest(
+			ip_address=self.ip_address,
+			user_agent=self.user_agent,
+			api_token=self.api_token,
+			url=self.url,
+			customer_id=self.customer_id,
+			use_test_environment=self.use_test_environment,
+			timeout=self.timeout,
+			max_connections=self.max_concurrency,
+			on_request_time=self.on_request_time,
+		)
+
+	def run(self, jobs: Iterable[Job]) -> Iterator:
+		"""
+		Run `jobs` concurrently on an event loop in a background thread.
+
+		Each job is a coroutine function that receives an async `emit` callback.
+		Everything emitted is yielded here, in the calling thread. The queue in
+		between is bounded, so fetching pauses while the DB writer is behind.
+		"""
+		results = queue.Queue(maxsize=self.max_concurrency * 2)
+		stopped = threading.Event()
+
+		async def emit(item) -> None:
+			if stopped.is_set():
+				raise SyncStopped
+
+			await asyncio.to_thread(results.put, item)
+
+		async def main() -> None:
+			semaphore = asyncio.Semaphore(self.max_concurrency)
+
+			async def guarded(job: Job) -> None:
+				async with semaphore:
+					with suppress(SyncStopped):
+						await job(emit)
+
+			try:
+				await asyncio.gather(*(guarded(job) for job in jobs))
+			finally:
+				await self.async_request.aclose()
+				results.put(_DONE)
+
+		thread = threading.Thread(target=asyncio.run, args=(main(),), daemon=True)
+		thread.start()
+		try:
+			while (item := results.get()) is not _DONE:
+				yield item
+		finally:
+			# Unblock and stop the jobs if the caller gave up early
+			stopped.set()
+			while thread.is_alive():
+				with suppress(queue.Empty):
+					results.get(timeout=0.1)
+
+	def consent_accounts_many(self, consents: List[Consent]) -> Dict[Consent, list]:
+		"""Fetch the accounts of many Bank Consents concurrently."""
+		consent_data = {consent: get_consent_data(*consent) for consent in consents}
+
+		def make_job(consent: Consent) -> Job:
+			async def job(emit) -> None:
+				try:
+					response = await self.async_request.consent_accounts(*consent_data[consent])
+				except Exception as exc:
+					response = exc
+
+				await emit((consent, response))
+
+			return job
+
+		accounts = {}
+		for consent, response in self.run(make_job(consent) for consent in consents):
+			try:
+				if isinstance(response, Exception):
+					raise response
+
+				accounts_response_value = to_json(response).get("message", {})
+				exchange_consent_token(accounts_response_value, *consent)
+				raise_for_status(response)
+
+				accounts[consent] = accounts_response_value.get("result", {}).get("accounts", [])
+			except Exception as exc:
+				accounts[consent] = []
+				with suppress(Exception):  # logged by the ExceptionHandler
+					ExceptionHandler(exc)
+
+		return accounts
+
+	def consent_transactions_many(self, accounts: List[str]) -> Dict[str, Optional[str]]:
+		"""
+		Fetch and insert Consent API transactions of many Bank Accounts concurrently.
+
+		Accounts that share a consent are fetched one after another, since every
+		request exchanges the consent token. Returns the error per account, if any.
+		"""
+		groups = defaultdict(list)
+		for account in accounts:
+			account_id, bank, company = frappe.db.get_value(
+				"Bank Account", account, ["kosma_account_id", "bank", "company"]
+			)
+			start_date, url, offset = get_sync_start(account)
+			sync_state = get_sync_state(account)
+			sync_state.start(start_date, url, offset)
+			groups[(bank, company)].append(
+				frappe._dict(
+					account=account,
+					account_id=account_id,
+					start_date=start_date,
+					url=url,
+					offset=offset,
+					sync_state=sync_state,
+					sync_run=new_sync_run("Consent API", account),
+					known_ids=get_known_transaction_ids(account, start_date),
+				)
+			)
+
+		errors = {}
+		jobs = []
+		for consent, rows in groups.items():
+			try:
+				jobs.append(self.get_transactions_job(consent, rows, *get_consent_data(*consent)))
+			except Exception as exc:
+				for row in rows:
+					errors[row.account] = str(exc)
+					row.sync_state.fail(resumed=bool(row.url))
+					row.sync_run.finish("Failed", str(exc))
+
+		for consent, row, response, transactions_value, http_time in self.run(jobs):
+			# Persist every exchanged token, the job already uses it for the next request
+			token_exchanged = exchange_consent_token(transactions_value, *consent)
+			if row.account in errors:
+				continue
+
+			try:
+				if isinstance(response, Exception):
+					raise response
+
+				raise_for_status(response)
+
+				transaction = AdminTransaction(transactions_value)
+				stats = None
+				if transaction.transaction_list:
+					stats = create_bank_transactions(
+						row.account, transaction.transaction_list, known_ids=row.known_ids
+					)
+
+				row.sync_run.add_page(stats, http_time, bool(token_exchanged))
+				next_page = transaction.next_page_request() if transaction.is_next_page() else None
+				# commits the page
+				row.sync_state.update_progress(stats, next_page)
+				if not next_page:
+					row.sync_run.finish()
+			except Exception as exc:
+				frappe.db.rollback()
+				errors[row.account] = str(exc)
+				row.sync_state.fail(resumed=bool(row.url))
+				row.sync_run.finish("Failed", str(exc))
+				with suppress(Exception):  # logged by the ExceptionHandler
+					ExceptionHandler(exc)
+
+		return {account: errors.get(account) for account in accounts}
+
+	def get_transactions_job(
+		self, consent: Consent, rows: List[Dict], consent_id: str, consent_token: str
+	) -> Job:
+		async def job(emit) -> None:
+			token = consent_token
+			for row in rows:
+				url, offset = row.url, row.offset
+				while True:
+					start = time.monotonic()
+					try:
+						response = await self.async_request.consent_transactions(
+							row.account_id, row.start_date, consent_id, token, url, offset
+						)
+						transactions_value = to_json(response).get("message", {})
+					except Exception as exc:
+						await emit((consent, row, exc, None, time.monotonic() - start))
+						break
+
+					await emit((consent, row, response, transactions_value, time.monotonic() - start))
+
+					if isinstance(transactions_value, dict):
+						token = transactions_value.get("consent_token") or token
+
+					transaction = AdminTransaction(transactions_value)
+					if response.is_error or not transaction.is_next_page():
+						break
+
+					url, offset = transaction.next_page_request()
+
+		return job
+
+
+def sync_kosma_transactions_async(accounts: List[str], max_concurrency: int = 8):
+	"""Fetch and insert Kosma transactions of many Bank Accounts on one event loop."""
+	errors = AsyncAdmin(max_concurrency).consent_transactions_many(accounts)
+	return {account: error for account, error in errors.items() if error}
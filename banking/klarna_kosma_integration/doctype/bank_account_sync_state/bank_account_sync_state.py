@@ -0,0 +1,72 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+from typing import Dict, Optional, Tuple
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import getdate, now_datetime
+
+
+class BankAccountSyncState(Document):
+	def get_cursor(self) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+		"""Return `(start_date, url, offset)` of a sync that did not complete, if any."""
+		if not self.cursor_start_date:
+			return None
+
+		return str(self.cursor_start_date), self.cursor_url, self.cursor_offset
+
+	def start(self, start_date: str, url: Optional[str] = None, offset: Optional[str] = None):
+		self.status = "In Progress"
+		self.cursor_start_date = start_date
+		self.cursor_url = url
+		self.cursor_offset = offset
+		self.save_state()
+
+	def update_progress(self, stats: Optional[Dict], next_page: Optional[Tuple[str, str]]):
+		"""
+		Record a processed page: move the watermark to the newest inserted
+		transaction and the cursor to the next page. Without a next page,
+		the sync is complete and the cursor is cleared.
+		"""
+		if stats and stats.get("last_value_date"):
+			value_date = getdate(stats.last_value_date)
+			if not self.last_value_date or value_date >= getdate(self.last_value_date):
+				self.last_value_date = value_date
+				self.last_transaction_id = stats.last_transaction_id
+
+		if next_page:
+			self.cursor_url, self.cursor_offset = next_page
+		else:
+			self.status = "Completed"
+			self.cursor_start_date = self.cursor_url = self.cursor_offset = None
+
+		self.last_synced_on = now_datetime()
+		self.save_state()
+
+	def fail(self, resumed: bool = False):
+		"""
+		Mark the sync as failed. The next sync resumes from the cursor. If this
+		sync already was a resumed one, the cursor might be the problem, so the
+		next sync restarts from the start date instead.
+		"""
+		self.status = "Failed"
+		if resumed:
+			self.cursor_url = self.cursor_offset = None
+
+		self.save_state()
+
+	def save_state(self):
+		self.save(ignore_permissions=True)
+		frappe.db.commit()
+
+
+def get_sync_state(bank_account: str) -> BankAccountSyncState:
+	if frappe.db.exists("Bank Account Sync State", bank_account):
+		return frappe.get_doc("Bank Account Sync State", bank_account)
+
+	return frappe.get_doc({"doctype": "Bank Account Sync State", "bank_account": bank_account})
+
+
+def delete_sync_state(doc, method=None):
+	"""Delete the sync state along with its Bank Account."""
+	frappe.db.delete("Bank Account Sync State", {"bank_account": doc.name})
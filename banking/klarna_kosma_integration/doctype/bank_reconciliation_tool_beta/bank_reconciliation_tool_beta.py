@@ -2,21 +2,43 @@
 # For license information, please see license.txt
 import json
 import datetime
+from collections import defaultdict
 from typing import Union
 
 import frappe
+import numpy as np
 from frappe import _
 from frappe.model.document import Document
+from frappe.query_builder import Criterion, Field
 from frappe.query_builder.custom import ConstantColumn
-from frappe.query_builder.functions import Coalesce
+from frappe.query_builder.functions import Coalesce, Count, Locate, Trim
 from frappe.utils import cint, flt, sbool
+from pypika.queries import QueryBuilder
+from pypika.terms import NullValue, ValueWrapper
 
-from erpnext import get_company_currency, get_default_cost_center
-from erpnext.accounts.doctype.bank_transaction.bank_transaction import (
-	BankTransaction,
-	get_total_allocated_amount,
+from erpnext.accounts.doctype.bank_transaction.bank_transaction import BankTransaction
+
+from banking.klarna_kosma_integration.doctype.banking_profile_log.banking_profile_log import (
+	profile,
+)
+from banking.reconciliation.counterparty import set_counterparty_party
+from banking.reconciliation.master_data import (
+	get_account_currency,
+	get_account_details,
+	get_bank_account_details,
+	get_company_currency,
+	get_default_cost_center,
+	get_gl_account,
 )
-from erpnext.accounts.utils import get_account_currency
+from banking.reconciliation.matching_engine import MatchingEngine, get_allocated_amounts
+from banking.reconciliation.reference_index import find_references, is_in_description
+from banking.reconciliation.scoring import sort_by_score
+from banking.reconciliation.subset_sum import SubsetSumSolver
+from banking.reconciliation.tolerance import amount_in_range, date_in_range, get_tolerances
+from banking.reconciliation.window_matcher import MAX_WINDOW_DAYS, find_windows
+
+
+RECONCILE_CHUNK_SIZE = 50  # transactions per commit in `bulk_reconcile_transactions`
 
 
 class BankReconciliationToolBeta(Document):
@@ -24,6 +46,7 @@ class BankReconciliationToolBeta(Document):
 
 
 @frappe.whitelist()
+@profile
 def get_bank_transactions(
 	bank_account: str,
 	from_date: str | datetime.date = None,
@@ -65,6 +88,7 @@ def get_bank_transactions(
 
 
 @frappe.whitelist()
+@profile
 def create_journal_entry_bts(
 	bank_transaction_name: str,
 	reference_number: str = None,
@@ -96,16 +120,12 @@ def create_journal_entry_bts(
 		bank_transaction.unallocated_amount if bank_transaction.withdrawal > 0.0 else 0.0
 	)
 
-	company_account = frappe.get_value(
-		"Bank Account", bank_transaction.bank_account, "account"
-	)
-	company, company_currency = frappe.get_value(
-		"Account", company_account, ["company", "account_currency"]
-	)
+	company_account = get_gl_account(bank_transaction.bank_account)
+	company = get_account_details(company_account).company
+	company_currency = get_account_details(company_account).account_currency
 
-	second_account_type, second_account_currency = frappe.db.get_value(
-		"Account", second_account, ["account_type", "account_currency"]
-	)
+	second_account_type = get_account_details(second_account).account_type
+	second_account_currency = get_account_details(second_account).account_currency
 	if second_account_type in ["Receivable", "Payable"] and not (party_type and party):
 		frappe.throw(
 			_("Party Type and Party is required for Receivable / Payable account {0}").format(
@@ -167,6 +187,7 @@ def create_journal_entry_bts(
 
 
 @frappe.whitelist()
+@profile
 def create_payment_entry_bts(
 	bank_transaction_name: str,
 	reference_number: str = None,
@@ -192,10 +213,8 @@ def create_payment_entry_bts(
 	paid_amount = bank_transaction.unallocated_amount
 	payment_type = "Receive" if bank_transaction.deposit > 0.0 else "Pay"
 
-	company_account = frappe.get_value(
-		"Bank Account", bank_transaction.bank_account, "account"
-	)
-	company = frappe.get_value("Account", company_account, "company")
+	company_account = get_gl_account(bank_transaction.bank_account)
+	company = get_account_details(company_account).company
 	payment_entry_dict = {
 		"company": company,
 		"payment_type": payment_type,
@@ -236,6 +255,7 @@ def create_payment_entry_bts(
 
 
 @frappe.whitelist()
+@profile
 def bulk_reconcile_vouchers(
 	bank_transaction_name: str,
 	vouchers: str | list[dict],
@@ -250,10 +270,73 @@ def bulk_reconcile_vouchers(
 	if isinstance(vouchers, str):
 		vouchers = json.loads(vouchers)
 
-	reconcile_multi_party = sbool(reconcile_multi_party)
-
 	transaction = frappe.get_doc("Bank Transaction", bank_transaction_name)
-	transaction.add_payment_entries(vouchers, reconcile_multi_party)
+	return reconcile_transaction(transaction, vouchers, sbool(reconcile_multi_party))
+
+
+@frappe.whitelist()
+@profile
+def bulk_reconcile_transactions(transactions: str | list[dict]) -> list[dict]:
+	"""
+	Reconcile many bank transactions with their vouchers in one call.
+
+	:param transactions: JSON string of transactions to reconcile
+	structure: List(Dict(bank_transaction_name, vouchers, reconcile_multi_party)),
+	with `vouchers` as in `bulk_reconcile_vouchers`
+
+	Each transaction is reconciled on its own: if it fails, only its changes are
+	rolled back. Changes are committed every `RECONCILE_CHUNK_SIZE` transactions.
+	Returns the status, unallocated amount or error per transaction, in order.
+	"""
+	if isinstance(transactions, str):
+		transactions = json.loads(transactions)
+
+	open_transactions = get_open_transactions(
+		[row["bank_transaction_name"] for row in transactions]
+	)
+	results = []
+	for i, row in enumerate(transactions, start=1):
+		name = row["bank_transaction_name"]
+		result = frappe._dict(bank_transaction_name=name)
+		if name not in open_transactions:
+			result.status = "Skipped"
+			result.error = _(
+				"Bank Transaction {0} is not submitted or already reconciled"
+			).format(name)
+		else:
+			frappe.db.savepoint("bulk_reconcile_transaction")
+			try:
+				transaction = reconcile_transaction(
+					frappe.get_doc("Bank Transaction", name),
+					row["vouchers"],
+					sbool(row.get("reconcile_multi_party")),
+				)
+			except Exception as e:
+				frappe.db.rollback(save_point="bulk_reconcile_transaction")
+				frappe.clear_last_message()
+				result.status = "Failed"
+				result.error = str(e)
+			else:
+				result.status = transaction.status
+				result.unallocated_amount = transaction.unallocated_amount
+				if transaction.unallocated_amount <= 0:
+					# later rows for the same transaction are skipped
+					open_transactions.discard(name)
+
+		results.append(result)
+		if i % RECONCILE_CHUNK_SIZE == 0:
+			frappe.db.commit()
+
+	return results
+
+
+def reconcile_transaction(
+	transaction: "BankTransaction",
+	vouchers: list[dict],
+	reconcile_multi_party: bool = False,
+) -> "BankTransaction":
+	"""Add `vouchers` to `transaction`, allocate them and save the transaction once."""
+	transaction.add_payment_entries(vouchers, reconcile_multi_party, save=False)
 	transaction.validate_duplicate_references()
 	transaction.allocate_payment_entries()
 	transaction.update_allocated_amount()
@@ -263,7 +346,26 @@ def bulk_reconcile_vouchers(
 	return transaction
 
 
+def get_open_transactions(names: list[str]) -> set[str]:
+	"""Return which of the Bank Transactions `names` are submitted and unallocated."""
+	if not names:
+		return set()
+
+	return set(
+		frappe.get_all(
+			"Bank Transaction",
+			filters={
+				"name": ("in", names),
+				"docstatus": 1,
+				"unallocated_amount": (">", 0.0),
+			},
+			pluck="name",
+		)
+	)
+
+
 @frappe.whitelist()
+@profile
 def reconcile_voucher(
 	transaction_name: str, amount: float, voucher_type: str, voucher_name: str
 ) -> Union[dict, "BankTransaction"]:
@@ -290,6 +392,7 @@ def reconcile_voucher(
 
 
 @frappe.whitelist()
+@profile
 def upload_bank_statement(**args):
 	args = frappe._dict(args)
 	bsi = frappe.new_doc("Bank Statement Import")
@@ -309,6 +412,7 @@ def upload_bank_statement(**args):
 
 
 @frappe.whitelist()
+@profile
 def auto_reconcile_vouchers(
 	bank_account: str,
 	from_date: str | datetime.date = None,
@@ -322,33 +426,38 @@ def auto_reconcile_vouchers(
 	reconciled, partially_reconciled = set(), set()
 
 	bank_transactions = get_bank_transactions(bank_account, from_date, to_date)
-	for transaction in bank_transactions:
-		linked_payments = get_linked_payments(
-			transaction.name,
-			["payment_entry", "journal_entry"],
+	if has_other_matching_queries():
+		# other apps add vouchers to match against, the engine does not know them
+		match = get_auto_reconcile_matches(
+			from_date, to_date, filter_by_reference_date, from_reference_date, to_reference_date
+		)
+		refresh_allocations = None
+	else:
+		gl_account, company = get_bank_account_details(bank_account)
+		engine = MatchingEngine(
+			gl_account,
+			company,
 			from_date,
 			to_date,
-			filter_by_reference_date,
+			sbool(filter_by_reference_date),
 			from_reference_date,
 			to_reference_date,
 		)
+		engine.load(bank_transactions)
+		match, refresh_allocations = engine.match, engine.refresh_allocations
 
-		if not linked_payments:
+	for transaction in bank_transactions:
+		set_counterparty_party(transaction)
+		vouchers = match(transaction)
+		if not vouchers:
 			continue
 
-		vouchers = list(
-			map(
-				lambda entry: {
-					"payment_doctype": entry.get("doctype"),
-					"payment_name": entry.get("name"),
-					"amount": entry.get("paid_amount"),
-				},
-				linked_payments,
-			)
-		)
-
 		unallocated_before = transaction.unallocated_amount
 		transaction = bulk_reconcile_vouchers(transaction.name, json.dumps(vouchers))
+		if refresh_allocations:
+			refresh_allocations(
+				(voucher["payment_doctype"], voucher["payment_name"]) for voucher in vouchers
+			)
 
 		if transaction.status == "Reconciled":
 			reconciled.add(transaction.name)
@@ -383,7 +492,44 @@ def auto_reconcile_vouchers(
 	return reconciled, partially_reconciled
 
 
+def has_other_matching_queries() -> bool:
+	"""Whether apps besides ERPNext and Banking hook into `get_matching_queries`."""
+	return len(frappe.get_hooks("get_matching_queries")) > 2
+
+
+def get_auto_reconcile_matches(
+	from_date: str | datetime.date = None,
+	to_date: str | datetime.date = None,
+	filter_by_reference_date: str | bool = False,
+	from_reference_date: str | datetime.date = None,
+	to_reference_date: str | datetime.date = None,
+):
+	"""Return a function that matches one Bank Transaction at a time via `get_linked_payments`."""
+
+	def match(transaction) -> list:
+		linked_payments = get_linked_payments(
+			transaction.name,
+			["payment_entry", "journal_entry"],
+			from_date,
+			to_date,
+			filter_by_reference_date,
+			from_reference_date,
+			to_reference_date,
+		)
+		return [
+			{
+				"payment_doctype": entry.get("doctype"),
+				"payment_name": entry.get("name"),
+				"amount": entry.get("paid_amount"),
+			}
+			for entry in linked_payments
+		]
+
+	return match
+
+
 @frappe.whitelist()
+@profile
 def get_linked_payments(
 	bank_transaction_name: str,
 	document_types: str | list,
@@ -392,17 +538,25 @@ def get_linked_payments(
 	filter_by_reference_date: str | bool = False,
 	from_reference_date: str | datetime.date = None,
 	to_reference_date: str | datetime.date = None,
-) -> list:
-	# get all matching payments for a bank transaction
+	limit: int | None = None,
+	offset: int | None = None,
+) -> list | dict:
+	"""
+	Return the matching payments for a bank transaction, best rank first.
+
+	With a `limit`, only that page of payments (starting at `offset`) is
+	returned, as `{"vouchers": [...], "total": <count of all matches>}`.
+	"""
 	transaction = frappe.get_doc("Bank Transaction", bank_transaction_name)
-	gl_account, company = frappe.db.get_value(
-		"Bank Account", transaction.bank_account, ["account", "company"]
-	)
+	gl_account, company = get_bank_account_details(transaction.bank_account)
 
 	if isinstance(document_types, str):
 		document_types = json.loads(document_types)
 
-	matching = check_matching(
+	# rank by the counterparty's party if the transaction has none (not saved)
+	set_counterparty_party(transaction)
+
+	args = (
 		gl_account,
 		company,
 		transaction,
@@ -413,20 +567,223 @@ def get_linked_payments(
 		from_reference_date,
 		to_reference_date,
 	)
-	return subtract_allocations(gl_account, matching)
+	if not cint(limit):
+		matching = subtract_allocations(gl_account, check_matching(*args))
+		return sort_by_score(transaction, matching)
+
+	# The score orders the vouchers within a rank, so all vouchers of the ranks
+	# on the page are scored before the page is cut out.
+	limit, offset = cint(limit), cint(offset)
+	rank_counts = count_matching(*args)
+	ranks, skipped = get_page_ranks(rank_counts, limit, offset)
+	matching = []
+	if ranks:
+		matching = subtract_allocations(gl_account, check_matching(*args, ranks=ranks))
+		matching = sort_by_score(transaction, matching)
+
+	start = offset - skipped
+
+	return {
+		"vouchers": matching[start : start + limit],
+		"total": sum(rank_counts.values()),
+	}
+
+
+def get_page_ranks(
+	rank_counts: dict[int, int], limit: int, offset: int
+) -> tuple[tuple[int, int] | None, int]:
+	"""
+	Return the lowest and highest rank of the vouchers on a page, and the number
+	of vouchers with a higher rank than those.
+	"""
+	page_ranks = []
+	skipped = position = 0
+	for rank in sorted(rank_counts, reverse=True):
+		count = rank_counts[rank]
+		if position + count <= offset:
+			skipped += count
+		elif position < offset + limit:
+			page_ranks.append(rank)
+
+		position += count
+
+	return ((min(page_ranks), max(page_ranks)) if page_ranks else None), skipped
+
+
+@frappe.whitelist()
+@profile
+def get_invoice_combinations(
+	bank_transaction_name: str, tolerance: float = 0.0, limit: int = 5
+) -> list[dict]:
+	"""
+	Propose combinations of the party's unpaid invoices whose outstanding amounts
+	add up to the unallocated amount of the bank transaction, within `tolerance`.
+	The vouchers of each combination can be passed to `bulk_reconcile_vouchers`.
+	"""
+	transaction = frappe.get_doc("Bank Transaction", bank_transaction_name)
+	set_counterparty_party(transaction)
+
+	is_deposit = transaction.deposit > 0.0
+	party_type = "Customer" if is_deposit else "Supplier"
+	if not transaction.party or transaction.party_type != party_type:
+		return []
+
+	doctype = "Sales Invoice" if is_deposit else "Purchase Invoice"
+	gl_account, company = get_bank_account_details(transaction.bank_account)
+	invoices = frappe.get_all(
+		doctype,
+		filters={
+			"docstatus": 1,
+			"company": company,
+			party_type.lower(): transaction.party,
+			"outstanding_amount": (">", 0.0),
+			"currency": get_account_currency(gl_account),
+		},
+		fields=["name", "outstanding_amount"],
+		order_by="posting_date asc",
+	)
+
+	def to_cents(amount: float) -> int:
+		return round(flt(amount) * 100)
+
+	solver = SubsetSumSolver(
+		[to_cents(invoice.outstanding_amount) for invoice in invoices],
+		to_cents(transaction.unallocated_amount),
+		to_cents(tolerance),
+		max_results=cint(limit) or 5,
+	)
+	combinations = []
+	for subset in solver.solve():
+		vouchers = [
+			{
+				"payment_doctype": doctype,
+				"payment_name": invoices[i].name,
+				"amount": invoices[i].outstanding_amount,
+				"party": transaction.party,
+			}
+			for i in subset
+		]
+		combinations.append(
+			{"vouchers": vouchers, "total": sum(voucher["amount"] for voucher in vouchers)}
+		)
+
+	return combinations
+
+
+@frappe.whitelist()
+@profile
+def get_transaction_windows(
+	voucher_type: str,
+	voucher_name: str,
+	bank_account: str,
+	tolerance: float = 0.0,
+	max_days: int = MAX_WINDOW_DAYS,
+) -> list[dict]:
+	"""
+	Propose runs of consecutive unreconciled bank transactions of the voucher's
+	party whose unallocated amounts add up to the open amount of the voucher,
+	e.g. an invoice paid in several transfers. A transaction without a party
+	belongs to the party of its counterparty, as in `get_linked_payments`.
+	"""
+	voucher = get_open_voucher(voucher_type, voucher_name, bank_account)
+	if not voucher.party or flt(voucher.amount) <= 0.0:
+		return []
+
+	bt = frappe.qb.DocType("Bank Transaction")
+	amount_field = bt.deposit if voucher.is_deposit else bt.withdrawal
+	party_condition = (bt.party_type == voucher.party_type) & (
+		bt.party == voucher.party
+	)
+	rows = (
+		frappe.qb.from_(bt)
+		.select(
+			bt.name,
+			bt.date,
+			bt.unallocated_amount,
+			bt.party_type,
+			bt.party,
+			bt.bank_party_iban,
+			bt.bank_party_account_number,
+		)
+		.where(bt.docstatus == 1)
+		.where(bt.bank_account == bank_account)
+		.where(party_condition | bt.party.isnull() | (bt.party == ""))
+		.where(amount_field > 0.0)
+		.where(bt.unallocated_amount > 0.0)
+		.orderby(bt.date)
+		.orderby(bt.name)
+		.run(as_dict=True)
+	)
+
+	lines = []
+	for row in rows:
+		set_counterparty_party(row)
+		if (row.party_type, row.party) == (voucher.party_type, voucher.party):
+			lines.append((row.name, row.date, row.unallocated_amount))
+
+	if not lines:
+		return []
+
+	names, dates, amounts = zip(*lines)
+	windows = find_windows(
+		np.array(dates, dtype="datetime64[D]"),
+		np.rint(np.array(amounts, dtype=float) * 100).astype(np.int64),
+		round(flt(voucher.amount) * 100),
+		tolerance=round(flt(tolerance) * 100),
+		max_days=cint(max_days),
+	)
+	return [
+		{
+			"bank_transactions": [
+				{"name": names[i], "date": dates[i], "unallocated_amount": amounts[i]}
+				for i in range(start, end)
+			],
+			"total": sum(amounts[start:end]),
+		}
+		for start, end in windows
+	]
+
+
+def get_open_voucher(voucher_type: str, voucher_name: str, bank_account: str) -> frappe._dict:
+	"""Return the open amount, party and direction of an invoice or payment entry."""
+	if voucher_type in ("Sales Invoice", "Purchase Invoice"):
+		is_sales = voucher_type == "Sales Invoice"
+		party_field = "customer" if is_sales else "supplier"
+		amount, party = frappe.db.get_value(
+			voucher_type, voucher_name, ["outstanding_amount", party_field]
+		)
+		return frappe._dict(
+			amount=amount,
+			party_type="Customer" if is_sales else "Supplier",
+			party=party,
+			is_deposit=is_sales,
+		)
+
+	if voucher_type == "Payment Entry":
+		payment_type, paid_amount, party_type, party = frappe.db.get_value(
+			voucher_type, voucher_name, ["payment_type", "paid_amount", "party_type", "party"]
+		)
+		gl_account = get_gl_account(bank_account)
+		allocated = get_allocated_amounts(gl_account, [(voucher_type, voucher_name)])
+		return frappe._dict(
+			amount=flt(paid_amount) - allocated.get((voucher_type, voucher_name), 0.0),
+			party_type=party_type,
+			party=party,
+			is_deposit=payment_type == "Receive",
+		)
+
+	frappe.throw(_("Cannot match bank transactions to a {0}").format(_(voucher_type)))
 
 
 def subtract_allocations(gl_account, vouchers):
 	"Look up & subtract any existing Bank Transaction allocations"
+	allocated_amounts = get_allocated_amounts(
+		gl_account, {(voucher.get("doctype"), voucher.get("name")) for voucher in vouchers}
+	)
+
 	copied = []
 	for voucher in vouchers:
-		rows = get_total_allocated_amount(voucher.get("doctype"), voucher.get("name"))
-		amount = None
-		for row in rows:
-			if row["gl_account"] == gl_account:
-				amount = row["total"]
-				break
-
+		amount = allocated_amounts.get((voucher.get("doctype"), voucher.get("name")))
 		if amount:
 			voucher["paid_amount"] -= amount
 
@@ -444,15 +801,131 @@ def check_matching(
 	filter_by_reference_date: bool = False,
 	from_reference_date: str | datetime.date = None,
 	to_reference_date: str | datetime.date = None,
+	ranks: tuple[int, int] | None = None,
 ):
+	"""
+	Return the vouchers matching `transaction`, best rank first. The matching
+	queries run as one UNION ALL statement that is ranked and ordered in SQL.
+	Pass `ranks` (lowest, highest) to only return the vouchers of these ranks.
+	"""
+	# open vouchers whose reference is in the description, e.g. an invoice name
+	references = find_references(company, transaction.description)
+	union_queries, other_queries = get_transaction_queries(
+		bank_account,
+		company,
+		transaction,
+		document_types,
+		from_date,
+		to_date,
+		filter_by_reference_date,
+		from_reference_date,
+		to_reference_date,
+		references,
+	)
+
+	matching_vouchers = []
+	if union_queries:
+		union = get_union_query(union_queries, transaction.description, references)
+		if ranks:
+			lowest, highest = ranks
+			union = (
+				frappe.qb.from_(union).select("*").where(Field("rank")[lowest:highest])
+			)
+
+		matching_vouchers = order_by_rank(union).run(as_dict=True)
+
+	if not other_queries:
+		return matching_vouchers
+
+	other_vouchers = run_other_queries(
+		other_queries, transaction.description, references
+	)
+	if ranks:
+		other_vouchers = [
+			voucher
+			for voucher in other_vouchers
+			if ranks[0] <= voucher["rank"] <= ranks[1]
+		]
+
+	matching_vouchers.extend(other_vouchers)
+	return sorted(matching_vouchers, key=lambda x: x["rank"], reverse=True)
+
+
+def count_matching(
+	bank_account: str,
+	company: str,
+	transaction: "BankTransaction",
+	document_types: list,
+	from_date: str | datetime.date = None,
+	to_date: str | datetime.date = None,
+	filter_by_reference_date: bool = False,
+	from_reference_date: str | datetime.date = None,
+	to_reference_date: str | datetime.date = None,
+) -> dict[int, int]:
+	"""Return the number of vouchers per rank that `check_matching` would return."""
+	references = find_references(company, transaction.description)
+	union_queries, other_queries = get_transaction_queries(
+		bank_account,
+		company,
+		transaction,
+		document_types,
+		from_date,
+		to_date,
+		filter_by_reference_date,
+		from_reference_date,
+		to_reference_date,
+		references,
+	)
+
+	rank_counts = defaultdict(int)
+	if union_queries:
+		union = get_union_query(union_queries, transaction.description, references)
+		for rank, count in (
+			frappe.qb.from_(union)
+			.select(Field("rank"), Count("*"))
+			.groupby(Field("rank"))
+			.run()
+		):
+			rank_counts[cint(rank)] += count
+
+	if other_queries:
+		for voucher in run_other_queries(
+			other_queries, transaction.description, references
+		):
+			rank_counts[cint(voucher["rank"])] += 1
+
+	return dict(rank_counts)
+
+
+def get_transaction_queries(
+	bank_account: str,
+	company: str,
+	transaction: "BankTransaction",
+	document_types: list,
+	from_date: str | datetime.date = None,
+	to_date: str | datetime.date = None,
+	filter_by_reference_date: bool = False,
+	from_reference_date: str | datetime.date = None,
+	to_reference_date: str | datetime.date = None,
+	references: dict | None = None,
+) -> tuple[list, list]:
+	"""
+	Return the matching queries for `transaction`, split into the ones that can
+	be combined into a union and the others.
+	"""
+	tolerances = get_tolerances(transaction.unallocated_amount)
 	common_filters = frappe._dict(
 		amount=transaction.unallocated_amount,
+		amount_tolerance=tolerances.amount,
 		payment_type=("Receive" if transaction.deposit > 0.0 else "Pay"),
 		reference_no=transaction.reference_number,
 		party_type=transaction.party_type,
 		party=transaction.party,
 		bank_account=bank_account,
 		date=transaction.date,
+		date_tolerance=tolerances.days,
+		description=transaction.description,
+		references=references,
 	)
 
 	# combine all types of vouchers
@@ -469,22 +942,129 @@ def check_matching(
 		common_filters,
 	)
 
+	union_queries, other_queries = [], []
+	for query in filter(None, queries):
+		if can_be_unioned(query):
+			union_queries.append(query)
+		else:
+			other_queries.append(query)
+
+	return union_queries, other_queries
+
+
+def run_other_queries(
+	queries: list, description: str | None = None, references: dict | None = None
+) -> list[dict]:
+	"""Run queries added by other apps that cannot be part of the union, e.g. raw SQL."""
 	matching_vouchers = []
 	for query in queries:
-		matching_vouchers.extend(query.run(as_dict=True))
+		if isinstance(query, str):
+			vouchers = frappe.db.sql(query, as_dict=True)
+		else:
+			vouchers = query.run(as_dict=True)
 
-	if not matching_vouchers:
-		return []
+		add_description_rank(vouchers, description, references)
+		matching_vouchers.extend(vouchers)
 
-	if transaction.description:
-		for voucher in matching_vouchers:
-			# higher rank if voucher name is in bank transaction
-			reference_no = voucher["reference_no"]
-			if reference_no and (reference_no.strip() in transaction.description):
-				voucher["rank"] += 1
-				voucher["name_in_desc_match"] = 1
+	return matching_vouchers
 
-	return sorted(matching_vouchers, key=lambda x: x["rank"], reverse=True)
+
+def can_be_unioned(query) -> bool:
+	"""Whether `query` is a query builder query that selects the columns the union needs."""
+	if not isinstance(query, QueryBuilder):
+		return False
+
+	columns = get_column_names(query)
+	return all(column in columns for column in ("rank", "doctype", "name", "posting_date"))
+
+
+def get_column_names(query: QueryBuilder) -> list[str]:
+	return [term.alias or getattr(term, "name", None) for term in query._selects]
+
+
+def get_union_query(
+	queries: list[QueryBuilder],
+	description: str | None = None,
+	references: dict | None = None,
+):
+	"""
+	Combine `queries` into one UNION ALL statement.
+
+	Queries select different columns, so each one is wrapped in a select of all
+	columns, with NULL for the columns it lacks. The wrapper also adds a rank
+	for a reference number that is part of the bank transaction's description,
+	or for a voucher in `references` (see `find_references`).
+	"""
+	columns = []
+	for query in queries:
+		columns.extend(
+			column for column in get_column_names(query) if column and column not in columns
+		)
+
+	union = None
+	for index, query in enumerate(queries):
+		query_columns = get_column_names(query)
+		reference_no = query.field("reference_no")
+		conditions = [
+			(query.field("doctype") == doctype) & query.field("name").isin(list(names))
+			for doctype, names in (references or {}).items()
+		]
+		if description and "reference_no" in query_columns:
+			conditions.append(
+				(reference_no != "")
+				& (Locate(Trim(reference_no), ValueWrapper(description)) > 0)
+			)
+
+		if conditions:
+			description_rank = frappe.qb.terms.Case().when(Criterion.any(conditions), 1).else_(0)
+		else:
+			description_rank = ValueWrapper(0)
+
+		selects = []
+		for column in columns:
+			if column == "rank":
+				selects.append((query.field("rank") + description_rank).as_("rank"))
+			elif column in query_columns:
+				selects.append(query.field(column))
+			else:
+				selects.append(NullValue().as_(column))
+
+		wrapped = (
+			frappe.qb.from_(query)
+			.select(
+				*selects,
+				description_rank.as_("name_in_desc_match"),
+				ValueWrapper(index).as_("query_index"),
+			)
+		)
+		union = wrapped if union is None else union.union_all(wrapped)
+
+	return union
+
+
+def order_by_rank(union):
+	"""Order like the sequential queries were sorted: by rank, then by query and posting date."""
+	return (
+		union.orderby(Field("rank"), order=frappe.qb.desc)
+		.orderby(Field("query_index"))
+		.orderby(Field("posting_date"))
+	)
+
+
+def add_description_rank(
+	vouchers: list[dict], description: str | None, references: dict | None = None
+) -> None:
+	if not description:
+		return
+
+	references = references or {}
+	for voucher in vouchers:
+		# higher rank if voucher name is in bank transaction
+		if is_in_description(voucher["reference_no"], description) or (
+			voucher.get("name") in references.get(voucher.get("doctype"), ())
+		):
+			voucher["rank"] += 1
+			voucher["name_in_desc_match"] = 1
 
 
 def get_queries(
@@ -613,6 +1193,56 @@ def get_matching_queries(
 	return queries
 
 
+def get_amount_condition(
+	amount_field, amount_equality, exact_match: bool, *other_matches
+) -> Criterion:
+	"""
+	Return the amount filter of a matching query. Without an exact match, the
+	amount may differ if the voucher matches otherwise, e.g. by reference, party
+	or date, so that not every open voucher of the account is fetched and ranked.
+	"""
+	if exact_match:
+		return amount_equality
+
+	return (amount_field > 0.0) & Criterion.any([amount_equality, *other_matches])
+
+
+def get_unpaid_amount_condition(
+	amount_equality, exact_match: bool, *other_matches
+) -> Criterion:
+	"""
+	Return the amount filter of an unpaid voucher query. Without an exact match,
+	the outstanding amount may differ if the voucher matches otherwise, e.g. by
+	party or reference. Unpaid vouchers are mostly dated before the payment, so
+	the date is no match.
+	"""
+	if exact_match:
+		return amount_equality
+
+	return Criterion.any([amount_equality, *other_matches])
+
+
+def get_reference_conditions(
+	common_filters: frappe._dict, doctype: str, name_field, reference_field
+) -> list[Criterion]:
+	"""
+	Return the conditions for a voucher whose reference is the reference number of
+	the bank transaction, or is in its description like `get_union_query` ranks it.
+	"""
+	conditions = []
+	if common_filters.reference_no:
+		conditions.append(reference_field == common_filters.reference_no)
+	if names := (common_filters.references or {}).get(doctype):
+		conditions.append(name_field.isin(list(names)))
+	if description := common_filters.description:
+		conditions.append(
+			(reference_field != "")
+			& (Locate(Trim(reference_field), ValueWrapper(description)) > 0)
+		)
+
+	return conditions
+
+
 def get_bt_matching_query(
 	exact_match: bool, common_filters: frappe._dict, transaction_name: str
 ):
@@ -629,11 +1259,18 @@ def get_bt_matching_query(
 	)
 	unallocated_rank = (
 		frappe.qb.terms.Case()
-		.when(bt.unallocated_amount == common_filters.amount, 1)
+		.when(
+			amount_in_range(
+				bt.unallocated_amount, common_filters.amount, common_filters.amount_tolerance
+			),
+			1,
+		)
 		.else_(0)
 	)
 
-	amount_equality = getattr(bt, field) == common_filters.amount
+	amount_equality = amount_in_range(
+		getattr(bt, field), common_filters.amount, common_filters.amount_tolerance
+	)
 	amount_rank = frappe.qb.terms.Case().when(amount_equality, 1).else_(0)
 
 	party_condition = (
@@ -642,7 +1279,14 @@ def get_bt_matching_query(
 		& bt.party.isnotnull()
 	)
 	party_rank = frappe.qb.terms.Case().when(party_condition, 1).else_(0)
-	amount_condition = amount_equality if exact_match else getattr(bt, field) > 0.0
+	amount_condition = get_amount_condition(
+		getattr(bt, field),
+		amount_equality,
+		exact_match,
+		bt.reference_number == common_filters.reference_no,
+		party_condition,
+		date_in_range(bt.date, common_filters.date, common_filters.date_tolerance),
+	)
 
 	query = (
 		frappe.qb.from_(bt)
@@ -683,9 +1327,10 @@ def get_ld_matching_query(exact_match: bool, common_filters: frappe._dict):
 		and loan_disbursement.applicant == common_filters.matching_party
 	)
 
-	date_condition = (
-		Coalesce(loan_disbursement.reference_date, loan_disbursement.disbursement_date)
-		== common_filters.date
+	date_condition = date_in_range(
+		Coalesce(loan_disbursement.reference_date, loan_disbursement.disbursement_date),
+		common_filters.date,
+		common_filters.date_tolerance,
 	)
 	date_rank = frappe.qb.terms.Case().when(date_condition, 1).else_(0)
 
@@ -715,7 +1360,13 @@ def get_ld_matching_query(exact_match: bool, common_filters: frappe._dict):
 	)
 
 	if exact_match:
-		query.where(loan_disbursement.disbursed_amount == common_filters.amount)
+		query.where(
+			amount_in_range(
+				loan_disbursement.disbursed_amount,
+				common_filters.amount,
+				common_filters.amount_tolerance,
+			)
+		)
 	else:
 		query.where(loan_disbursement.disbursed_amount > 0.0)
 
@@ -730,9 +1381,10 @@ def get_lr_matching_query(exact_match: bool, common_filters: frappe._dict):
 		and loan_repayment.applicant == common_filters.party
 	)
 
-	date_condition = (
-		Coalesce(loan_repayment.reference_date, loan_repayment.posting_date)
-		== common_filters.date
+	date_condition = date_in_range(
+		Coalesce(loan_repayment.reference_date, loan_repayment.posting_date),
+		common_filters.date,
+		common_filters.date_tolerance,
 	)
 	date_rank = frappe.qb.terms.Case().when(date_condition, 1).else_(0)
 
@@ -765,7 +1417,11 @@ def get_lr_matching_query(exact_match: bool, common_filters: frappe._dict):
 		query = query.where((loan_repayment.repay_from_salary == 0))
 
 	if exact_match:
-		query.where(loan_repayment.amount_paid == common_filters.amount)
+		query.where(
+			amount_in_range(
+				loan_repayment.amount_paid, common_filters.amount, common_filters.amount_tolerance
+			)
+		)
 	else:
 		query.where(loan_repayment.amount_paid > 0.0)
 
@@ -790,9 +1446,10 @@ def get_pe_matching_query(
 	ref_condition = pe.reference_no == common_filters.reference_no
 	ref_rank = frappe.qb.terms.Case().when(ref_condition, 1).else_(0)
 
-	amount_equality = pe.paid_amount == common_filters.amount
+	amount_equality = amount_in_range(
+		pe.paid_amount, common_filters.amount, common_filters.amount_tolerance
+	)
 	amount_rank = frappe.qb.terms.Case().when(amount_equality, 1).else_(0)
-	amount_condition = amount_equality if exact_match else pe.paid_amount > 0.0
 
 	party_condition = (
 		(pe.party_type == common_filters.party_type)
@@ -805,8 +1462,20 @@ def get_pe_matching_query(
 	if cint(filter_by_reference_date):
 		filter_by_date = pe.reference_date.between(from_reference_date, to_reference_date)
 
-	date_condition = Coalesce(pe.reference_date, pe.posting_date) == common_filters.date
+	date_condition = date_in_range(
+		Coalesce(pe.reference_date, pe.posting_date),
+		common_filters.date,
+		common_filters.date_tolerance,
+	)
 	date_rank = frappe.qb.terms.Case().when(date_condition, 1).else_(0)
+	amount_condition = get_amount_condition(
+		pe.paid_amount,
+		amount_equality,
+		exact_match,
+		ref_condition,
+		party_condition,
+		date_condition,
+	)
 
 	query = (
 		frappe.qb.from_(pe)
@@ -865,15 +1534,28 @@ def get_je_matching_query(
 	ref_rank = frappe.qb.terms.Case().when(ref_condition, 1).else_(0)
 
 	amount_field = f"{cr_or_dr}_in_account_currency"
-	amount_equality = getattr(jea, amount_field) == common_filters.amount
+	amount_equality = amount_in_range(
+		getattr(jea, amount_field), common_filters.amount, common_filters.amount_tolerance
+	)
 	amount_rank = frappe.qb.terms.Case().when(amount_equality, 1).else_(0)
 
 	filter_by_date = je.posting_date.between(from_date, to_date)
 	if cint(filter_by_reference_date):
 		filter_by_date = je.cheque_date.between(from_reference_date, to_reference_date)
 
-	date_condition = Coalesce(je.cheque_date, je.posting_date) == common_filters.date
+	date_condition = date_in_range(
+		Coalesce(je.cheque_date, je.posting_date),
+		common_filters.date,
+		common_filters.date_tolerance,
+	)
 	date_rank = frappe.qb.terms.Case().when(date_condition, 1).else_(0)
+	amount_condition = get_amount_condition(
+		getattr(jea, amount_field),
+		amount_equality,
+		exact_match,
+		ref_condition,
+		date_condition,
+	)
 
 	query = (
 		frappe.qb.from_(jea)
@@ -898,7 +1580,7 @@ def get_je_matching_query(
 		.where(je.voucher_type != "Opening Entry")
 		.where(je.clearance_date.isnull())
 		.where(jea.account == common_filters.bank_account)
-		.where(amount_equality if exact_match else getattr(jea, amount_field) > 0.0)
+		.where(amount_condition)
 		.where(je.docstatus == 1)
 		.where(filter_by_date)
 		.orderby(je.cheque_date if cint(filter_by_reference_date) else je.posting_date)
@@ -919,14 +1601,18 @@ def get_si_matching_query(
 	si = frappe.qb.DocType("Sales Invoice")
 	sip = frappe.qb.DocType("Sales Invoice Payment")
 
-	amount_equality = sip.amount == common_filters.amount
+	amount_equality = amount_in_range(
+		sip.amount, common_filters.amount, common_filters.amount_tolerance
+	)
 	amount_rank = frappe.qb.terms.Case().when(amount_equality, 1).else_(0)
 	amount_condition = amount_equality if exact_match else sip.amount != 0.0
 
 	party_condition = si.customer == common_filters.party
 	party_rank = frappe.qb.terms.Case().when(party_condition, 1).else_(0)
 
-	date_condition = si.posting_date == common_filters.date
+	date_condition = date_in_range(
+		si.posting_date, common_filters.date, common_filters.date_tolerance
+	)
 	date_rank = frappe.qb.terms.Case().when(date_condition, 1).else_(0)
 
 	query = (
@@ -973,10 +1659,20 @@ def get_unpaid_si_matching_query(
 	party_condition = sales_invoice.customer == common_filters.party
 	party_match = frappe.qb.terms.Case().when(party_condition, 1).else_(0)
 
-	outstanding_amount_condition = (
-		sales_invoice.outstanding_amount == common_filters.amount
+	outstanding_amount_condition = amount_in_range(
+		sales_invoice.outstanding_amount,
+		common_filters.amount,
+		common_filters.amount_tolerance,
 	)
 	amount_match = frappe.qb.terms.Case().when(outstanding_amount_condition, 1).else_(0)
+	amount_condition = get_unpaid_amount_condition(
+		outstanding_amount_condition,
+		exact_match,
+		party_condition,
+		*get_reference_conditions(
+			common_filters, "Sales Invoice", sales_invoice.name, sales_invoice.name
+		),
+	)
 
 	query = (
 		frappe.qb.from_(sales_invoice)
@@ -998,13 +1694,12 @@ def get_unpaid_si_matching_query(
 		.where(sales_invoice.docstatus == 1)
 		.where(sales_invoice.company == company)  # because we do not have bank account check
 		.where(sales_invoice.outstanding_amount != 0.0)
+		.where(amount_condition)
 		.where(sales_invoice.currency == currency)
 	)
 
 	if include_only_returns:
 		query = query.where(sales_invoice.is_return == 1)
-	if exact_match:
-		query = query.where(outstanding_amount_condition)
 	if common_filters.exact_party_match:
 		query = query.where(party_condition)
 
@@ -1019,7 +1714,9 @@ def get_pi_matching_query(
 	"""
 	purchase_invoice = frappe.qb.DocType("Purchase Invoice")
 
-	amount_equality = purchase_invoice.paid_amount == common_filters.amount
+	amount_equality = amount_in_range(
+		purchase_invoice.paid_amount, common_filters.amount, common_filters.amount_tolerance
+	)
 	amount_rank = frappe.qb.terms.Case().when(amount_equality, 1).else_(0)
 	amount_condition = (
 		amount_equality if exact_match else purchase_invoice.paid_amount != 0.0
@@ -1029,9 +1726,10 @@ def get_pi_matching_query(
 	party_rank = frappe.qb.terms.Case().when(party_condition, 1).else_(0)
 
 	# date of BT and paid PI could be the same (date of payment or the date of the bill)
-	date_condition = (
-		Coalesce(purchase_invoice.bill_date, purchase_invoice.posting_date)
-		== common_filters.date
+	date_condition = date_in_range(
+		Coalesce(purchase_invoice.bill_date, purchase_invoice.posting_date),
+		common_filters.date,
+		common_filters.date_tolerance,
 	)
 	date_rank = frappe.qb.terms.Case().when(date_condition, 1).else_(0)
 
@@ -1079,10 +1777,23 @@ def get_unpaid_pi_matching_query(
 	party_condition = purchase_invoice.supplier == common_filters.party
 	party_match = frappe.qb.terms.Case().when(party_condition, 1).else_(0)
 
-	outstanding_amount_condition = (
-		purchase_invoice.outstanding_amount == common_filters.amount
+	outstanding_amount_condition = amount_in_range(
+		purchase_invoice.outstanding_amount,
+		common_filters.amount,
+		common_filters.amount_tolerance,
 	)
 	amount_match = frappe.qb.terms.Case().when(outstanding_amount_condition, 1).else_(0)
+	amount_condition = get_unpaid_amount_condition(
+		outstanding_amount_condition,
+		exact_match,
+		party_condition,
+		*get_reference_conditions(
+			common_filters,
+			"Purchase Invoice",
+			purchase_invoice.name,
+			purchase_invoice.bill_no,
+		),
+	)
 
 	# We skip date rank as the date of an unpaid bill is mostly
 	# earlier than the date of the bank transaction
@@ -1106,14 +1817,13 @@ def get_unpaid_pi_matching_query(
 		.where(purchase_invoice.docstatus == 1)
 		.where(purchase_invoice.company == company)
 		.where(purchase_invoice.outstanding_amount != 0.0)
+		.where(amount_condition)
 		.where(purchase_invoice.is_paid == 0)
 		.where(purchase_invoice.currency == currency)
 	)
 
 	if include_only_returns:
 		query = query.where(purchase_invoice.is_return == 1)
-	if exact_match:
-		query = query.where(outstanding_amount_condition)
 	if common_filters.exact_party_match:
 		query = query.where(party_condition)
 
@@ -1138,8 +1848,18 @@ def get_unpaid_ec_matching_query(
 		- expense_claim.total_amount_reimbursed
 		- expense_claim.total_advance_amount
 	)
-	outstanding_amount_condition = outstanding_amount == common_filters.amount
+	outstanding_amount_condition = amount_in_range(
+		outstanding_amount, common_filters.amount, common_filters.amount_tolerance
+	)
 	amount_match = frappe.qb.terms.Case().when(outstanding_amount_condition, 1).else_(0)
+	amount_condition = get_unpaid_amount_condition(
+		outstanding_amount_condition,
+		exact_match,
+		party_condition,
+		*get_reference_conditions(
+			common_filters, "Expense Claim", expense_claim.name, expense_claim.name
+		),
+	)
 
 	query = (
 		frappe.qb.from_(expense_claim)
@@ -1161,11 +1881,10 @@ def get_unpaid_ec_matching_query(
 		.where(expense_claim.docstatus == 1)
 		.where(expense_claim.company == company)
 		.where(outstanding_amount > 0.0)
+		.where(amount_condition)
 		.where(expense_claim.status == "Unpaid")
 	)
 
-	if exact_match:
-		query = query.where(outstanding_amount_condition)
 	if common_filters.exact_party_match:
 		query = query.where(party_condition)
 
@@ -20,9 +20,13 @@ from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import (
 
 from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta import (
 	auto_reconcile_vouchers,
+	bulk_reconcile_transactions,
 	bulk_reconcile_vouchers,
 	create_journal_entry_bts,
 	create_payment_entry_bts,
+	get_invoice_combinations,
+	get_linked_payments,
+	get_transaction_windows,
 )
 
 from hrms.hr.doctype.expense_claim.test_expense_claim import make_expense_claim
@@ -478,6 +482,400 @@ class TestBankReconciliationToolBeta(AccountsTestMixin, FrappeTestCase):
 		self.assertEqual(bt.status, "Unreconciled")
 		self.assertEqual(bt.unallocated_amount, 50)
 
+	def test_auto_reconciliation_shared_reference(self):
+		"""
+		Test auto reconciliation of two bank transactions against one payment entry.
+		BT1, BT2: 100, 100 (same reference number)
+		PE: 150 (BT1: 100, BT2: 50)
+		"""
+		day_before_yesterday = add_days(getdate(), -2)
+		bt1 = create_bank_transaction(
+			date=day_before_yesterday,
+			deposit=100,
+			reference_no="Shared001",
+			bank_account=self.bank_account,
+		)
+		bt2 = create_bank_transaction(
+			date=day_before_yesterday,
+			deposit=100,
+			reference_no="Shared001",
+			bank_account=self.bank_account,
+		)
+		pe = create_payment_entry(
+			payment_type="Receive",
+			party_type="Customer",
+			party=self.customer,
+			paid_from="Debtors - _TC",
+			paid_to=self.gl_account,
+			paid_amount=150,
+		)
+		pe.reference_no = "Shared001"
+		pe.reference_date = day_before_yesterday
+		pe.insert()
+		pe.submit()
+
+		auto_reconcile_vouchers(
+			bank_account=self.bank_account,
+			from_date=day_before_yesterday,
+			to_date=add_days(getdate(), 1),
+			filter_by_reference_date=False,
+		)
+		bt1.reload()
+		bt2.reload()
+
+		self.assertEqual(bt1.status, "Reconciled")
+		self.assertEqual(bt1.payment_entries[0].allocated_amount, 100)
+		self.assertEqual(bt2.payment_entries[0].allocated_amount, 50)
+		self.assertEqual(bt2.unallocated_amount, 50)
+
+	def test_linked_payments_rank(self):
+		"""
+		Test that matching vouchers are ranked in one query,
+		including the reference number in the description.
+		"""
+		bt = create_bank_transaction(deposit=120, bank_account=self.bank_account)
+		vouchers = []
+		for reference_no in ("Unrelated001", "BG/000002918"):
+			pe = create_payment_entry(
+				payment_type="Receive",
+				party_type="Customer",
+				party=self.customer,
+				paid_from="Debtors - _TC",
+				paid_to=self.gl_account,
+				paid_amount=120,
+			)
+			pe.reference_no = reference_no
+			pe.reference_date = bt.date
+			pe.insert()
+			pe.submit()
+			vouchers.append(pe.name)
+
+		matches = get_linked_payments(
+			bt.name,
+			["payment_entry", "journal_entry"],
+			from_date=add_days(bt.date, -1),
+			to_date=add_days(bt.date, 1),
+		)
+		ranks = [match["rank"] for match in matches]
+
+		self.assertEqual(matches[0]["name"], vouchers[1])
+		self.assertEqual(matches[0]["name_in_desc_match"], 1)
+		self.assertIn(vouchers[0], [match["name"] for match in matches])
+		self.assertEqual(ranks, sorted(ranks, reverse=True))
+
+		page = get_linked_payments(
+			bt.name,
+			["payment_entry", "journal_entry"],
+			from_date=add_days(bt.date, -1),
+			to_date=add_days(bt.date, 1),
+			limit=1,
+			offset=1,
+		)
+		self.assertEqual(page["total"], len(matches))
+		self.assertEqual([voucher["name"] for voucher in page["vouchers"]], [matches[1]["name"]])
+
+	def test_linked_payments_paged_by_score(self):
+		"""
+		Test that vouchers of the same rank are ordered by score on every page.
+		BT: 217 today
+		PE1, PE2: 217 with reference dates 20 and 2 days ago (same rank)
+		"""
+		bt = create_bank_transaction(deposit=217, bank_account=self.bank_account)
+		vouchers = []
+		for days in (20, 2):
+			pe = create_payment_entry(
+				payment_type="Receive",
+				party_type="Customer",
+				party=self.customer,
+				paid_from="Debtors - _TC",
+				paid_to=self.gl_account,
+				paid_amount=217,
+			)
+			pe.reference_no = f"Score{days:03}"
+			pe.reference_date = add_days(bt.date, -days)
+			pe.insert()
+			pe.submit()
+			vouchers.append(pe.name)
+
+		args = (bt.name, ["payment_entry"], add_days(bt.date, -1), add_days(bt.date, 1))
+		matches = [match["name"] for match in get_linked_payments(*args)]
+		pages = [
+			get_linked_payments(*args, limit=1, offset=offset)["vouchers"][0]["name"]
+			for offset in range(len(matches))
+		]
+
+		far, near = vouchers
+		self.assertLess(matches.index(near), matches.index(far))
+		self.assertLess(pages.index(near), pages.index(far))
+
+	def test_linked_payments_tolerance(self):
+		"""
+		Test that vouchers match within the amount and date tolerances.
+		BT: 100 today
+		PE: 99.5 two days ago
+		"""
+		bt = create_bank_transaction(deposit=100, bank_account=self.bank_account)
+		pe = create_payment_entry(
+			payment_type="Receive",
+			party_type="Customer",
+			party=self.customer,
+			paid_from="Debtors - _TC",
+			paid_to=self.gl_account,
+			paid_amount=99.5,
+		)
+		pe.reference_no = "Tolerance001"
+		pe.reference_date = add_days(bt.date, -2)
+		pe.insert()
+		pe.submit()
+
+		def get_match():
+			matches = get_linked_payments(
+				bt.name,
+				["payment_entry", "exact_match"],
+				from_date=add_days(bt.date, -5),
+				to_date=add_days(bt.date, 1),
+			)
+			return next((match for match in matches if match["name"] == pe.name), None)
+
+		self.assertIsNone(get_match())
+
+		settings = frappe.get_single("Banking Settings")
+		self.addCleanup(
+			settings.db_set,
+			{
+				"match_amount_tolerance": settings.match_amount_tolerance,
+				"match_date_tolerance": settings.match_date_tolerance,
+			},
+		)
+		settings.db_set({"match_amount_tolerance": 1, "match_date_tolerance": 3})
+
+		match = get_match()
+		self.assertIsNotNone(match)
+		self.assertEqual(match["amount_match"], 1)
+		self.assertEqual(match["date_match"], 1)
+
+	def test_linked_payments_other_amounts(self):
+		"""
+		Test that vouchers of other amounts only match if they match otherwise.
+		BT: 100 from ABC Inc.
+		PE1: 40 from ABC Inc. (matches by party)
+		PE2: 60 from another customer, 30 days ago (no match)
+		"""
+		bt = create_bank_transaction(deposit=100, bank_account=self.bank_account)
+		bt.db_set({"party_type": "Customer", "party": self.customer})
+
+		vouchers = []
+		for customer, amount, days in (
+			(self.customer, 40, 0),
+			(create_customer(customer_name="Other Amounts Inc."), 60, 30),
+		):
+			pe = create_payment_entry(
+				payment_type="Receive",
+				party_type="Customer",
+				party=customer,
+				paid_from="Debtors - _TC",
+				paid_to=self.gl_account,
+				paid_amount=amount,
+			)
+			pe.reference_no = f"OtherAmount{amount}"
+			pe.reference_date = add_days(bt.date, -days)
+			pe.insert()
+			pe.submit()
+			vouchers.append(pe.name)
+
+		matches = get_linked_payments(
+			bt.name,
+			["payment_entry"],
+			from_date=add_days(bt.date, -1),
+			to_date=add_days(bt.date, 1),
+		)
+		names = [match["name"] for match in matches]
+
+		self.assertIn(vouchers[0], names)
+		self.assertNotIn(vouchers[1], names)
+
+	def test_linked_unpaid_invoices_other_amounts(self):
+		"""
+		Test that unpaid invoices of other amounts only match if they match otherwise.
+		BT: 100 from ABC Inc., naming SI3 in its description
+		SI1: 40 to ABC Inc. (matches by party)
+		SI2: 60 to another customer (no match)
+		SI3: 70 to another customer (matches by description)
+		"""
+		bt = create_bank_transaction(deposit=100, bank_account=self.bank_account)
+		other_customer = create_customer(customer_name="Other Unpaid Inc.")
+		invoices = [
+			create_sales_invoice(
+				rate=rate,
+				warehouse="Finished Goods - _TC",
+				customer=customer,
+				cost_center="Main - _TC",
+				item="Reco Item",
+			).name
+			for customer, rate in (
+				(self.customer, 40),
+				(other_customer, 60),
+				(other_customer, 70),
+			)
+		]
+		bt.db_set(
+			{
+				"party_type": "Customer",
+				"party": self.customer,
+				"description": f"Payment {invoices[2]}",
+			}
+		)
+
+		matches = get_linked_payments(bt.name, ["sales_invoice", "unpaid_invoices"])
+		names = [match["name"] for match in matches]
+
+		self.assertIn(invoices[0], names)
+		self.assertNotIn(invoices[1], names)
+		self.assertIn(invoices[2], names)
+
+	def test_invoice_combinations(self):
+		"""
+		Test that unpaid invoices adding up to the transaction are proposed.
+		BT: 150
+		SI1, SI2, SI3: 100, 70, 50 (SI1 + SI3)
+		"""
+		customer = create_customer(customer_name="Combination Inc.")
+		bt = create_bank_transaction(deposit=150, bank_account=self.bank_account)
+		bt.db_set({"party_type": "Customer", "party": customer})
+
+		invoices = [
+			create_sales_invoice(
+				rate=rate,
+				warehouse="Finished Goods - _TC",
+				customer=customer,
+				cost_center="Main - _TC",
+				item="Reco Item",
+			).name
+			for rate in (100, 70, 50)
+		]
+
+		combinations = get_invoice_combinations(bt.name)
+		self.assertEqual(len(combinations), 1)
+		self.assertEqual(combinations[0]["total"], 150)
+		self.assertEqual(
+			{voucher["payment_name"] for voucher in combinations[0]["vouchers"]},
+			{invoices[0], invoices[2]},
+		)
+
+		bulk_reconcile_vouchers(bt.name, json.dumps(combinations[0]["vouchers"]))
+		bt.reload()
+		self.assertEqual(bt.status, "Reconciled")
+
+	def test_transaction_windows(self):
+		"""
+		Test that several bank transactions paying one invoice are proposed.
+		SI: 200
+		BT1, BT2: 120, 80 (BT2 only has the IBAN of the customer)
+		"""
+		customer = create_customer(customer_name="Instalment Inc.")
+		si = create_sales_invoice(
+			rate=200,
+			warehouse="Finished Goods - _TC",
+			customer=customer,
+			cost_center="Main - _TC",
+			item="Reco Item",
+		)
+		transactions = []
+		for days, amount in ((-3, 120), (-1, 80)):
+			bt = create_bank_transaction(
+				date=add_days(getdate(), days), deposit=amount, bank_account=self.bank_account
+			)
+			bt.db_set("bank_party_iban", "DE75512108001245126199")
+			transactions.append(bt.name)
+
+		# BT2's party is resolved through the counterparty IBAN of BT1
+		frappe.db.set_value(
+			"Bank Transaction",
+			transactions[0],
+			{"party_type": "Customer", "party": customer},
+		)
+
+		windows = get_transaction_windows("Sales Invoice", si.name, self.bank_account)
+		self.assertEqual(len(windows), 1)
+		self.assertEqual(windows[0]["total"], 200)
+		self.assertEqual([bt["name"] for bt in windows[0]["bank_transactions"]], transactions)
+
+	def test_bulk_reconcile_transactions(self):
+		"""
+		Test that many transactions are reconciled in one call, each on its own.
+		BT1: 100, PE1: 100 (reconciled)
+		BT2: 100, PE2: 60 (partially reconciled)
+		BT1 again (skipped)
+		BT2 again with an SI and a missing PI (failed and rolled back)
+		"""
+		transactions, payments = [], []
+		for amount in (100, 60):
+			bt = create_bank_transaction(deposit=100, bank_account=self.bank_account)
+			pe = create_payment_entry(
+				payment_type="Receive",
+				party_type="Customer",
+				party=self.customer,
+				paid_from="Debtors - _TC",
+				paid_to=self.gl_account,
+				paid_amount=amount,
+			)
+			pe.reference_no = f"Bulk{amount}"
+			pe.reference_date = bt.date
+			pe.insert()
+			pe.submit()
+			transactions.append(bt.name)
+			payments.append(
+				{
+					"payment_doctype": "Payment Entry",
+					"payment_name": pe.name,
+					"amount": amount,
+				}
+			)
+
+		si = create_sales_invoice(
+			rate=40,
+			warehouse="Finished Goods - _TC",
+			customer=create_customer(customer_name="Bulk Inc."),
+			cost_center="Main - _TC",
+			item="Reco Item",
+		)
+		invoices = [
+			{"payment_doctype": "Sales Invoice", "payment_name": si.name, "amount": 40},
+			{
+				"payment_doctype": "Purchase Invoice",
+				"payment_name": "Unknown",
+				"amount": 0,
+			},
+		]
+
+		results = bulk_reconcile_transactions(
+			json.dumps(
+				[
+					{"bank_transaction_name": name, "vouchers": vouchers}
+					for name, vouchers in [
+						(transactions[0], [payments[0]]),
+						(transactions[1], [payments[1]]),
+						(transactions[0], [payments[1]]),
+						(transactions[1], invoices),
+					]
+				]
+			)
+		)
+
+		self.assertEqual(
+			[result.status for result in results],
+			["Reconciled", "Unreconciled", "Skipped", "Failed"],
+		)
+		self.assertEqual(results[1].unallocated_amount, 40)
+		self.assertTrue(results[3].error)
+
+		bt = frappe.get_doc("Bank Transaction", transactions[1])
+		self.assertEqual(len(bt.payment_entries), 1)
+		self.assertEqual(bt.unallocated_amount, 40)
+		self.assertEqual(
+			frappe.db.get_value("Sales Invoice", si.name, "outstanding_amount"), 40
+		)
+
 	def test_multi_party_reconciliation(self):
 		bt = create_bank_transaction(
 			deposit=150,
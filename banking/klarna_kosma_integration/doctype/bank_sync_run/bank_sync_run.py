@@ -0,0 +1,107 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import time
+from typing import Dict, List, Optional
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.query_builder import Case, Interval
+from frappe.query_builder.functions import Avg, Count, Now, Sum
+from frappe.utils import add_days, getdate, now_datetime
+
+METRICS = (
+	"pages",
+	"rows_received",
+	"rows_inserted",
+	"duplicates_skipped",
+	"rows_failed",
+	"token_exchanges",
+	"http_time",
+	"db_time",
+	"duration",
+)
+
+
+class BankSyncRun(Document):
+	"""
+	Metrics of one sync. Counters are collected in memory while the sync runs,
+	the record is only inserted by `finish`.
+	"""
+
+	def add_page(
+		self, stats: Optional[Dict] = None, http_time: float = 0.0, token_exchanged: bool = False
+	) -> None:
+		"""Count a page and the statistics returned by `create_bank_transactions`."""
+		self.pages += 1
+		self.http_time += http_time or 0.0
+		self.token_exchanges += int(bool(token_exchanged))
+		if stats:
+			self.rows_received += stats.received
+			self.rows_inserted += stats.inserted
+			self.duplicates_skipped += stats.skipped
+			self.rows_failed += stats.get("failed") or 0
+			self.db_time += stats.get("dedup_time", 0.0) + stats.get("insert_time", 0.0)
+
+	def finish(self, status: str = "Completed", error: Optional[str] = None) -> None:
+		self.status = status
+		self.error = error
+		self.duration = time.monotonic() - self.flags.start_time
+		self.insert(ignore_permissions=True)
+		frappe.db.commit()
+
+	@staticmethod
+	def clear_old_logs(days: int = 90) -> None:
+		table = frappe.qb.DocType("Bank Sync Run")
+		frappe.db.delete(table, filters=(table.modified < (Now() - Interval(days=days))))
+
+
+def new_sync_run(sync_type: str, bank_account: Optional[str] = None) -> BankSyncRun:
+	sync_run = frappe.get_doc(
+		{
+			"doctype": "Bank Sync Run",
+			"sync_type": sync_type,
+			"bank_account": bank_account,
+			"started_on": now_datetime(),
+		}
+	)
+	for metric in METRICS:
+		sync_run.set(metric, 0)
+
+	sync_run.flags.start_time = time.monotonic()
+	return sync_run
+
+
+@frappe.whitelist()
+def get_sync_run_summary(
+	from_date: Optional[str] = None,
+	to_date: Optional[str] = None,
+	group_by: str = "bank_account",
+) -> List[Dict]:
+	"""
+	Return the summed metrics of Bank Sync Runs per Bank Account, Bank or
+	Sync Type, slowest first.
+	"""
+	frappe.only_for("System Manager")
+	if group_by not in ("bank_account", "bank", "sync_type"):
+		frappe.throw(_("Cannot group Bank Sync Runs by {0}").format(group_by))
+
+	run = frappe.qb.DocType("Bank Sync Run")
+	query = (
+		frappe.qb.from_(run)
+		.select(
+			run[group_by],
+			Count(run.name).as_("runs"),
+			Sum(Case().when(run.status == "Failed", 1).else_(0)).as_("failed_runs"),
+			Avg(run.duration).as_("avg_duration"),
+			*(Sum(run[metric]).as_(metric) for metric in METRICS),
+		)
+		.groupby(run[group_by])
+		.orderby(Sum(run.duration), order=frappe.qb.desc)
+	)
+	if from_date:
+		query = query.where(run.started_on >= getdate(from_date))
+	if to_date:
+		query = query.where(run.started_on < add_days(getdate(to_date), 1))
+
+	return query.run(as_dict=True)
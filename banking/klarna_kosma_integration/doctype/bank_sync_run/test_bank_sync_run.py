@@ -0,0 +1,41 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from banking.klarna_kosma_integration.doctype.bank_sync_run.bank_sync_run import (
+	get_sync_run_summary,
+	new_sync_run,
+)
+
+
+class TestBankSyncRun(FrappeTestCase):
+	def test_metrics_and_summary(self):
+		frappe.db.delete("Bank Sync Run")
+
+		for status in ("Completed", "Failed"):
+			sync_run = new_sync_run("Flow API")
+			sync_run.add_page(
+				frappe._dict(received=10, inserted=7, skipped=3, dedup_time=0.5, insert_time=1.5),
+				http_time=2.0,
+				token_exchanged=True,
+			)
+			sync_run.add_page(http_time=1.0)
+			sync_run.finish(status)
+
+		self.assertEqual(sync_run.pages, 2)
+		self.assertEqual(sync_run.rows_inserted, 7)
+		self.assertEqual(sync_run.db_time, 2.0)
+		self.assertEqual(sync_run.http_time, 3.0)
+
+		summary = get_sync_run_summary(group_by="sync_type")
+		self.assertEqual(len(summary), 1)
+		self.assertEqual(summary[0].sync_type, "Flow API")
+		self.assertEqual(summary[0].runs, 2)
+		self.assertEqual(summary[0].failed_runs, 1)
+		self.assertEqual(summary[0].rows_received, 20)
+		self.assertEqual(summary[0].duplicates_skipped, 6)
+		self.assertEqual(summary[0].token_exchanges, 2)
+
+		self.assertRaises(frappe.ValidationError, get_sync_run_summary, group_by="status")
@@ -0,0 +1,112 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+from typing import Dict, Optional, Tuple
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+from banking.klarna_kosma_integration.admin import Admin
+
+
+class BankTransactionBackfill(Document):
+	def enqueue(self) -> None:
+		"""Run the backfill in a background job, unless it is queued or running already."""
+		frappe.enqueue(
+			"banking.klarna_kosma_integration.doctype.bank_transaction_backfill.bank_transaction_backfill.run_backfill",
+			queue="long",
+			job_id=f"bank_transaction_backfill::{self.name}",
+			deduplicate=True,
+			enqueue_after_commit=True,
+			backfill=self.name,
+			now=frappe.conf.developer_mode,
+		)
+
+	@frappe.whitelist()
+	def resume(self) -> None:
+		"""Resume a failed backfill from its last checkpoint."""
+		if self.status != "Failed":
+			frappe.throw(_("Only failed backfills can be resumed."))
+
+		self.status = "Queued"
+		self.error = None
+		self.save()
+		self.enqueue()
+
+	def start(self) -> None:
+		self.status = "Running"
+		self.save_checkpoint()
+
+	def checkpoint(self, stats: Optional[Dict], next_page: Optional[Tuple[str, str]]) -> None:
+		"""Record a committed page and the next page to fetch. Without one, the backfill is done."""
+		self.pages_done += 1
+		if stats:
+			self.transactions_inserted += stats.inserted
+			self.transactions_skipped += stats.skipped
+			self.transactions_failed += stats.failed
+
+		if next_page:
+			self.next_url, self.next_offset = next_page
+		else:
+			self.status = "Completed"
+			self.next_url = self.next_offset = None
+
+		self.save_checkpoint()
+
+	def fail(self, error: str) -> None:
+		self.status = "Failed"
+		self.error = error
+		self.save_checkpoint()
+
+	def save_checkpoint(self) -> None:
+		self.last_checkpoint_on = now_datetime()
+		self.save(ignore_permissions=True)
+		frappe.db.commit()
+		self.publish_progress()
+
+	def publish_progress(self) -> None:
+		frappe.publish_realtime(
+			"bank_transaction_backfill",
+			{
+				"name": self.name,
+				"bank_account": self.bank_account,
+				"status": self.status,
+				"pages_done": self.pages_done,
+				"inserted": self.transactions_inserted,
+				"failed": self.transactions_failed,
+			},
+			user=self.owner,
+			doctype=self.doctype,
+			docname=self.name,
+		)
+
+
+def create_backfill(bank_account: str, session_id_short: str) -> BankTransactionBackfill:
+	backfill = frappe.get_doc(
+		{
+			"doctype": "Bank Transaction Backfill",
+			"bank_account": bank_account,
+			"session_id_short": session_id_short,
+		}
+	).insert()
+	backfill.enqueue()
+	return backfill
+
+
+def run_backfill(backfill: str) -> None:
+	Admin().backfill_transactions(frappe.get_doc("Bank Transaction Backfill", backfill))
+
+
+def resume_interrupted_backfills() -> None:
+	"""
+	Re-enqueue backfills that are queued or were running when their worker died.
+	Backfills whose job is still queued or running are not enqueued again.
+	Called via hooks.
+	"""
+	for name in frappe.get_all(
+		"Bank Transaction Backfill",
+		filters={"status": ["in", ["Queued", "Running"]]},
+		pluck="name",
+	):
+		frappe.get_doc("Bank Transaction Backfill", name).enqueue()
@@ -0,0 +1,140 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import heapq
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+
+import frappe
+from frappe.deferred_insert import deferred_insert
+from frappe.model.document import Document
+from frappe.utils import now_datetime, sbool
+
+PROFILE_HEADER = "X-Banking-Profile"
+SLOWEST_QUERIES = 5
+MAX_QUERY_LENGTH = 1000
+
+
+class BankingProfileLog(Document):
+	"""
+	SQL queries and timings of one call to a whitelisted endpoint. Inserted
+	deferred, so that logging neither commits nor is rolled back with the call.
+	"""
+
+
+def profile(fn: Callable) -> Callable:
+	"""
+	Profile calls of `fn` if profiling is enabled in Banking Settings or, for
+	System Managers, by the `X-Banking-Profile` request header. Put it below
+	`@frappe.whitelist()`. Calls within a profiled call are part of its profile.
+	"""
+
+	@wraps(fn)
+	def wrapper(*args, **kwargs):
+		if frappe.flags.banking_profiler or not is_profiling_enabled():
+			return fn(*args, **kwargs)
+
+		with Profiler(f"{fn.__module__}.{fn.__qualname__}"):
+			return fn(*args, **kwargs)
+
+	return wrapper
+
+
+def is_profiling_enabled() -> bool:
+	if (
+		frappe.request
+		and sbool(frappe.get_request_header(PROFILE_HEADER))
+		and "System Manager" in frappe.get_roles()
+	):
+		return True
+
+	return bool(frappe.get_cached_doc("Banking Settings").get("enable_profiling"))
+
+
+def get_http_timer() -> Optional[Callable[[float], None]]:
+	"""
+	Return a callback that adds the duration of an Admin App request to the
+	active profile, or None if nothing is profiled. The callback can be passed
+	to request clients and called from any thread, e.g. while prefetching.
+	"""
+	profiler = frappe.flags.banking_profiler
+	return profiler.add_http_time if profiler else None
+
+
+class Profiler:
+	"""
+	Count and time the SQL queries and Admin App requests run in this block.
+	The result is logged and added to the response as `banking_profile`.
+	"""
+
+	def __init__(self, method: str) -> None:
+		self.method = method
+		self.query_count = 0
+		self.db_time = 0.0
+		self.http_time = 0.0  # summed up, concurrent requests overlap
+		self.http_lock = threading.Lock()
+		self.slowest_queries = []  # heap of (duration, index, query)
+
+	def __enter__(self) -> "Profiler":
+		frappe.flags.banking_profiler = self
+		self.sql = frappe.db.sql
+		frappe.db.sql = self.timed_sql
+
+		self.started_on = now_datetime()
+		self.start = time.monotonic()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback) -> None:
+		duration = time.monotonic() - self.start
+		frappe.db.sql = self.sql
+		frappe.flags.banking_profiler = None
+
+		result = {
+			"method": self.method,
+			"status": "Failed" if exc_type else "Completed",
+			"duration": duration,
+			"query_count": self.query_count,
+			"db_time": self.db_time,
+			"http_time": self.http_time,
+			"slowest_queries": self.get_slowest_queries(),
+		}
+		frappe.response["banking_profile"] = result
+		deferred_insert(
+			"Banking Profile Log",
+			frappe.as_json(
+				[
+					{
+						**result,
+						"slowest_queries": frappe.as_json(result["slowest_queries"]),
+						"user": frappe.session.user,
+						"started_on": self.started_on,
+					}
+				]
+			),
+		)
+
+	def add_http_time(self, duration: float) -> None:
+		with self.http_lock:
+			self.http_time += duration
+
+	def timed_sql(self, query, *args, **kwargs):
+		start = time.monotonic()
+		try:
+			return self.sql(query, *args, **kwargs)
+		finally:
+			duration = time.monotonic() - start
+			self.query_count += 1
+			self.db_time += duration
+
+			entry = (duration, self.query_count, str(query)[:MAX_QUERY_LENGTH])
+			if len(self.slowest_queries) < SLOWEST_QUERIES:
+				heapq.heappush(self.slowest_queries, entry)
+			else:
+				heapq.heappushpop(self.slowest_queries, entry)
+
+	def get_slowest_queries(self) -> List[Dict]:
+		return [
+			{"duration": round(duration, 6), "position": position, "query": query}
+			for duration, position, query in sorted(self.slowest_queries, reverse=True)
+		]
@@ -0,0 +1,123 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import frappe
+from frappe.deferred_insert import save_to_db
+from frappe.tests.utils import FrappeTestCase
+
+from banking.connectors.admin_request import AdminRequest
+from banking.connectors.page_prefetcher import PagePrefetcher
+from banking.klarna_kosma_integration.doctype.banking_profile_log.banking_profile_log import (
+	get_http_timer,
+	profile,
+)
+
+REQUEST_TIME = 0.05  # seconds
+
+
+class SlowAdminHandler(BaseHTTPRequestHandler):
+	def do_POST(self):
+		self.rfile.read(int(self.headers["Content-Length"]))
+		time.sleep(REQUEST_TIME)
+		content = b'{"message": {}}'
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def log_message(self, *args):
+		pass
+
+
+@profile
+def count_banks(fail: bool = False) -> int:
+	count = frappe.db.count("Bank")
+	frappe.db.sql("SELECT 1")
+	if fail:
+		frappe.throw("Failed")
+
+	return count
+
+
+@profile
+def count_banks_twice() -> int:
+	return count_banks() + count_banks()
+
+
+@profile
+def fetch_pages(url: str, count: int) -> list:
+	"""Fetch pages in a background thread, like a prefetched sync."""
+	request = AdminRequest(
+		ip_address=None,
+		user_agent=None,
+		api_token="xabsttcpQr5",
+		url=url,
+		customer_id="ADCB8A",
+		use_test_environment=True,
+		on_request_time=get_http_timer(),
+	)
+
+	def next_cursor(page, cursor):
+		return cursor + 1 if cursor < count else None
+
+	def fetch_page(cursor):
+		return request.fetch_subscription()
+
+	with PagePrefetcher(fetch_page, next_cursor, 1) as pages:
+		return list(pages)
+
+
+class TestBankingProfileLog(FrappeTestCase):
+	def setUp(self):
+		frappe.db.delete("Banking Profile Log")
+		frappe.response.pop("banking_profile", None)
+
+	def test_disabled(self):
+		frappe.db.set_single_value("Banking Settings", "enable_profiling", 0)
+		count_banks()
+		self.assertNotIn("banking_profile", frappe.response)
+
+	def test_profile(self):
+		frappe.db.set_single_value("Banking Settings", "enable_profiling", 1)
+		self.addCleanup(frappe.db.set_single_value, "Banking Settings", "enable_profiling", 0)
+
+		count_banks_twice()
+		result = frappe.response["banking_profile"]
+		self.assertTrue(result["method"].endswith("count_banks_twice"))
+		self.assertEqual(result["status"], "Completed")
+		self.assertEqual(result["query_count"], 4)
+		self.assertLessEqual(result["db_time"], result["duration"])
+		self.assertLessEqual(len(result["slowest_queries"]), 5)
+
+		self.assertRaises(frappe.ValidationError, count_banks, fail=True)
+		self.assertEqual(frappe.response["banking_profile"]["status"], "Failed")
+
+		# nested calls are part of the outer profile
+		save_to_db()
+		self.assertEqual(
+			frappe.get_all("Banking Profile Log", pluck="status", order_by="started_on"),
+			["Completed", "Failed"],
+		)
+
+	def test_profile_prefetched_requests(self):
+		frappe.db.set_single_value("Banking Settings", "enable_profiling", 1)
+		self.addCleanup(
+			frappe.db.set_single_value, "Banking Settings", "enable_profiling", 0
+		)
+
+		server = ThreadingHTTPServer(("127.0.0.1", 0), SlowAdminHandler)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		self.addCleanup(server.shutdown)
+
+		pages = fetch_pages(f"http://127.0.0.1:{server.server_port}/api/method/", 3)
+		self.assertEqual(len(pages), 3)
+
+		# the requests ran in the prefetching thread
+		result = frappe.response["banking_profile"]
+		self.assertGreaterEqual(result["http_time"], 3 * REQUEST_TIME)
+		self.assertLessEqual(result["http_time"], result["duration"])
@@ -357,8 +357,8 @@ class KlarnaKosmaConnect {
 	}
 
 	async complete_transactions_flow()  {
-		// Enqueue transactions fetch via Consent API
-		await this.frm.call({
+		// Enqueue transactions fetch via Consent API, or a backfill via Flow API
+		const r = await this.frm.call({
 			method: "sync_transactions",
 			args: {
 				account: this.account,
@@ -368,6 +368,38 @@ class KlarnaKosmaConnect {
 			freeze_message: __("Please wait. Syncing Bank Transactions ...")
 		});
 
+		if (r.message) {
+			this.show_backfill_progress(r.message);
+		}
+	}
+
+	show_backfill_progress(backfill) {
+		const title = __("Importing Bank Transactions");
+		frappe.realtime.off("bank_transaction_backfill");
+		frappe.realtime.on("bank_transaction_backfill", (data) => {
+			if (data.name !== backfill) return;
+
+			const running = ["Queued", "Running"].includes(data.status);
+			frappe.show_progress(
+				title,
+				data.pages_done,
+				running ? data.pages_done + 1 : data.pages_done,
+				__("{0} transactions imported", [data.inserted])
+			);
+
+			if (!running) {
+				frappe.hide_progress();
+				frappe.realtime.off("bank_transaction_backfill");
+				frappe.show_alert({
+					message: data.status === "Completed"
+						? __("{0} transactions imported", [data.inserted])
+						: __("Import failed. It can be resumed from {0}", [
+							frappe.utils.get_form_link("Bank Transaction Backfill", backfill, true)
+						]),
+					indicator: data.status === "Completed" ? "green" : "red",
+				});
+			}
+		});
 	}
 
 	async fetch_accounts_data() {
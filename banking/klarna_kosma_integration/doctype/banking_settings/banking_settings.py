@@ -7,9 +7,17 @@ from typing import Dict, Optional, Union
 import frappe
 from frappe import _
 from frappe.model.document import Document
+from frappe.utils import cint
 
+from banking.connectors.admin_request import get_pool_metrics
 from banking.klarna_kosma_integration.admin import Admin
-from banking.klarna_kosma_integration.exception_handler import BankingError
+from banking.klarna_kosma_integration.doctype.bank_transaction_backfill.bank_transaction_backfill import (
+	create_backfill,
+)
+from banking.klarna_kosma_integration.doctype.banking_profile_log.banking_profile_log import (
+	profile,
+)
+from banking.klarna_kosma_integration.sync import SyncOrchestrator
 from banking.klarna_kosma_integration.utils import (
 	create_bank_account,
 	needs_consent,
@@ -23,6 +31,7 @@ class BankingSettings(Document):
 
 
 @frappe.whitelist()
+@profile
 def get_client_token(
 	current_flow: str,
 	account: Optional[str] = None,
@@ -37,6 +46,7 @@ def get_client_token(
 
 
 @frappe.whitelist()
+@profile
 def fetch_accounts_and_bank(session_id_short: str = None, company: str = None) -> Dict:
 	"""
 	Fetch Accounts via Flow API after XS2A App interaction.
@@ -45,6 +55,7 @@ def fetch_accounts_and_bank(session_id_short: str = None, company: str = None) -
 
 
 @frappe.whitelist()
+@profile
 def add_bank_account(
 	account_data: Union[str, dict], gl_account: str, company: str, bank_name: str
 ) -> None:
@@ -61,9 +72,11 @@ def add_bank_account(
 
 
 @frappe.whitelist()
-def sync_transactions(account: str, session_id_short: Optional[str] = None) -> None:
+@profile
+def sync_transactions(account: str, session_id_short: Optional[str] = None) -> Optional[str]:
 	"""
 	Enqueue transactions sync via the Consent API.
+	With a Flow API session, start a resumable backfill and return its name.
 	"""
 	bank, company = frappe.db.get_value("Bank Account", account, ["bank", "company"])
 
@@ -75,12 +88,15 @@ def sync_transactions(account: str, session_id_short: Optional[str] = None) -> N
 			title=_("Kosma Error"),
 		)
 
-	frappe.enqueue(
-		"banking.klarna_kosma_integration.admin.sync_kosma_transactions",
-		account=account,
-		session_id_short=session_id_short,
-		now=frappe.conf.developer_mode,
-	)
+	backfill = None
+	if session_id_short:
+		backfill = create_backfill(account, session_id_short).name
+	else:
+		frappe.enqueue(
+			"banking.klarna_kosma_integration.admin.sync_kosma_transactions",
+			account=account,
+			now=frappe.conf.developer_mode,
+		)
 
 	frappe.msgprint(
 		_(
@@ -89,59 +105,29 @@ def sync_transactions(account: str, session_id_short: Optional[str] = None) -> N
 		alert=True,
 		indicator="green",
 	)
+	return backfill
 
 
 @frappe.whitelist()
+@profile
 def sync_all_accounts_and_transactions():
 	"""
 	Refresh all Bank accounts and enqueue their transactions sync, via the Consent API.
 	Called via hooks.
 	"""
-	if not frappe.db.get_single_value("Banking Settings", "enabled"):
+	settings = frappe.get_single("Banking Settings")
+	if not settings.enabled:
 		return
 
-	accounts_list = []
-
-	for bank, company in frappe.get_all(
-		"Bank Consent", fields=["bank", "company"], as_list=True
-	):
-		accounts = get_bank_accounts_to_sync(bank, company)
-		for account in accounts:
-			bank_account = frappe.db.exists("Bank Account", {"iban": account.get("iban")})
-			if not bank_account:
-				continue
-
-			update_bank_account(account, bank_account)
-			accounts_list.append(bank_account)
-
-		if not accounts:
-			accounts_list.extend(
-				frappe.get_all(
-					"Bank Account",
-					filters={
-						"bank": bank,
-						"company": company,
-						"kosma_account_id": ["is", "set"],
-					},
-					pluck="name",
-				)
-			)
-
-	for bank_account in accounts_list:
-		sync_transactions(account=bank_account)
-
-
-def get_bank_accounts_to_sync(bank: str, company: str) -> list:
-	"""
-	Get bank accounts from Kosma via the consent API.
-	"""
-	try:
-		return Admin().consent_accounts(bank, company)
-	except BankingError:
-		return []
+	SyncOrchestrator(
+		max_workers=cint(settings.sync_workers) or 4,
+		max_requests_per_bank=cint(settings.max_requests_per_bank) or 2,
+		use_async=settings.use_async_sync,
+	).run()
 
 
 @frappe.whitelist()
+@profile
 def fetch_subscription_data() -> Dict:
 	"""
 	Fetch Accounts via Flow API after XS2A App interaction.
@@ -150,6 +136,7 @@ def fetch_subscription_data() -> Dict:
 
 
 @frappe.whitelist()
+@profile
 def get_customer_portal_url() -> str:
 	"""
 	Returns the customer portal URL.
@@ -158,6 +145,18 @@ def get_customer_portal_url() -> str:
 
 
 @frappe.whitelist()
+@profile
+def get_connection_pool_metrics() -> Dict:
+	"""
+	Returns the request counters and connection pool state of the Admin app
+	HTTP session in the current worker process.
+	"""
+	frappe.only_for("System Manager")
+	return get_pool_metrics()
+
+
+@frappe.whitelist()
+@profile
 def get_app_health() -> Dict:
 	"""
 	Returns the app health.
@@ -0,0 +1,174 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import suppress
+from typing import Dict, List, Tuple
+
+import frappe
+from frappe import _
+
+from banking.klarna_kosma_integration.admin import Admin
+from banking.klarna_kosma_integration.doctype.bank_sync_run.bank_sync_run import new_sync_run
+from banking.klarna_kosma_integration.exception_handler import ExceptionHandler
+from banking.klarna_kosma_integration.utils import (
+	get_consent_data,
+	needs_consent,
+	update_bank_account,
+)
+
+Consent = Tuple[str, str]  # (bank, company)
+
+
+class SyncOrchestrator:
+	"""
+	Refresh the accounts of all Bank Consents and enqueue their transactions sync.
+
+	Account refreshes are fanned out over a thread pool, with at most
+	`max_requests_per_bank` concurrent requests per bank. The threads only do
+	HTTP requests, responses are processed on the calling thread.
+	Accounts that share a consent are synced in one background job, since
+	every request exchanges the consent token. With `use_async`, all accounts
+	are synced in a single job that fetches them concurrently (see `AsyncAdmin`).
+	The account refresh is recorded as a "Scheduled" Bank Sync Run.
+	"""
+
+	def __init__(
+		self, max_workers: int = 4, max_requests_per_bank: int = 2, use_async: bool = False
+	) -> None:
+		self.admin = Admin()
+		self.sync_run = new_sync_run("Scheduled")
+		self.max_workers = max(max_workers, 1)
+		self.use_async = use_async
+		self.bank_limits = defaultdict(
+			lambda: threading.BoundedSemaphore(max(max_requests_per_bank, 1))
+		)
+
+	def run(self) -> Dict[Consent, List[str]]:
+		try:
+			accounts_by_consent = self.refresh_accounts(self.get_consents())
+		except Exception as exc:
+			self.sync_run.finish("Failed", str(exc))
+			raise
+
+		self.sync_run.accounts = sum(len(accounts) for accounts in accounts_by_consent.values())
+		self.sync_run.finish()
+
+		if self.use_async:
+			enqueue_async_sync(
+				[account for accounts in accounts_by_consent.values() for account in accounts],
+				max_concurrency=self.max_workers,
+			)
+			return accounts_by_consent
+
+		for (bank, company), accounts in accounts_by_consent.items():
+			if accounts:
+				enqueue_consent_sync(bank, company, accounts)
+
+		return accounts_by_consent
+
+	def get_consents(self) -> List[Consent]:
+		consents = []
+		for bank, company in frappe.get_all(
+			"Bank Consent", fields=["bank", "company"], as_list=True
+		):
+			if needs_consent(bank, company):
+				frappe.log_error(
+					title=_("Banking Error"),
+					message=_("Skipped sync of Bank {0}: the consent has expired.").format(bank),
+				)
+				continue
+
+			consents.append((bank, company))
+
+		return consents
+
+	def refresh_accounts(self, consents: List[Consent]) -> Dict[Consent, List[str]]:
+		"""Return the Bank Accounts to sync, per consent."""
+		accounts_by_consent = {}
+		with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+			futures = {
+				executor.submit(self.fetch_accounts, bank, *get_consent_data(bank, company)): (
+					bank,
+					company,
+				)
+				for bank, company in consents
+			}
+
+			for future in as_completed(futures):
+				bank, company = futures[future]
+				accounts = self.process_accounts(future, bank, company)
+				accounts_by_consent[(bank, company)] = self.get_bank_accounts(
+					accounts, bank, company
+				)
+
+		return accounts_by_consent
+
+	def fetch_accounts(self, bank: str, consent_id: str, consent_token: str):
+		"""Runs in a worker thread: no database access here."""
+		with self.bank_limits[bank]:
+			return self.admin.request.consent_accounts(consent_id, consent_token)
+
+	def process_accounts(self, future, bank: str, company: str) -> list:
+		try:
+			return self.admin.process_consent_accounts(
+				future.result(), bank, company, sync_run=self.sync_run
+			)
+		except Exception as exc:
+			# log the error, but don't let one bank stop the sync of the others
+			with suppress(Exception):
+				ExceptionHandler(exc)
+
+			return []
+
+	def get_bank_accounts(self, accounts: list, bank: str, company: str) -> List[str]:
+		bank_accounts = []
+		for account in accounts:
+			bank_account = frappe.db.exists("Bank Account", {"iban": account.get("iban")})
+			if not bank_account:
+				continue
+
+			update_bank_account(account, bank_account)
+			bank_accounts.append(bank_account)
+
+		if not accounts:
+			bank_accounts.extend(
+				frappe.get_all(
+					"Bank Account",
+					filters={
+						"bank": bank,
+						"company": company,
+						"kosma_account_id": ["is", "set"],
+					},
+					pluck="name",
+				)
+			)
+
+		return bank_accounts
+
+
+def enqueue_consent_sync(bank: str, company: str, accounts: List[str]) -> None:
+	"""Sync the transactions of all accounts of a consent in one background job."""
+	frappe.enqueue(
+		"banking.klarna_kosma_integration.admin.sync_kosma_consent_transactions",
+		queue="long",
+		job_name=f"Bank Sync: {bank} ({company})",
+		accounts=accounts,
+		now=frappe.conf.developer_mode,
+	)
+
+
+def enqueue_async_sync(accounts: List[str], max_concurrency: int) -> None:
+	"""Sync the transactions of all accounts in one job, fetched on one event loop."""
+	if not accounts:
+		return
+
+	frappe.enqueue(
+		"banking.klarna_kosma_integration.async_admin.sync_kosma_transactions_async",
+		queue="long",
+		job_name="Bank Sync: all accounts",
+		accounts=accounts,
+		max_concurrency=max_concurrency,
+		now=frappe.conf.developer_mode,
+	)
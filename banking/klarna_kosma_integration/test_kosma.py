@@ -1,4 +1,7 @@
 import json
+import threading
+from unittest.mock import MagicMock, patch
+
 import frappe
 
 from frappe.client import get_count
@@ -18,11 +21,16 @@ from banking.klarna_kosma_integration.doctype.banking_settings.banking_settings
 	add_bank_account,
 )
 from banking.klarna_kosma_integration.admin import Admin
+from banking.klarna_kosma_integration.doctype.bank_account_sync_state.bank_account_sync_state import (
+	get_sync_state,
+)
 from banking.klarna_kosma_integration.utils import (
 	add_bank,
 	create_bank_transactions,
 	create_session_doc,
 	get_account_name,
+	get_consent_data,
+	get_sync_start,
 )
 
 from erpnext.accounts.doctype.journal_entry.journal_entry import (
@@ -173,10 +181,12 @@ class TestKosma(FrappeTestCase):
 		transaction = AdminTransaction(transactions_consent_response)
 		self.assertFalse(transaction.is_next_page())
 
-		create_bank_transactions(
+		stats = create_bank_transactions(
 			account=f"My checking account (Max Mustermann) - {bank_name}",
 			transactions=transaction.transaction_list,
 		)
+		self.assertEqual(stats.received, len(transaction.transaction_list))
+		self.assertEqual(stats.inserted, 17)
 
 		test_transn_dict = transaction.transaction_list[0]
 		test_transn_doc = frappe.get_doc(
@@ -204,6 +214,127 @@ class TestKosma(FrappeTestCase):
 		# Test last sync date correctness
 		self.assertEqual(getdate(last_sync_date), actual_last_sync_date)
 
+		# Re-syncing the same page must not create duplicates
+		stats = create_bank_transactions(
+			account=f"My checking account (Max Mustermann) - {bank_name}",
+			transactions=transaction.transaction_list,
+		)
+		self.assertEqual(stats.inserted, 0)
+		self.assertEqual(get_count("Bank Transaction"), 17)
+
+		# Transactions outside of the preloaded sync window are skipped as well
+		frappe.clear_messages()
+		stats = create_bank_transactions(
+			account=f"My checking account (Max Mustermann) - {bank_name}",
+			transactions=transaction.transaction_list,
+			known_ids=set(),
+		)
+		self.assertEqual(stats.inserted, 0)
+		self.assertEqual(stats.skipped, stats.received)
+		self.assertEqual(frappe.message_log, [])  # duplicates are skipped silently
+		self.assertEqual(get_count("Bank Transaction"), 17)
+
+	def test_sync_state(self):
+		"""Test the sync watermark, overlap window and resume cursor"""
+		bank_name = add_bank(bank_data_response)
+		account = (
+			frappe.get_doc(
+				{
+					"doctype": "Bank Account",
+					"account_name": "Sync State Account",
+					"bank": bank_name,
+					"company": "Bolt Trades",
+					"is_company_account": 1,
+					"account": create_account_for_bank_account("Sync State Account"),
+				}
+			)
+			.insert()
+			.name
+		)
+		frappe.db.set_single_value("Banking Settings", "sync_overlap_days", 3)
+
+		sync_state = get_sync_state(account)
+		sync_state.start("2024-01-01")
+		self.assertEqual(get_sync_start(account), ("2024-01-01", None, None))
+
+		# An interrupted sync resumes from the next page
+		sync_state.update_progress(
+			frappe._dict(last_value_date=getdate("2024-01-20"), last_transaction_id="T2"),
+			("https://next-page", "100"),
+		)
+		self.assertEqual(get_sync_start(account), ("2024-01-01", "https://next-page", "100"))
+
+		# A failed resumed sync restarts from its start date
+		sync_state.fail(resumed=True)
+		self.assertEqual(get_sync_start(account), ("2024-01-01", None, None))
+
+		# Older pages don't move the watermark back
+		sync_state.update_progress(
+			frappe._dict(last_value_date=getdate("2024-01-10"), last_transaction_id="T1"), None
+		)
+		self.assertEqual(sync_state.status, "Completed")
+		self.assertEqual(sync_state.last_transaction_id, "T2")
+
+		# A completed sync starts at the watermark minus the overlap
+		self.assertEqual(get_sync_start(account), ("2024-01-17", None, None))
+
+	def test_prefetched_consent_tokens_are_kept(self):
+		"""Page 1 fails to insert while page 2 is prefetched: page 2's token is kept"""
+		session_data = session_response.session_data
+		create_session_doc(session_data, session_response.flow_data)
+		bank_name = add_bank(bank_data_response)
+		account = (
+			frappe.get_doc(
+				{
+					"doctype": "Bank Account",
+					"account_name": "Prefetch Account",
+					"bank": bank_name,
+					"company": "Bolt Trades",
+					"is_company_account": 1,
+					"account": create_account_for_bank_account("Prefetch Account"),
+					"kosma_account_id": "prefetch-account",
+				}
+			)
+			.insert()
+			.name
+		)
+		Admin().set_consent(
+			consent=get_formatted_consent(),
+			bank_name=bank_name,
+			session_id_short=session_data.get("session_id_short"),
+			company="Bolt Trades",
+		)
+
+		page_2_fetched = threading.Event()
+		pages = [
+			get_page_response("token-1", next_offset="100"),
+			get_page_response("token-2"),
+		]
+
+		def consent_transactions(*args, **kwargs):
+			if len(pages) == 1:
+				page_2_fetched.set()
+			return pages.pop(0)
+
+		def create_bank_transactions(*args, **kwargs):
+			page_2_fetched.wait(timeout=5)
+			raise ValueError("Insert failed")
+
+		admin = Admin()
+		admin.stream_pages = False
+		admin.request = MagicMock()
+		admin.request.consent_transactions.side_effect = consent_transactions
+		with patch(
+			"banking.klarna_kosma_integration.admin.create_bank_transactions",
+			create_bank_transactions,
+		):
+			self.assertRaises(
+				ValueError, admin.consent_transactions, account, "2022-01-01"
+			)
+
+		self.assertTrue(page_2_fetched.is_set())
+		self.assertEqual(get_consent_data(bank_name, "Bolt Trades")[1], "token-2")
+
 	def test_bank_consent_set_get(self):
 		from banking.klarna_kosma_integration.utils import (
 			get_consent_data,
@@ -242,6 +373,23 @@ def get_formatted_consent():
 	}
 
 
+def get_page_response(consent_token: str, next_offset: str = None) -> MagicMock:
+	"""Return a successful consent transactions response."""
+	result = dict(transactions_consent_response["result"], pagination={})
+	if next_offset:
+		result["pagination"] = {
+			"url": "https://next-page",
+			"next": {"offset": next_offset},
+		}
+
+	response = MagicMock(ok=True, headers={"Content-Type": "application/json"})
+	message = dict(
+		transactions_consent_response, result=result, consent_token=consent_token
+	)
+	response.json.return_value = {"message": message}
+	return response
+
+
 def create_account_for_bank_account(account_name: str):
 	gl_account = frappe.get_doc(
 		{
@@ -1,7 +1,9 @@
 # Copyright (c) 2022, ALYF GmbH and contributors
 # For license information, please see license.txt
 import json
-from typing import TYPE_CHECKING, Dict, List, Optional
+import time
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
 from banking.klarna_kosma_integration.exception_handler import ExceptionHandler
 
 import frappe
@@ -10,12 +12,19 @@ from frappe import _
 from frappe.utils import (
 	add_days,
 	add_to_date,
+	cint,
 	formatdate,
 	get_datetime,
 	get_first_day,
 	getdate,
 	nowdate,
 )
+from frappe.utils.caching import request_cache
+
+from banking.klarna_kosma_integration.doctype.bank_account_sync_state.bank_account_sync_state import (
+	get_sync_state,
+)
+from banking.reconciliation.counterparty import set_counterparty_party
 
 if TYPE_CHECKING:
 	from frappe.model.document import Document
@@ -52,6 +61,15 @@ SUPPORTED_COUNTRIES = [
 	"United States",
 ]
 
+# Days before the sync start date for which known transaction IDs are preloaded
+DEDUP_BUFFER_DAYS = 7
+
+# Transactions of a streamed page that are deduplicated and inserted at once
+STREAM_INSERT_CHUNK_SIZE = 200
+
+# Unique index on Bank Transaction (bank_account, transaction_id)
+TRANSACTION_ID_INDEX = "unique_bank_account_transaction_id"
+
 
 def needs_consent(bank: str, company: str) -> bool:
 	"""Returns False if there is atleast 1 hour before consent expires."""
@@ -230,20 +248,74 @@ def get_account_name(account: Dict) -> str:
 
 
 def create_bank_transactions(
-	account: str, transactions: List[Dict], via_flow_api: bool = False
-) -> None:
-	last_sync_date = None
+	account: str,
+	transactions: List[Dict],
+	via_flow_api: bool = False,
+	known_ids: Optional[Set[str]] = None,
+	update_last_sync_date: bool = True,
+	skip_failed: bool = False,
+) -> Dict:
+	"""
+	Insert a page of Kosma transactions as submitted Bank Transactions.
+
+	The whole page is deduplicated against existing `transaction_id`s in one query,
+	or against `known_ids` (see `get_known_transaction_ids`) without any query.
+	Each new transaction is inserted and submitted in a single document lifecycle.
+	With `skip_failed`, a transaction that fails to insert is logged and skipped
+	instead of failing the whole page.
+	Returns the page statistics and timings.
+	"""
+	stats = frappe._dict(received=len(transactions), inserted=0, skipped=0, failed=0)
+	stats.last_sync_date = last_sync_date = None
+	stats.last_value_date = stats.last_transaction_id = None
 	try:
-		for transaction in reversed(transactions):
-			transaction_created = new_bank_transaction(account, transaction)
-
-			if not transaction_created or via_flow_api:
-				# Don't set last integration date if via Flow API (one time action with arbitrary time period)
-				# or if transaction was not inserted
+		start = time.monotonic()
+		new_transactions = filter_new_transactions(account, transactions, known_ids)
+		stats.skipped = stats.received - len(new_transactions)
+		stats.dedup_time = time.monotonic() - start
+
+		start = time.monotonic()
+		for transaction in new_transactions:
+			# A failed statement aborts the whole transaction on Postgres
+			frappe.db.savepoint("bank_transaction")
+			message_count = len(frappe.message_log)
+
+			try:
+				insert_bank_transaction(account, transaction)
+			except frappe.UniqueValidationError:
+				# Exists outside of the preloaded sync window, caught by the unique index
+				frappe.db.rollback(save_point="bank_transaction")
+				# Expected, so drop the "must be unique" message shown to the user
+				del frappe.message_log[message_count:]
+				stats.skipped += 1
+				continue
+			except Exception:
+				if not skip_failed:
+					raise
+
+				frappe.db.rollback(save_point="bank_transaction")
+				frappe.log_error(
+					title=_("Kosma Transaction Error"),
+					message=frappe.get_traceback(),
+					reference_doctype="Bank Account",
+					reference_name=account,
+				)
+				stats.failed += 1
 				continue
 
-			last_sync_date = transaction.get("value_date") or transaction.get("date")
+			stats.inserted += 1
+
+			value_date = getdate(transaction.get("value_date") or transaction.get("date"))
+			if not stats.last_value_date or value_date >= stats.last_value_date:
+				stats.last_value_date = value_date
+				stats.last_transaction_id = transaction.get("transaction_id")
+
+			if not via_flow_api and update_last_sync_date:
+				# Don't set last integration date if via Flow API (one time action with arbitrary time period)
+				last_sync_date = transaction.get("value_date") or transaction.get("date")
 
+		stats.insert_time = time.monotonic() - start
+		stats.last_sync_date = last_sync_date
 	except Exception:
 		frappe.log_error(title=_("Kosma Transaction Error"), message=frappe.get_traceback())
 		frappe.throw(_("Error creating transactions"))
@@ -251,8 +323,130 @@ def create_bank_transactions(
 		if last_sync_date:
 			frappe.db.set_value("Bank Account", account, "last_integration_date", last_sync_date)
 
+	frappe.logger("banking").info(
+		f"Bank Account {account}: page of {stats.received} transactions, "
+		f"{stats.inserted} inserted, {stats.skipped} skipped, {stats.failed} failed "
+		f"(dedup {stats.dedup_time:.3f}s, insert {stats.insert_time:.3f}s)"
+	)
+	return stats
+
+
+def create_bank_transactions_in_chunks(
+	account: str,
+	transactions: Iterable[Dict],
+	via_flow_api: bool = False,
+	known_ids: Optional[Set[str]] = None,
+	chunk_size: int = STREAM_INSERT_CHUNK_SIZE,
+) -> Dict:
+	"""
+	Insert Kosma transactions from an iterable, e.g. a streamed page, in chunks.
+
+	Only `chunk_size` transactions are held in memory at a time. As for a whole page,
+	the last integration date is set from the newest inserted transaction, which
+	is in the first chunk that inserts anything.
+	"""
+	stats = frappe._dict(
+		received=0, inserted=0, skipped=0, failed=0, dedup_time=0.0, insert_time=0.0
+	)
+	transactions = iter(transactions)
+	while chunk := list(islice(transactions, chunk_size)):
+		chunk_stats = create_bank_transactions(
+			account,
+			chunk,
+			via_flow_api=via_flow_api,
+			known_ids=known_ids,
+			update_last_sync_date=not stats.inserted,
+		)
+		for key in ("received", "inserted", "skipped", "failed", "dedup_time", "insert_time"):
+			stats[key] += chunk_stats[key]
+
+		stats.last_sync_date = stats.last_sync_date or chunk_stats.last_sync_date
+		if chunk_stats.last_value_date and (
+			not stats.last_value_date or chunk_stats.last_value_date >= stats.last_value_date
+		):
+			stats.last_value_date = chunk_stats.last_value_date
+			stats.last_transaction_id = chunk_stats.last_transaction_id
+
+	return stats
+
+
+def filter_new_transactions(
+	account: str, transactions: List[Dict], known_ids: Optional[Set[str]] = None
+) -> List[Dict]:
+	"""
+	Return the transactions of a page that are not yet in the system, oldest first.
+
+	If `known_ids` is passed, it is used (and extended) as the set of existing IDs.
+	Otherwise existing `transaction_id`s are looked up for the whole page in one query.
+	The lookup is also made for IDs missing from `known_ids` if there is no unique
+	index to catch transactions that exist outside of the preloaded sync window.
+	Pending transactions and repeats within the page are dropped as well.
+	"""
+	transaction_ids = {row.get("transaction_id") for row in transactions} - {None, ""}
+	if known_ids is not None:
+		existing_ids = known_ids
+		if not has_unique_transaction_ids():
+			existing_ids.update(
+				get_existing_transaction_ids(account, transaction_ids - known_ids)
+			)
+	else:
+		existing_ids = set(get_existing_transaction_ids(account, transaction_ids))
+
+	new_transactions = []
+	for transaction in reversed(transactions):
+		transaction_id = transaction.get("transaction_id")
+
+		if not transaction_id and transaction.get("state") == "PENDING":
+			# Dont insert pending transactions. transaction_id is absent only for Pending state
+			# Ref: https://docs.openbanking.klarna.com/xs2a/objects/transaction.html
+			continue
+
+		if transaction_id in existing_ids:
+			continue
 
-def new_bank_transaction(account: str, transaction: Dict) -> bool:
+		if transaction_id:
+			existing_ids.add(transaction_id)
+
+		new_transactions.append(transaction)
+
+	return new_transactions
+
+
+def get_existing_transaction_ids(account: str, transaction_ids: Iterable[str]) -> List[str]:
+	"""Return the subset of `transaction_ids` that already exist for the Bank Account."""
+	transaction_ids = list(transaction_ids)
+	if not transaction_ids:
+		return []
+
+	return frappe.get_all(
+		"Bank Transaction",
+		filters={"bank_account": account, "transaction_id": ["in", transaction_ids]},
+		pluck="transaction_id",
+	)
+
+
+@request_cache
+def has_unique_transaction_ids() -> bool:
+	"""Return whether the unique index on (bank_account, transaction_id) exists."""
+	return bool(frappe.db.has_index("tabBank Transaction", TRANSACTION_ID_INDEX))
+
+
+def get_known_transaction_ids(account: str, from_date: Optional[str] = None) -> Set[str]:
+	"""
+	Preload the transaction IDs of a Bank Account for a sync window into a set.
+
+	The window starts `DEDUP_BUFFER_DAYS` before `from_date`, as a transaction's
+	value date can lie before the booking date the Admin app filters on.
+	"""
+	filters = {"bank_account": account, "transaction_id": ["is", "set"]}
+	if from_date:
+		filters["date"] = [">=", add_days(from_date, -DEDUP_BUFFER_DAYS)]
+
+	return set(frappe.get_all("Bank Transaction", filters=filters, pluck="transaction_id"))
+
+
+def insert_bank_transaction(account: str, transaction: Dict) -> "Document":
+	"""Insert and submit a Bank Transaction for a Kosma transaction."""
 	amount_data = transaction.get("amount", {})
 	amount = (
 		amount_data.get("amount", 0) / 100
@@ -262,16 +456,6 @@ def new_bank_transaction(account: str, transaction: Dict) -> bool:
 	debit = 0 if is_credit else float(amount)
 	credit = float(amount) if is_credit else 0
 
-	transaction_id = transaction.get("transaction_id")
-
-	if not transaction_id and transaction.get("state") == "PENDING":
-		# Dont insert pending transactions. transaction_id is absent only for Pending state
-		# Ref: https://docs.openbanking.klarna.com/xs2a/objects/transaction.html
-		return False
-
-	if frappe.db.exists("Bank Transaction", {"transaction_id": transaction_id}):
-		return False
-
 	new_transaction = frappe.get_doc(
 		{
 			"doctype": "Bank Transaction",
@@ -280,7 +464,7 @@ def new_bank_transaction(account: str, transaction: Dict) -> bool:
 			"deposit": credit,
 			"withdrawal": debit,
 			"currency": amount_data.get("currency"),
-			"transaction_id": transaction_id,
+			"transaction_id": transaction.get("transaction_id"),
 			"reference_number": transaction.get("bank_references", {}).get("end_to_end"),
 			"description": transaction.get("reference"),
 			"bank_party_name": transaction.get("counter_party", {}).get("holder_name"),
@@ -288,11 +472,12 @@ def new_bank_transaction(account: str, transaction: Dict) -> bool:
 			"bank_party_account_number": transaction.get("counter_party", {}).get(
 				"account_number"
 			),
+			# insert as submitted: runs validate, before_submit & on_submit in one lifecycle
+			"docstatus": 1,
 		}
 	)
-	new_transaction.insert()
-	new_transaction.submit()
-	return True
+	set_counterparty_party(new_transaction)
+	return new_transaction.insert()
 
 
 def get_from_to_date(from_date: Optional[str] = None, to_date: Optional[str] = None):
@@ -311,22 +496,52 @@ def to_json(response: requests.models.Response) -> Dict:
 	"""
 	Check if response is in JSON format. If not, return {}
 	"""
-	is_json = "application/json" in response.headers.get("Content-Type", "")
-	return response.json() if is_json else {}
+	return response.json() if is_json_response(response) else {}
+
+
+def is_json_response(response: requests.models.Response) -> bool:
+	return "application/json" in response.headers.get("Content-Type", "")
 
 
 def account_last_sync_date(account_name: str):
-	"""Get Account's Last Integration Date or Consent Start Date."""
+	"""
+	Get the start date for the next sync of an Account: the date of the newest
+	synced transaction (or the Last Integration Date) minus the overlap window,
+	but not before the Consent Start Date.
+	"""
 	last_sync_date, bank, company = frappe.db.get_value(
 		"Bank Account", account_name, ["last_integration_date", "bank", "company"]
 	)
-	if last_sync_date:
-		return formatdate(last_sync_date, "YYYY-MM-dd")
-	else:
-		date = frappe.db.get_value(
-			"Bank Consent", {"bank": bank, "company": company}, "consent_start"
-		)
-		return formatdate(date, "YYYY-MM-dd")
+	last_sync_date = (
+		frappe.db.get_value("Bank Account Sync State", account_name, "last_value_date")
+		or last_sync_date
+	)
+	consent_start = frappe.db.get_value(
+		"Bank Consent", {"bank": bank, "company": company}, "consent_start"
+	)
+	if not last_sync_date:
+		return formatdate(consent_start, "YYYY-MM-dd")
+
+	# Transactions can be booked late, so recent days are requested again
+	overlap_days = cint(frappe.db.get_single_value("Banking Settings", "sync_overlap_days"))
+	date = getdate(add_days(last_sync_date, -overlap_days))
+	if consent_start:
+		date = max(date, getdate(consent_start))
+
+	return formatdate(date, "YYYY-MM-dd")
+
+
+def get_sync_start(account_name: str) -> Tuple[str, Optional[str], Optional[str]]:
+	"""
+	Return `(start_date, url, offset)` for the next Consent API sync of an Account.
+	Resumes a sync that did not complete, else starts at `account_last_sync_date`.
+	"""
+	cursor = get_sync_state(account_name).get_cursor()
+	if cursor:
+		start_date, url, offset = cursor
+		return formatdate(start_date, "YYYY-MM-dd"), url, offset
+
+	return account_last_sync_date(account_name), None, None
 
 
 def get_consent_start_date(session_id_short: str) -> str:
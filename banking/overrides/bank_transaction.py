@@ -4,21 +4,39 @@ from frappe.core.utils import find
 from frappe.model.document import Document
 from frappe.utils import flt, getdate
 
-from erpnext import get_default_cost_center
 from erpnext.accounts.doctype.payment_entry.payment_entry import (
 	get_payment_entry,
 	split_invoices_based_on_payment_terms,
 )
 from erpnext.accounts.doctype.bank_transaction.bank_transaction import BankTransaction
 
+from banking.reconciliation.master_data import (
+	get_account_details,
+	get_default_cost_center,
+	get_gl_account,
+	get_latest_period_closing_date,
+)
+
 from typing import Callable
 
 DOCTYPE, DOCNAME, AMOUNT, PARTY = 0, 1, 2, 3
 
 
 class CustomBankTransaction(BankTransaction):
-	def add_payment_entries(self, vouchers: list, reconcile_multi_party: bool = False):
-		"Add the vouchers with zero allocation. Save() will perform the allocations and clearance"
+	def validate(self):
+		# Empty IDs (e.g. from statement imports) must not collide in the unique index
+		if not self.transaction_id:
+			self.transaction_id = None
+
+		super().validate()
+
+	def add_payment_entries(
+		self, vouchers: list, reconcile_multi_party: bool = False, save: bool = True
+	):
+		"""
+		Add the vouchers with zero allocation. Save() will perform the allocations and clearance.
+		Pass `save=False` if the caller saves the Bank Transaction itself.
+		"""
 		if self.unallocated_amount <= 0.0:
 			frappe.throw(
 				frappe._("Bank Transaction {0} is already fully reconciled").format(self.name)
@@ -33,7 +51,7 @@ class CustomBankTransaction(BankTransaction):
 		else:
 			self.reconcile_paid_vouchers(vouchers)
 
-		if len(self.payment_entries) != pe_length_before:
+		if save and len(self.payment_entries) != pe_length_before:
 			self.save()  # runs on_update_after_submit
 
 	def validate_period_closing(self):
@@ -41,12 +59,7 @@ class CustomBankTransaction(BankTransaction):
 		Check if the Bank Transaction date is after the latest period closing date.
 		We cannot make PEs against this transaction's date (before period closing date).
 		"""
-		latest_period_close_date = frappe.db.get_value(
-			"Period Closing Voucher",
-			{"company": self.company, "docstatus": 1},
-			"posting_date",
-			order_by="posting_date desc",
-		)
+		latest_period_close_date = get_latest_period_closing_date(self.company)
 		if latest_period_close_date and getdate(self.date) <= getdate(
 			latest_period_close_date
 		):
@@ -123,9 +136,7 @@ class CustomBankTransaction(BankTransaction):
 
 		def _attach_invoice(row: dict, journal_entry: "Document") -> None:
 			second_account = get_debtor_creditor_account(row)
-			second_account_currency = frappe.db.get_value(
-				"Account", second_account, "account_currency"
-			)
+			second_account_currency = get_account_details(second_account).account_currency
 			if second_account_currency != company_currency:
 				frappe.throw(
 					_(
@@ -148,10 +159,9 @@ class CustomBankTransaction(BankTransaction):
 
 		self.validate_invoices_to_bill(invoices_to_bill, allow_multi_party=True)
 
-		company_account = frappe.get_value("Bank Account", self.bank_account, "account")
-		company, company_currency = frappe.get_value(
-			"Account", company_account, ["company", "account_currency"]
-		)
+		company_account = get_gl_account(self.bank_account)
+		company = get_account_details(company_account).company
+		company_currency = get_account_details(company_account).account_currency
 
 		journal_entry = frappe.new_doc("Journal Entry")
 		journal_entry.voucher_type = "Bank Entry"
@@ -193,7 +203,7 @@ class CustomBankTransaction(BankTransaction):
 
 		self.validate_invoices_to_bill(invoices_to_bill)
 
-		bank_account = frappe.db.get_value("Bank Account", self.bank_account, "account")
+		bank_account = get_gl_account(self.bank_account)
 		first_invoice = invoices_to_bill[0]
 		if first_invoice[DOCTYPE] == "Expense Claim":
 			from hrms.overrides.employee_payment_entry import get_payment_entry_for_employee
@@ -0,0 +1,53 @@
+import frappe
+
+from banking.klarna_kosma_integration.utils import TRANSACTION_ID_INDEX as INDEX_NAME
+
+INDEX_FIELDS = ["bank_account", "transaction_id"]
+
+
+def execute():
+	"""
+	Add a unique index on (bank_account, transaction_id) of Bank Transaction.
+
+	Transaction IDs are used to deduplicate synced transactions. If legacy duplicates
+	prevent a unique index, a regular index is added so that lookups stay indexed,
+	and syncs keep looking up every page's IDs until the patch is run again.
+	"""
+	if frappe.db.has_index("tabBank Transaction", INDEX_NAME):
+		return
+
+	# Empty IDs (e.g. from statement imports) must not collide in the unique index
+	frappe.db.sql(
+		"""UPDATE `tabBank Transaction` SET transaction_id = NULL WHERE transaction_id = ''"""
+	)
+
+	if has_duplicate_transaction_ids():
+		frappe.log_error(
+			title="Banking: Duplicate Transaction IDs",
+			message=(
+				"Bank Transactions with duplicate transaction IDs exist. "
+				"A non-unique index was added on (bank_account, transaction_id) "
+				"instead.\n\nCancel and delete the duplicates, then add the unique "
+				"index by running `bench --site <site> run-patch --force "
+				"banking.patches.add_bank_transaction_id_index`."
+			),
+		)
+		frappe.db.add_index("Bank Transaction", INDEX_FIELDS)
+		return
+
+	frappe.db.add_unique("Bank Transaction", INDEX_FIELDS, constraint_name=INDEX_NAME)
+
+
+def has_duplicate_transaction_ids() -> bool:
+	return bool(
+		frappe.db.sql(
+			"""
+			SELECT bank_account, transaction_id
+			FROM `tabBank Transaction`
+			WHERE transaction_id IS NOT NULL
+			GROUP BY bank_account, transaction_id
+			HAVING COUNT(*) > 1
+			LIMIT 1
+			"""
+		)
+	)
@@ -0,0 +1,58 @@
+import frappe
+
+# Composite indexes for the access paths of the matching queries of the Bank
+# Reconciliation Tool Beta and its list of Bank Transactions. Equality columns
+# come first, the range column (dates, amounts) last.
+INDEXES = {
+	"Bank Transaction": [
+		["bank_account", "docstatus", "date", "unallocated_amount"],
+	],
+	"Payment Entry": [
+		["paid_to", "docstatus", "clearance_date", "posting_date"],
+		["paid_from", "docstatus", "clearance_date", "posting_date"],
+	],
+	"Journal Entry Account": [
+		["account", "parent"],
+	],
+	"Sales Invoice Payment": [
+		["account", "clearance_date", "parent"],
+	],
+	"Sales Invoice": [
+		["company", "docstatus", "currency", "outstanding_amount"],
+	],
+	"Purchase Invoice": [
+		["cash_bank_account", "docstatus", "is_paid", "clearance_date"],
+		["company", "docstatus", "is_paid", "currency", "outstanding_amount"],
+	],
+	"Expense Claim": [
+		["company", "docstatus", "status"],
+	],
+	"Loan Disbursement": [
+		["disbursement_account", "docstatus", "clearance_date"],
+	],
+	"Loan Repayment": [
+		["payment_account", "docstatus", "clearance_date"],
+	],
+}
+
+
+def execute():
+	"""
+	Add composite indexes for reconciliation matching.
+
+	Doctypes of apps that are not installed (e.g. Lending) are skipped.
+	Existing indexes are kept, so this can run again after an app was installed.
+	"""
+	for doctype, indexes in INDEXES.items():
+		if not frappe.db.table_exists(doctype):
+			continue
+
+		for fields in indexes:
+			if not all(frappe.db.has_column(doctype, field) for field in fields):
+				continue
+
+			frappe.db.add_index(doctype, fields, index_name=get_index_name(fields))
+
+
+def get_index_name(fields: list) -> str:
+	return "banking_" + "_".join(fields)
@@ -0,0 +1,132 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, nowdate
+
+from erpnext.accounts.doctype.bank_transaction.test_bank_transaction import (
+	create_gl_account,
+)
+from erpnext.accounts.doctype.payment_entry.test_payment_entry import (
+	create_payment_entry,
+)
+
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta import (
+	get_transaction_queries,
+)
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.test_bank_reconciliation_tool_beta import (
+	create_bank,
+	create_bank_account,
+	create_bank_transaction,
+	create_customer,
+)
+from banking.patches.add_reconciliation_indexes import INDEXES, execute, get_index_name
+
+
+class TestAddReconciliationIndexes(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		execute()
+
+		create_bank()
+		cls.gl_account = create_gl_account("_Test Bank Index")
+		cls.bank_account = create_bank_account(
+			bank_account_name="Index Account", gl_account=cls.gl_account
+		)
+		cls.customer = create_customer(customer_name="Index Inc.")
+
+		# seed a few vouchers, so that the tables are not empty
+		cls.transactions = []
+		for amount in (100, 200, 300):
+			pe = create_payment_entry(
+				payment_type="Receive",
+				party_type="Customer",
+				party=cls.customer,
+				paid_from="Debtors - _TC",
+				paid_to=cls.gl_account,
+				paid_amount=amount,
+			)
+			pe.reference_no = f"Index{amount}"
+			pe.reference_date = nowdate()
+			pe.insert()
+			pe.submit()
+
+			cls.transactions += [
+				create_bank_transaction(deposit=amount, bank_account=cls.bank_account),
+				create_bank_transaction(withdrawal=amount, bank_account=cls.bank_account),
+			]
+
+	def test_indexes_exist(self):
+		for doctype, indexes in INDEXES.items():
+			if not frappe.db.table_exists(doctype):
+				continue
+
+			for fields in indexes:
+				if all(frappe.db.has_column(doctype, field) for field in fields):
+					self.assertTrue(
+						frappe.db.has_index(f"tab{doctype}", get_index_name(fields)),
+						f"Missing index on {doctype} ({', '.join(fields)})",
+					)
+
+	def test_matching_queries_use_indexes(self):
+		"""
+		EXPLAIN every matching query and check that the table it reads from can
+		use one of the indexes. On a small table, the optimizer may still prefer
+		a full scan, so `possible_keys` is checked rather than `key`.
+		"""
+		document_types = [
+			"payment_entry",
+			"journal_entry",
+			"sales_invoice",
+			"purchase_invoice",
+			"expense_claim",
+			"loan_disbursement",
+			"loan_repayment",
+			"bank_transaction",
+		]
+		# a deposit and a withdrawal
+		for transaction in self.transactions[:2]:
+			for include_unpaid in (False, True):
+				union_queries, _other_queries = get_transaction_queries(
+					self.gl_account,
+					"_Test Company",
+					transaction,
+					document_types + (["unpaid_invoices"] if include_unpaid else []),
+					from_date=add_days(transaction.date, -30),
+					to_date=transaction.date,
+				)
+				for query in union_queries:
+					self.assertUsesIndex(query)
+
+		# as in `get_bank_transactions`
+		transactions = frappe.qb.get_query(
+			"Bank Transaction",
+			filters={
+				"bank_account": self.bank_account,
+				"docstatus": 1,
+				"unallocated_amount": (">", 0.0),
+			},
+		)
+		self.assertUsesIndex(transactions)
+
+	def assertUsesIndex(self, query):
+		table = query._from[0].get_table_name()
+		doctype = table.removeprefix("tab")
+		if doctype not in INDEXES:
+			return
+
+		index_names = {get_index_name(fields) for fields in INDEXES[doctype]}
+		for row in explain(query):
+			if row.table != table:
+				continue
+
+			possible_keys = set((row.possible_keys or "").split(","))
+			self.assertTrue(
+				index_names & possible_keys,
+				f"No index used for {doctype}: {row.possible_keys}\n{query}",
+			)
+
+
+def explain(query) -> list[dict]:
+	return frappe.db.sql(f"EXPLAIN {query}", as_dict=True)
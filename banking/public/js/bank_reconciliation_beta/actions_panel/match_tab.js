@@ -3,6 +3,7 @@ frappe.provide("erpnext.accounts.bank_reconciliation");
 erpnext.accounts.bank_reconciliation.MatchTab = class MatchTab {
 	constructor(opts) {
 		$.extend(this, opts);
+		this.page_length = 50;
 		this.make();
 	}
 
@@ -40,8 +41,12 @@ erpnext.accounts.bank_reconciliation.MatchTab = class MatchTab {
 
 		this.update_filters_in_state(document_types);
 
-		let vouchers = await this.get_matching_vouchers(document_types);
+		this.document_types = document_types;
+		this.vouchers = [];
+		let { vouchers, total } = await this.get_matching_vouchers(document_types);
+		this.vouchers = vouchers;
 		this.set_table_data(vouchers);
+		this.toggle_load_more(total);
 		this.actions_table.unfreeze();
 
 		let transaction_amount = this.transaction.withdrawal || this.transaction.deposit;
@@ -60,8 +65,27 @@ erpnext.accounts.bank_reconciliation.MatchTab = class MatchTab {
 		})
 	}
 
-	async get_matching_vouchers(document_types) {
-		let vouchers = await frappe.call({
+	async load_more_vouchers() {
+		let { vouchers, total } = await this.get_matching_vouchers(
+			this.document_types, this.vouchers.length
+		);
+		this.vouchers = this.vouchers.concat(vouchers);
+		this.actions_table.appendRows(this.get_table_rows(vouchers));
+		this.toggle_load_more(total);
+	}
+
+	toggle_load_more(total) {
+		let has_more = this.vouchers.length < total;
+		this.match_field_group.set_df_property("load_more", "hidden", has_more ? 0 : 1);
+		this.match_field_group.set_df_property(
+			"load_more",
+			"description",
+			has_more ? __("Showing {0} of {1} vouchers", [this.vouchers.length, total]) : ""
+		);
+	}
+
+	async get_matching_vouchers(document_types, offset = 0) {
+		let result = await frappe.call({
 			method:
 				"banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta.get_linked_payments",
 			args: {
@@ -71,10 +95,12 @@ erpnext.accounts.bank_reconciliation.MatchTab = class MatchTab {
 				to_date: this.doc.bank_statement_to_date,
 				filter_by_reference_date: this.doc.filter_by_reference_date,
 				from_reference_date: this.doc.from_reference_date,
-				to_reference_date: this.doc.to_reference_date
+				to_reference_date: this.doc.to_reference_date,
+				limit: this.page_length,
+				offset: offset,
 			},
 		}).then(result => result.message);
-		return vouchers || [];
+		return result || { vouchers: [], total: 0 };
 	}
 
 	render_data_table() {
@@ -104,7 +130,11 @@ erpnext.accounts.bank_reconciliation.MatchTab = class MatchTab {
 
 	set_table_data(vouchers) {
 		this.summary_data = {};
-		let table_data = vouchers.map((row) => {
+		this.actions_table.refresh(this.get_table_rows(vouchers), this.get_data_table_columns());
+	}
+
+	get_table_rows(vouchers) {
+		return vouchers.map((row) => {
 			return [
 				{
 					content: row.reference_date || row.posting_date, // Reference Date
@@ -146,8 +176,6 @@ erpnext.accounts.bank_reconciliation.MatchTab = class MatchTab {
 				},
 			];
 		});
-
-		this.actions_table.refresh(table_data, this.get_data_table_columns());
 	}
 
 	bind_row_check_event() {
@@ -431,6 +459,15 @@ erpnext.accounts.bank_reconciliation.MatchTab = class MatchTab {
 				fieldname: "vouchers",
 				fieldtype: "HTML",
 			},
+			{
+				label: __("Load More"),
+				fieldname: "load_more",
+				fieldtype: "Button",
+				hidden: 1,
+				click: () => {
+					this.load_more_vouchers();
+				}
+			},
 			{
 				fieldtype: "Section Break",
 				fieldname: "section_break_reconcile",
@@ -0,0 +1,385 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""
+Benchmark of the Bank Reconciliation Tool Beta on a synthetic ledger.
+
+Run it on a test site, as it adds (and by default removes) many documents:
+
+	bench --site test.localhost execute banking.reconciliation.benchmark.run \
+		--kwargs "{'bank_account': 'Main - Bank', 'customer': 'Cust', 'supplier': 'Supp'}"
+"""
+import json
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List
+
+import click
+import frappe
+import numpy as np
+from frappe.utils import add_days, getdate, now, nowdate
+
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta import (
+	auto_reconcile_vouchers,
+	bulk_reconcile_vouchers,
+	get_bank_transactions,
+	get_linked_payments,
+)
+
+PREFIX = "BENCH-"
+SIZES = (10_000, 100_000, 1_000_000)
+RUNS = 20
+LEDGER_DAYS = 365
+CHUNK_SIZE = 10_000
+DOCUMENT_TYPES = [
+	"payment_entry",
+	"journal_entry",
+	"sales_invoice",
+	"purchase_invoice",
+	"unpaid_invoices",
+	"bank_transaction",
+]
+
+
+def run(
+	bank_account: str,
+	customer: str,
+	supplier: str,
+	sizes: Iterable[int] = SIZES,
+	runs: int = RUNS,
+	seed: int = 0,
+	cleanup: bool = True,
+	commit: bool = True,
+) -> List[Dict]:
+	"""
+	Grow a synthetic ledger to each of `sizes` Bank Transactions and time the
+	hot paths of reconciliation on it. Returns one result per size and function.
+	Without `commit`, the ledger is left to the caller's transaction, e.g. a test.
+	"""
+	ledger = LedgerGenerator(bank_account, customer, supplier, seed, commit)
+	results = []
+	try:
+		for size in sorted(sizes):
+			ledger.grow(size)
+			for name, timings in run_benchmarks(ledger, runs).items():
+				results.append({"rows": size, "function": name, **timings})
+				echo_result(results[-1])
+	finally:
+		if cleanup:
+			ledger.delete()
+
+	return results
+
+
+def run_benchmarks(ledger: "LedgerGenerator", runs: int = RUNS) -> Dict[str, Dict]:
+	"""
+	Time each hot path `runs` times on random transactions of `ledger`.
+	Functions that write are rolled back after each run.
+	"""
+	rng = np.random.default_rng(ledger.seed)
+	indexes = rng.choice(ledger.size, size=min(runs, ledger.size), replace=False)
+	from_date, to_date = ledger.start_date, add_days(ledger.start_date, LEDGER_DAYS)
+
+	def linked_payments(i):
+		get_linked_payments(ledger.get_name("BT", i), DOCUMENT_TYPES, from_date, to_date, limit=50)
+
+	def auto_reconcile(i):
+		date = ledger.get_date(i)
+		auto_reconcile_vouchers(ledger.bank_account, date, date)
+
+	def bulk_reconcile(i):
+		vouchers = [
+			{
+				"payment_doctype": "Payment Entry",
+				"payment_name": ledger.get_name("PE", i),
+				"amount": float(ledger.amounts[i]),
+			}
+		]
+		bulk_reconcile_vouchers(ledger.get_name("BT", i), json.dumps(vouchers))
+
+	return {
+		"get_bank_transactions": measure(
+			lambda i: get_bank_transactions(ledger.bank_account, from_date, to_date),
+			indexes,
+		),
+		"get_linked_payments": measure(linked_payments, indexes),
+		"auto_reconcile_vouchers": measure(auto_reconcile, indexes, rollback=True),
+		"bulk_reconcile_vouchers": measure(bulk_reconcile, indexes, rollback=True),
+	}
+
+
+def measure(function: Callable, indexes: Iterable[int], rollback: bool = False) -> Dict:
+	"""Return the p50 and p95 latency in ms and the median number of queries of `function`."""
+	latencies, query_counts = [], []
+	for i in indexes:
+		if rollback:
+			frappe.db.savepoint("benchmark")
+
+		with count_queries() as counter:
+			start = time.perf_counter()
+			function(i)
+			latencies.append((time.perf_counter() - start) * 1000)
+
+		query_counts.append(counter["count"])
+		if rollback:
+			frappe.db.rollback(save_point="benchmark")
+
+	p50, p95 = np.percentile(latencies, [50, 95])
+	return {
+		"runs": len(latencies),
+		"p50_ms": round(float(p50), 2),
+		"p95_ms": round(float(p95), 2),
+		"queries": int(np.median(query_counts)),
+	}
+
+
+@contextmanager
+def count_queries():
+	"""Count the SQL queries run in this block."""
+	counter = {"count": 0}
+	sql = frappe.db.sql
+
+	def counting_sql(*args, **kwargs):
+		counter["count"] += 1
+		return sql(*args, **kwargs)
+
+	frappe.db.sql = counting_sql
+	try:
+		yield counter
+	finally:
+		frappe.db.sql = sql
+
+
+def echo_result(result: Dict) -> None:
+	click.echo(
+		"{rows:>9} rows  {function:<24} p50 {p50_ms:>9.2f} ms  p95 {p95_ms:>9.2f} ms"
+		"  {queries:>5} queries".format(**result)
+	)
+
+
+class LedgerGenerator:
+	"""
+	Insert a synthetic ledger for a Bank Account: per Bank Transaction one
+	Payment Entry with the same amount and reference number, and per two
+	Bank Transactions one Journal Entry and one open Sales and Purchase Invoice.
+
+	Rows are inserted directly in bulk, without validations, GL Entries or
+	child tables other than the Journal Entry Accounts the matching needs.
+	Document names start with `PREFIX`. With `commit`, each chunk of rows is
+	committed, so that a large ledger does not build up in one transaction.
+	"""
+
+	def __init__(
+		self,
+		bank_account: str,
+		customer: str,
+		supplier: str,
+		seed: int = 0,
+		commit: bool = True,
+	) -> None:
+		self.bank_account = bank_account
+		self.customer = customer
+		self.supplier = supplier
+		self.seed = seed
+		self.commit = commit
+		self.size = 0
+		self.amounts = np.array([])
+		self.start_date = getdate(add_days(nowdate(), -LEDGER_DAYS))
+
+		self.company, self.gl_account = frappe.db.get_value(
+			"Bank Account", bank_account, ["company", "account"]
+		)
+		self.currency = frappe.get_cached_value("Account", self.gl_account, "account_currency")
+		self.receivable_account, self.payable_account = frappe.get_cached_value(
+			"Company", self.company, ["default_receivable_account", "default_payable_account"]
+		)
+
+	def grow(self, size: int) -> None:
+		"""Add rows until the ledger has `size` Bank Transactions."""
+		if size <= self.size:
+			return
+
+		rng = np.random.default_rng(self.seed + self.size)
+		amounts = np.round(rng.uniform(1, 10_000, size - self.size), 2)
+		self.amounts = np.concatenate((self.amounts, amounts))
+
+		for start in range(self.size, size, CHUNK_SIZE):
+			end = min(start + CHUNK_SIZE, size)
+			self.insert_chunk(range(start, end))
+			if self.commit:
+				frappe.db.commit()
+
+		self.size = size
+
+	def insert_chunk(self, indexes: range) -> None:
+		timestamp = now()
+		standard = {
+			"creation": timestamp,
+			"modified": timestamp,
+			"owner": "Administrator",
+			"modified_by": "Administrator",
+			"docstatus": 1,
+		}
+
+		bank_transactions, payment_entries = [], []
+		journal_entries, journal_entry_accounts = [], []
+		sales_invoices, purchase_invoices = [], []
+		for i in indexes:
+			amount = float(self.amounts[i])
+			date = self.get_date(i)
+			is_deposit = i % 4 != 3
+			reference = f"{PREFIX}REF-{i:07d}"
+			bank_transactions.append(
+				{
+					**standard,
+					"name": self.get_name("BT", i),
+					"date": date,
+					"status": "Unreconciled",
+					"company": self.company,
+					"bank_account": self.bank_account,
+					"currency": self.currency,
+					"deposit": amount if is_deposit else 0.0,
+					"withdrawal": 0.0 if is_deposit else amount,
+					"allocated_amount": 0.0,
+					"unallocated_amount": amount,
+					"reference_number": reference,
+					"description": f"Payment {reference}",
+				}
+			)
+			payment_entries.append(
+				{
+					**standard,
+					"name": self.get_name("PE", i),
+					"payment_type": "Receive" if is_deposit else "Pay",
+					"company": self.company,
+					"posting_date": date,
+					"reference_no": reference,
+					"reference_date": date,
+					"party_type": "Customer" if is_deposit else "Supplier",
+					"party": self.customer if is_deposit else self.supplier,
+					"paid_from": self.receivable_account if is_deposit else self.gl_account,
+					"paid_to": self.gl_account if is_deposit else self.payable_account,
+					"paid_from_account_currency": self.currency,
+					"paid_to_account_currency": self.currency,
+					"paid_amount": amount,
+					"received_amount": amount,
+					"base_paid_amount": amount,
+					"base_received_amount": amount,
+					"source_exchange_rate": 1,
+					"target_exchange_rate": 1,
+				}
+			)
+
+			if i % 2:
+				continue
+
+			journal_entries.append(
+				{
+					**standard,
+					"name": self.get_name("JE", i),
+					"voucher_type": "Bank Entry",
+					"company": self.company,
+					"posting_date": date,
+					"cheque_no": f"{PREFIX}CHQ-{i:07d}",
+					"cheque_date": date,
+					"total_debit": amount,
+					"total_credit": amount,
+				}
+			)
+			for idx, (account, debit) in enumerate(
+				((self.gl_account, amount), (self.receivable_account, 0.0)), start=1
+			):
+				journal_entry_accounts.append(
+					{
+						**standard,
+						"name": f"{self.get_name('JE', i)}-{idx}",
+						"parent": self.get_name("JE", i),
+						"parenttype": "Journal Entry",
+						"parentfield": "accounts",
+						"idx": idx,
+						"account": account,
+						"account_currency": self.currency,
+						"debit_in_account_currency": debit,
+						"debit": debit,
+						"credit_in_account_currency": amount - debit,
+						"credit": amount - debit,
+					}
+				)
+
+			invoice = {
+				**standard,
+				"company": self.company,
+				"posting_date": date,
+				"due_date": date,
+				"currency": self.currency,
+				"conversion_rate": 1,
+				"grand_total": amount,
+				"base_grand_total": amount,
+				"outstanding_amount": amount,
+				"is_return": 0,
+				"status": "Unpaid",
+			}
+			sales_invoices.append(
+				{
+					**invoice,
+					"name": self.get_name("SI", i),
+					"customer": self.customer,
+					"debit_to": self.receivable_account,
+				}
+			)
+			purchase_invoices.append(
+				{
+					**invoice,
+					"name": self.get_name("PI", i),
+					"supplier": self.supplier,
+					"bill_date": date,
+					"credit_to": self.payable_account,
+					"is_paid": 0,
+				}
+			)
+
+		for doctype, rows in (
+			("Bank Transaction", bank_transactions),
+			("Payment Entry", payment_entries),
+			("Journal Entry", journal_entries),
+			("Journal Entry Account", journal_entry_accounts),
+			("Sales Invoice", sales_invoices),
+			("Purchase Invoice", purchase_invoices),
+		):
+			bulk_insert(doctype, rows)
+
+	def get_name(self, abbreviation: str, i: int) -> str:
+		return f"{PREFIX}{abbreviation}-{i:07d}"
+
+	def get_date(self, i: int) -> str:
+		"""Spread the rows evenly over `LEDGER_DAYS` days, whatever the size."""
+		return str(add_days(self.start_date, i % LEDGER_DAYS))
+
+	def delete(self) -> None:
+		"""Delete all rows of the synthetic ledger, including the ones benchmarks added."""
+		for doctype in (
+			"Bank Transaction Payments",
+			"Bank Transaction",
+			"Payment Entry",
+			"Journal Entry Account",
+			"Journal Entry",
+			"Sales Invoice",
+			"Purchase Invoice",
+		):
+			field = "parent" if doctype == "Bank Transaction Payments" else "name"
+			table = frappe.qb.DocType(doctype)
+			frappe.qb.from_(table).delete().where(table[field].like(f"{PREFIX}%")).run()
+
+		if self.commit:
+			frappe.db.commit()
+		self.size = 0
+		self.amounts = np.array([])
+
+
+def bulk_insert(doctype: str, rows: List[Dict]) -> None:
+	if not rows:
+		return
+
+	fields = list(rows[0])
+	frappe.db.bulk_insert(
+		doctype, fields, [tuple(row.get(field) for field in fields) for row in rows]
+	)
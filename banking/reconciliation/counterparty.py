@@ -0,0 +1,107 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+from typing import Optional, Tuple
+
+import frappe
+from frappe.query_builder.functions import Replace
+
+CACHE_KEY = "banking_counterparty_party"
+
+
+def normalize_account(account: Optional[str]) -> str:
+	"""IBANs and account numbers are compared without spaces and in upper case."""
+	return "".join((account or "").split()).upper()
+
+
+def get_counterparty_party(
+	iban: Optional[str] = None, account_number: Optional[str] = None
+) -> Optional[Tuple[str, str]]:
+	"""
+	Return `(party_type, party)` of a bank transaction's counterparty, looked
+	up by IBAN first, then by account number. Results, including misses, are
+	kept in a Redis hash, so each account is only looked up once.
+	"""
+	for field, account in (("iban", iban), ("bank_account_no", account_number)):
+		account = normalize_account(account)
+		if not account:
+			continue
+
+		party = frappe.cache.hget(
+			CACHE_KEY, f"{field}|{account}", generator=lambda: find_party(field, account)
+		)
+		if party:
+			return tuple(party)
+
+	return None
+
+
+def find_party(field: str, account: str) -> Optional[Tuple[str, str]]:
+	"""
+	Find the party of a counterparty account: from a party's Bank Account, or
+	else from the latest submitted Bank Transaction with this account and a party.
+	"""
+	ba = frappe.qb.DocType("Bank Account")
+	party = (
+		frappe.qb.from_(ba)
+		.select(ba.party_type, ba.party)
+		.where(ba.is_company_account == 0)
+		.where(ba.party.isnotnull() & (ba.party != ""))
+		.where(Replace(ba[field], " ", "") == account)
+		.orderby(ba.modified, order=frappe.qb.desc)
+		.limit(1)
+		.run()
+	)
+	if party:
+		return tuple(party[0])
+
+	bt_field = "bank_party_iban" if field == "iban" else "bank_party_account_number"
+	bt = frappe.qb.DocType("Bank Transaction")
+	party = (
+		frappe.qb.from_(bt)
+		.select(bt.party_type, bt.party)
+		.where(bt.docstatus == 1)
+		.where(bt.party.isnotnull() & (bt.party != ""))
+		.where(bt[bt_field] == account)
+		.orderby(bt.date, order=frappe.qb.desc)
+		.limit(1)
+		.run()
+	)
+	return tuple(party[0]) if party else None
+
+
+def set_counterparty_party(transaction) -> None:
+	"""Set the party of a Bank Transaction (document or dict) from its counterparty, if unset."""
+	if transaction.get("party"):
+		return
+
+	party = get_counterparty_party(
+		transaction.get("bank_party_iban"), transaction.get("bank_party_account_number")
+	)
+	if party:
+		transaction.update({"party_type": party[0], "party": party[1]})
+
+
+def clear_counterparty_cache(doc=None, method=None):
+	"""Drop all cached counterparties when a Bank Account changes. Called via hooks."""
+	frappe.cache.delete_key(CACHE_KEY)
+
+
+def clear_counterparty(doc, method=None):
+	"""
+	Drop the cached counterparty of a Bank Transaction that has a different
+	party than the cached one. Called via hooks.
+	"""
+	if not doc.party:
+		return
+
+	for field, account in (
+		("iban", doc.bank_party_iban),
+		("bank_account_no", doc.bank_party_account_number),
+	):
+		if not account:
+			continue
+
+		key = f"{field}|{normalize_account(account)}"
+		party = frappe.cache.hget(CACHE_KEY, key)
+		if not party or tuple(party) != (doc.party_type, doc.party):
+			frappe.cache.hdel(CACHE_KEY, key)
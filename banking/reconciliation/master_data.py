@@ -0,0 +1,58 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""
+Master data that reconciliation reads again and again, memoized for the
+current request (or background job). A bulk reconciliation of many Bank
+Transactions of one Bank Account reads each of them once.
+
+The results are shared between callers and must not be mutated.
+"""
+from typing import Optional, Tuple
+
+import frappe
+from frappe.utils.caching import request_cache
+
+import erpnext
+
+
+@request_cache
+def get_bank_account_details(bank_account: str) -> Tuple[Optional[str], Optional[str]]:
+	"""Return the GL account and company of a Bank Account."""
+	details = frappe.db.get_value("Bank Account", bank_account, ["account", "company"])
+	return tuple(details) if details else (None, None)
+
+
+def get_gl_account(bank_account: str) -> Optional[str]:
+	return get_bank_account_details(bank_account)[0]
+
+
+@request_cache
+def get_account_details(account: str) -> frappe._dict:
+	"""Return the company, currency and type of a GL account."""
+	return frappe.db.get_value(
+		"Account", account, ["company", "account_currency", "account_type"], as_dict=True
+	) or frappe._dict()
+
+
+def get_account_currency(account: str) -> Optional[str]:
+	return get_account_details(account).get("account_currency")
+
+
+@request_cache
+def get_default_cost_center(company: str) -> Optional[str]:
+	return erpnext.get_default_cost_center(company)
+
+
+@request_cache
+def get_company_currency(company: str) -> Optional[str]:
+	return erpnext.get_company_currency(company)
+
+
+@request_cache
+def get_latest_period_closing_date(company: str) -> Optional[str]:
+	return frappe.db.get_value(
+		"Period Closing Voucher",
+		{"company": company, "docstatus": 1},
+		"posting_date",
+		order_by="posting_date desc",
+	)
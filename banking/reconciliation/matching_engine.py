@@ -0,0 +1,269 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import datetime
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import frappe
+from frappe.query_builder.custom import ConstantColumn
+from frappe.query_builder.functions import Coalesce, Sum
+from frappe.utils import cint, flt
+
+from banking.reconciliation.reference_index import find_references, is_in_description
+from banking.reconciliation.scoring import get_weights, score_candidates
+from banking.reconciliation.tolerance import get_tolerances, is_amount_in_range, is_date_in_range
+
+Voucher = Tuple[str, str]  # (doctype, name)
+
+
+class MatchingEngine:
+	"""
+	Match many Bank Transactions of one Bank Account to Payment Entries and
+	Journal Entries at once, as auto reconciliation does.
+
+	All candidate vouchers for the transactions' reference numbers in the date
+	window are loaded with one query per doctype, along with their existing
+	allocations. Transactions are then matched in memory through an index on
+	the reference number, and ranked like `check_matching` ranks them.
+
+	Usage:
+		engine = MatchingEngine(gl_account, company, from_date, to_date)
+		engine.load(transactions)
+		for transaction in transactions:
+			vouchers = engine.match(transaction)
+			... reconcile ...
+			engine.refresh_allocations(vouchers)
+	"""
+
+	def __init__(
+		self,
+		gl_account: str,
+		company: str,
+		from_date: str | datetime.date = None,
+		to_date: str | datetime.date = None,
+		filter_by_reference_date: bool = False,
+		from_reference_date: str | datetime.date = None,
+		to_reference_date: str | datetime.date = None,
+	) -> None:
+		self.gl_account = gl_account
+		self.company = company
+		self.from_date = from_date
+		self.to_date = to_date
+		self.filter_by_reference_date = cint(filter_by_reference_date)
+		self.from_reference_date = from_reference_date
+		self.to_reference_date = to_reference_date
+
+		self.by_reference: Dict[str, List[Dict]] = defaultdict(list)
+		self.allocated: Dict[Voucher, float] = {}
+		self.weights = get_weights()
+
+	def load(self, transactions: Iterable[Dict]) -> None:
+		"""Load the candidate vouchers and their allocations for all `transactions`."""
+		reference_numbers = {
+			transaction.get("reference_number") for transaction in transactions
+		} - {None, ""}
+		if not reference_numbers:
+			return
+
+		candidates = self.get_payment_entries(reference_numbers)
+		candidates.extend(self.get_journal_entries(reference_numbers))
+		for candidate in candidates:
+			self.by_reference[candidate.reference_no].append(candidate)
+
+		self.refresh_allocations({(row.doctype, row.name) for row in candidates})
+
+	def refresh_allocations(self, vouchers: Iterable[Voucher]) -> None:
+		"""Reload the allocated amounts of `vouchers`, e.g. after reconciling them."""
+		vouchers = set(vouchers)
+		allocated = get_allocated_amounts(self.gl_account, vouchers)
+		for voucher in vouchers:
+			self.allocated[voucher] = allocated.get(voucher, 0.0)
+
+	def match(self, transaction: Dict) -> List[Dict]:
+		"""
+		Return the vouchers that match `transaction`, best first, in the format
+		of `bulk_reconcile_vouchers`. Fully allocated vouchers are left out.
+		"""
+		reference_number = transaction.get("reference_number")
+		if not reference_number:
+			return []
+
+		is_deposit = flt(transaction.get("deposit")) > 0.0
+		references = find_references(self.company, transaction.get("description"))
+		matches = []
+		for candidate in self.by_reference.get(reference_number, []):
+			amount = self.get_amount(candidate, is_deposit)
+			if amount is None:
+				continue
+
+			remaining = amount - self.allocated.get((candidate.doctype, candidate.name), 0.0)
+			if flt(remaining, 2) <= 0.0:
+				continue
+
+			rank = self.get_rank(candidate, amount, transaction, references)
+			matches.append((rank, candidate, remaining))
+
+		# within a rank, the best scored candidate comes first
+		scores = score_candidates(
+			[transaction],
+			[{**candidate, "paid_amount": remaining} for _rank, candidate, remaining in matches],
+			self.weights,
+		)[0]
+		order = sorted(
+			range(len(matches)), key=lambda i: (matches[i][0], scores[i]), reverse=True
+		)
+		return [
+			{
+				"payment_doctype": matches[i][1].doctype,
+				"payment_name": matches[i][1].name,
+				"amount": matches[i][2],
+			}
+			for i in order
+		]
+
+	def get_amount(self, candidate: Dict, is_deposit: bool) -> Optional[float]:
+		"""Return the voucher amount, or None if it goes in the other direction."""
+		if candidate.doctype == "Payment Entry":
+			account_from_to = candidate.paid_to if is_deposit else candidate.paid_from
+			payment_types = ("Receive" if is_deposit else "Pay", "Internal Transfer")
+			if account_from_to != self.gl_account or candidate.payment_type not in payment_types:
+				return None
+
+			return flt(candidate.paid_amount)
+
+		amount = flt(candidate.debit if is_deposit else candidate.credit)
+		return amount if amount > 0.0 else None
+
+	def get_rank(
+		self,
+		candidate: Dict,
+		amount: float,
+		transaction: Dict,
+		references: Optional[Dict[str, set]] = None,
+	) -> int:
+		"""
+		The rank `check_matching` gives. The reference number always matches.
+		`references` are the vouchers found in the description by `find_references`.
+		"""
+		tolerances = get_tolerances(transaction.get("unallocated_amount"))
+		rank = 2  # reference number match + 1
+		rank += is_amount_in_range(amount, transaction.get("unallocated_amount"), tolerances.amount)
+		rank += is_date_in_range(
+			candidate.reference_date or candidate.posting_date,
+			transaction.get("date"),
+			tolerances.days,
+		)
+
+		if candidate.doctype == "Payment Entry":
+			rank += bool(
+				candidate.party
+				and candidate.party_type == transaction.get("party_type")
+				and candidate.party == transaction.get("party")
+			)
+
+		description = transaction.get("description")
+		if is_in_description(candidate.reference_no, description) or (
+			candidate.name in (references or {}).get(candidate.doctype, ())
+		):
+			rank += 1
+
+		return rank
+
+	def get_payment_entries(self, reference_numbers: set) -> List[Dict]:
+		pe = frappe.qb.DocType("Payment Entry")
+
+		date_field = pe.reference_date if self.filter_by_reference_date else pe.posting_date
+		return (
+			frappe.qb.from_(pe)
+			.select(
+				ConstantColumn("Payment Entry").as_("doctype"),
+				pe.name,
+				pe.paid_amount,
+				pe.reference_no,
+				pe.reference_date,
+				pe.party,
+				pe.party_type,
+				pe.posting_date,
+				pe.payment_type,
+				pe.paid_from,
+				pe.paid_to,
+			)
+			.where(pe.docstatus == 1)
+			.where(pe.clearance_date.isnull())
+			.where((pe.paid_to == self.gl_account) | (pe.paid_from == self.gl_account))
+			.where(pe.reference_no.isin(list(reference_numbers)))
+			.where(pe.paid_amount > 0.0)
+			.where(date_field.between(*self.get_date_window()))
+			.orderby(date_field)
+			.run(as_dict=True)
+		)
+
+	def get_journal_entries(self, reference_numbers: set) -> List[Dict]:
+		je = frappe.qb.DocType("Journal Entry")
+		jea = frappe.qb.DocType("Journal Entry Account")
+
+		date_field = je.cheque_date if self.filter_by_reference_date else je.posting_date
+		return (
+			frappe.qb.from_(jea)
+			.join(je)
+			.on(jea.parent == je.name)
+			.select(
+				ConstantColumn("Journal Entry").as_("doctype"),
+				je.name,
+				jea.debit_in_account_currency.as_("debit"),
+				jea.credit_in_account_currency.as_("credit"),
+				je.cheque_no.as_("reference_no"),
+				je.cheque_date.as_("reference_date"),
+				je.pay_to_recd_from.as_("party"),
+				jea.party_type,
+				je.posting_date,
+			)
+			.where(je.docstatus == 1)
+			.where(je.voucher_type != "Opening Entry")
+			.where(je.clearance_date.isnull())
+			.where(jea.account == self.gl_account)
+			.where(je.cheque_no.isin(list(reference_numbers)))
+			.where(date_field.between(*self.get_date_window()))
+			.orderby(date_field)
+			.run(as_dict=True)
+		)
+
+	def get_date_window(self) -> Tuple[Optional[str], Optional[str]]:
+		if self.filter_by_reference_date:
+			return self.from_reference_date, self.to_reference_date
+
+		return self.from_date, self.to_date
+
+
+def get_allocated_amounts(gl_account: str, vouchers: Iterable[Voucher]) -> Dict[Voucher, float]:
+	"""
+	Return the amounts of `vouchers` that are allocated to submitted Bank
+	Transactions on `gl_account`, in one query.
+	"""
+	vouchers = list(vouchers)
+	if not vouchers:
+		return {}
+
+	bt = frappe.qb.DocType("Bank Transaction")
+	btp = frappe.qb.DocType("Bank Transaction Payments")
+	ba = frappe.qb.DocType("Bank Account")
+
+	rows = (
+		frappe.qb.from_(btp)
+		.join(bt)
+		.on(bt.name == btp.parent)
+		.join(ba)
+		.on(ba.name == bt.bank_account)
+		.select(
+			btp.payment_document,
+			btp.payment_entry,
+			Sum(btp.allocated_amount).as_("total"),
+		)
+		.where(bt.docstatus == 1)
+		.where(ba.account == gl_account)
+		.where(btp.payment_document.isin(list({doctype for doctype, _name in vouchers})))
+		.where(btp.payment_entry.isin(list({name for _doctype, name in vouchers})))
+		.groupby(btp.payment_document, btp.payment_entry)
+		.run(as_dict=True)
+	)
+	return {(row.payment_document, row.payment_entry): flt(row.total) for row in rows}
@@ -0,0 +1,195 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import re
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+import frappe
+from frappe.query_builder import Criterion
+
+CACHE_KEY = "banking_reference_index"
+BUILT = "__built__"  # hash field that is set once the index of a company is complete
+MIN_KEY_LENGTH = 5
+MAX_NGRAM = 4  # references split into up to this many words are found
+
+SEPARATORS = re.compile(r"[\s\-/._\\#]+")
+DELIMITERS = re.compile(r"[\s,;:()\[\]{}\"'<>|]+")
+# characters that OCR and manual typing confuse, mapped to one of them
+CONFUSABLES = str.maketrans("OQILSBZ", "0011582")
+# fields of a voucher that hold its references
+REFERENCE_FIELDS = {
+	"Sales Invoice": ("name",),
+	"Purchase Invoice": ("name", "bill_no"),
+	"Payment Entry": ("reference_no",),
+	"Journal Entry": ("cheque_no",),
+}
+
+
+def normalize_reference(reference: Optional[str]) -> str:
+	"""
+	Return the key of a reference number in the index: upper case, without
+	separators, and with confusable characters like O and 0 made the same.
+	"""
+	if not reference:
+		return ""
+
+	return SEPARATORS.sub("", reference.upper()).translate(CONFUSABLES)
+
+
+def is_valid_key(key: str) -> bool:
+	"""Keys that are too short or have no digit would match ordinary words."""
+	return len(key) >= MIN_KEY_LENGTH and any(char.isdigit() for char in key)
+
+
+def is_in_description(reference: Optional[str], description: Optional[str]) -> bool:
+	"""
+	Whether `reference` is part of `description`, ignoring case and surrounding
+	whitespace like the `Locate(Trim(reference_no), description)` of the queries.
+	"""
+	reference = (reference or "").strip()
+	return bool(reference and description) and reference.lower() in description.lower()
+
+
+def get_description_keys(description: Optional[str]) -> Set[str]:
+	"""
+	Return the keys to look up for a bank transaction description: every word
+	and every run of up to `MAX_NGRAM` consecutive words, normalized. This way
+	"RE ACC-SINV-2024-00012" and "ACC SINV 2024 00012" both find the invoice.
+	"""
+	if not description:
+		return set()
+
+	words = [word for word in DELIMITERS.split(description) if word]
+	keys = set()
+	for start in range(len(words)):
+		for end in range(start + 1, min(start + MAX_NGRAM, len(words)) + 1):
+			key = normalize_reference("".join(words[start:end]))
+			if is_valid_key(key):
+				keys.add(key)
+
+	return keys
+
+
+def find_references(company: str, description: Optional[str]) -> Dict[str, Set[str]]:
+	"""Return the names of open vouchers per doctype whose reference is in `description`."""
+	keys = get_description_keys(description)
+	if not keys:
+		return {}
+
+	cache_key = get_cache_key(company)
+	if not frappe.cache.hget(cache_key, BUILT):
+		build_reference_index(company)
+
+	found = defaultdict(set)
+	for key in keys:
+		for doctype, name in frappe.cache.hget(cache_key, key) or ():
+			found[doctype].add(name)
+
+	return found
+
+
+def build_reference_index(company: str) -> None:
+	"""
+	Map the normalized references of all open Sales Invoices, Purchase Invoices,
+	Payment Entries and Journal Entries of `company` to the vouchers, in a Redis
+	hash per company with one field per reference.
+	"""
+	index = defaultdict(list)
+	for doctype, name, reference in get_references(company):
+		key = normalize_reference(reference)
+		if is_valid_key(key) and (doctype, name) not in index[key]:
+			index[key].append((doctype, name))
+
+	cache_key = get_cache_key(company)
+	for key, vouchers in index.items():
+		frappe.cache.hset(cache_key, key, vouchers)
+
+	frappe.cache.hset(cache_key, BUILT, True)
+
+
+def get_references(company: str):
+	si = frappe.qb.DocType("Sales Invoice")
+	for name in (
+		frappe.qb.from_(si)
+		.select(si.name)
+		.where(si.company == company)
+		.where(si.docstatus == 1)
+		.where(si.outstanding_amount != 0.0)
+		.run(pluck=True)
+	):
+		yield "Sales Invoice", name, name
+
+	pi = frappe.qb.DocType("Purchase Invoice")
+	for name, bill_no in (
+		frappe.qb.from_(pi)
+		.select(pi.name, pi.bill_no)
+		.where(pi.company == company)
+		.where(pi.docstatus == 1)
+		.where(
+			Criterion.any(
+				[pi.outstanding_amount != 0.0, (pi.is_paid == 1) & pi.clearance_date.isnull()]
+			)
+		)
+		.run()
+	):
+		yield "Purchase Invoice", name, name
+		yield "Purchase Invoice", name, bill_no
+
+	pe = frappe.qb.DocType("Payment Entry")
+	for name, reference_no in (
+		frappe.qb.from_(pe)
+		.select(pe.name, pe.reference_no)
+		.where(pe.company == company)
+		.where(pe.docstatus == 1)
+		.where(pe.clearance_date.isnull())
+		.where(pe.reference_no.isnotnull())
+		.run()
+	):
+		yield "Payment Entry", name, reference_no
+
+	je = frappe.qb.DocType("Journal Entry")
+	for name, cheque_no in (
+		frappe.qb.from_(je)
+		.select(je.name, je.cheque_no)
+		.where(je.company == company)
+		.where(je.docstatus == 1)
+		.where(je.clearance_date.isnull())
+		.where(je.cheque_no.isnotnull())
+		.run()
+	):
+		yield "Journal Entry", name, cheque_no
+
+
+def get_cache_key(company: str) -> str:
+	return f"{CACHE_KEY}|{company}"
+
+
+def get_voucher_keys(doc) -> Set[str]:
+	"""Return the index keys of a voucher's references."""
+	keys = {
+		normalize_reference(doc.get(field)) for field in REFERENCE_FIELDS[doc.doctype]
+	}
+	return {key for key in keys if is_valid_key(key)}
+
+
+def update_reference_index(doc, method=None):
+	"""
+	Add a submitted voucher to the index of its company, or remove a cancelled
+	one. Called via hooks.
+	"""
+	cache_key = get_cache_key(doc.company)
+	if not frappe.cache.hget(cache_key, BUILT):
+		# The voucher is indexed when the index is built
+		return
+
+	voucher = (doc.doctype, doc.name)
+	for key in get_voucher_keys(doc):
+		vouchers = [tuple(row) for row in frappe.cache.hget(cache_key, key) or ()]
+		if doc.docstatus == 1 and voucher not in vouchers:
+			frappe.cache.hset(cache_key, key, [*vouchers, voucher])
+		elif doc.docstatus == 2 and voucher in vouchers:
+			vouchers.remove(voucher)
+			if vouchers:
+				frappe.cache.hset(cache_key, key, vouchers)
+			else:
+				frappe.cache.hdel(cache_key, key)
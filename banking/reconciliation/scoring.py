@@ -0,0 +1,150 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+from typing import Dict, List, Optional, Sequence
+
+import frappe
+import numpy as np
+from frappe.utils import flt, getdate
+
+from banking.reconciliation.reference_index import get_description_keys, normalize_reference
+
+FEATURES = ("amount", "date", "reference", "party", "currency")
+DEFAULT_WEIGHTS = {"amount": 3.0, "date": 1.0, "reference": 3.0, "party": 2.0, "currency": 1.0}
+DATE_SCALE = 7  # days apart at which the date similarity is halved
+
+
+def get_weights() -> np.ndarray:
+	"""Return the weights of `FEATURES` as set in Banking Settings."""
+	settings = frappe.get_cached_doc("Banking Settings")
+	return np.array(
+		[
+			flt(settings.get(f"match_weight_{feature}"))
+			if settings.get(f"match_weight_{feature}") is not None
+			else DEFAULT_WEIGHTS[feature]
+			for feature in FEATURES
+		]
+	)
+
+
+def score_candidates(
+	transactions: Sequence[Dict],
+	candidates: Sequence[Dict],
+	weights: Optional[np.ndarray] = None,
+) -> np.ndarray:
+	"""
+	Return the scores of all candidate vouchers for all bank transactions as a
+	`len(transactions)` x `len(candidates)` array.
+
+	A score is the weighted sum of similarities between 0 and 1:
+	- amount: 1 for the same amount, down to 0 for a difference of the whole amount
+	- date: 1 on the same day, 0.5 `DATE_SCALE` days apart, and so on
+	- reference: 1 for the same reference number, or the reference in the description
+	- party: 1 for the same party
+	- currency: 1 for the same currency
+	"""
+	if weights is None:
+		weights = get_weights()
+
+	if not len(transactions) or not len(candidates):
+		return np.zeros((len(transactions), len(candidates)))
+
+	features = np.stack(
+		[
+			get_amount_similarity(transactions, candidates),
+			get_date_similarity(transactions, candidates),
+			get_reference_similarity(transactions, candidates),
+			get_equality(transactions, candidates, get_party, get_party),
+			get_equality(transactions, candidates, get_currency, get_currency),
+		]
+	)
+	return np.tensordot(weights, features, axes=1)
+
+
+def get_amount_similarity(transactions, candidates) -> np.ndarray:
+	transaction_amounts = np.array([flt(row.get("unallocated_amount")) for row in transactions])
+	candidate_amounts = np.array([flt(row.get("paid_amount")) for row in candidates])
+
+	difference = np.abs(candidate_amounts[None, :] - transaction_amounts[:, None])
+	relative = difference / np.maximum(np.abs(transaction_amounts[:, None]), 0.01)
+	return 1.0 - np.clip(relative, 0.0, 1.0)
+
+
+def get_date_similarity(transactions, candidates) -> np.ndarray:
+	transaction_dates = to_dates(row.get("date") for row in transactions)
+	candidate_dates = to_dates(
+		row.get("reference_date") or row.get("posting_date") for row in candidates
+	)
+
+	difference = candidate_dates[None, :] - transaction_dates[:, None]
+	days = np.abs(difference.astype(np.int64)).astype(float)
+	return np.where(np.isnat(difference), 0.0, 1.0 / (1.0 + days / DATE_SCALE))
+
+
+def get_reference_similarity(transactions, candidates) -> np.ndarray:
+	codes = {}
+
+	def encode(keys) -> np.ndarray:
+		return np.array([codes.setdefault(key, len(codes)) if key else -1 for key in keys])
+
+	candidate_codes = encode(normalize_reference(row.get("reference_no")) for row in candidates)
+	transaction_codes = encode(
+		normalize_reference(row.get("reference_number")) for row in transactions
+	)
+
+	similarity = (transaction_codes[:, None] == candidate_codes[None, :]) & (
+		transaction_codes[:, None] >= 0
+	)
+	for i, transaction in enumerate(transactions):
+		# reference numbers of candidates in the description
+		description_keys = get_description_keys(transaction.get("description"))
+		keys = [codes[key] for key in description_keys if key in codes]
+		if keys:
+			similarity[i] |= np.isin(candidate_codes, keys)
+
+	return similarity.astype(float)
+
+
+def get_equality(transactions, candidates, transaction_key, candidate_key) -> np.ndarray:
+	"""1 where the (non-empty) keys of a transaction and a candidate are the same."""
+	codes = {}
+
+	def encode(rows, key) -> np.ndarray:
+		return np.array(
+			[codes.setdefault(value, len(codes)) if (value := key(row)) else -1 for row in rows]
+		)
+
+	transaction_codes = encode(transactions, transaction_key)
+	candidate_codes = encode(candidates, candidate_key)
+	equal = (transaction_codes[:, None] == candidate_codes[None, :]) & (
+		transaction_codes[:, None] >= 0
+	)
+	return equal.astype(float)
+
+
+def get_party(row: Dict) -> Optional[tuple]:
+	return (row.get("party_type"), row.get("party")) if row.get("party") else None
+
+
+def get_currency(row: Dict) -> Optional[str]:
+	return row.get("currency") or None
+
+
+def to_dates(values) -> np.ndarray:
+	return np.array(
+		[getdate(value) if value else np.datetime64("NaT") for value in values],
+		dtype="datetime64[D]",
+	)
+
+
+def sort_by_score(transaction: Dict, vouchers: List[Dict]) -> List[Dict]:
+	"""
+	Set the score of each matching voucher of `transaction` and sort them by
+	rank, then by score. The rank stays the primary order.
+	"""
+	scores = score_candidates([transaction], vouchers)
+	for voucher, score in zip(vouchers, scores[0] if len(vouchers) else []):
+		voucher["score"] = round(float(score), 3)
+
+	return sorted(
+		vouchers, key=lambda voucher: (voucher["rank"], voucher["score"]), reverse=True
+	)
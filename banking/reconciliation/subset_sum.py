@@ -0,0 +1,171 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import List, Sequence, Tuple
+
+MITM_MAX_ITEMS = 32  # up to 2^16 sums per half
+MAX_SUBSET_SIZE = 8
+TIME_BUDGET = 0.5  # seconds
+
+
+class SubsetSumSolver:
+	"""
+	Find subsets of positive integer `amounts` (e.g. cents) that add up to
+	`target` within `tolerance`. Smaller subsets come first.
+
+	Subsets are searched by size, one size after the other, so that all
+	smaller subsets are found before larger ones. Up to `MITM_MAX_ITEMS` amounts
+	are searched exhaustively by meet in the middle. Larger lists are searched
+	depth first, largest amounts first, and pruned by the smallest and largest
+	sums the remaining amounts can add. Either search stops after `time_budget`
+	seconds and returns what it found so far.
+	"""
+
+	def __init__(
+		self,
+		amounts: Sequence[int],
+		target: int,
+		tolerance: int = 0,
+		max_results: int = 5,
+		max_size: int = MAX_SUBSET_SIZE,
+		time_budget: float = TIME_BUDGET,
+	) -> None:
+		self.target = target
+		self.tolerance = abs(tolerance)
+		self.max_results = max_results
+		self.max_size = max_size
+		self.deadline = time.monotonic() + time_budget
+		self.timed_out = False
+
+		# amounts that can be part of a solution, with their original indexes
+		self.items = sorted(
+			(
+				(amount, index)
+				for index, amount in enumerate(amounts)
+				if 0 < amount <= target + self.tolerance
+			),
+			reverse=True,
+		)
+		self.results = set()
+
+	def solve(self) -> List[Tuple[int, ...]]:
+		"""Return up to `max_results` tuples of indexes into `amounts`."""
+		if self.target <= 0 or not self.items:
+			return []
+
+		if len(self.items) <= MITM_MAX_ITEMS:
+			self.split_halves()
+			search = self.meet_in_the_middle
+		else:
+			search = self.depth_first
+
+		for size in range(1, min(self.max_size, len(self.items)) + 1):
+			search(size)
+			if self.is_done():
+				break
+
+		results = sorted(self.results, key=lambda subset: (len(subset), subset))
+		return results[: self.max_results]
+
+	def split_halves(self) -> None:
+		"""Sums of all subsets of either half of the amounts, by subset size."""
+		half = len(self.items) // 2
+		self.left = defaultdict(list)
+		for total, subset in self.get_subset_sums(self.items[:half], 0):
+			self.left[len(subset)].append((total, subset))
+
+		self.right = defaultdict(list)
+		for total, subset in sorted(self.get_subset_sums(self.items[half:], half)):
+			self.right[len(subset)].append((total, subset))
+
+		self.right_sums = {
+			size: [total for total, _subset in sums]
+			for size, sums in self.right.items()
+		}
+
+	def meet_in_the_middle(self, size: int) -> None:
+		"""Find the subsets of `size` amounts."""
+		for left_size in range(size + 1):
+			right = self.right.get(size - left_size)
+			if not right:
+				continue
+
+			right_sums = self.right_sums[size - left_size]
+			for left_sum, left_subset in self.left.get(left_size, ()):
+				low = bisect_left(right_sums, self.target - self.tolerance - left_sum)
+				high = bisect_right(right_sums, self.target + self.tolerance - left_sum)
+				for _right_sum, right_subset in right[low:high]:
+					self.add_result(left_subset + right_subset)
+					if self.is_done():
+						return
+
+	def get_subset_sums(self, items, offset: int) -> List[Tuple[int, Tuple[int, ...]]]:
+		sums = [(0, ())]
+		for position, (amount, _index) in enumerate(items, start=offset):
+			if self.is_done():
+				break
+			sums += [
+				(total + amount, subset + (position,))
+				for total, subset in sums
+				if total + amount <= self.target + self.tolerance
+				and len(subset) < self.max_size
+			]
+
+		return sums
+
+	def depth_first(self, size: int) -> None:
+		"""Find the subsets of `size` amounts."""
+		amounts = [amount for amount, _index in self.items]
+		count = len(amounts)
+		# prefix[i] is the sum of amounts[:i], the largest amounts come first
+		prefix = [0] * (count + 1)
+		for i, amount in enumerate(amounts):
+			prefix[i + 1] = prefix[i] + amount
+
+		lowest, highest = self.target - self.tolerance, self.target + self.tolerance
+		stack = [(0, 0, ())]
+		steps = 0
+		while stack:
+			start, total, subset = stack.pop()
+			steps += 1
+			if steps % 1024 == 0 and self.is_done():
+				return
+
+			# amounts still to choose after the next one, and their smallest sum
+			rest = size - len(subset) - 1
+			smallest = prefix[count] - prefix[count - rest]
+
+			children = []
+			for i in range(start, count - rest):
+				new_total = total + amounts[i]
+				if new_total + smallest > highest:
+					continue
+				if new_total + prefix[i + 1 + rest] - prefix[i + 1] < lowest:
+					# even the largest remaining amounts do not reach the target
+					break
+
+				if rest:
+					children.append((i + 1, new_total, subset + (i,)))
+					continue
+
+				self.add_result(subset + (i,))
+				if self.is_done():
+					return
+
+			# reversed, so that larger amounts are tried first
+			stack.extend(reversed(children))
+
+	def add_result(self, positions: Tuple[int, ...]) -> None:
+		self.results.add(tuple(sorted(self.items[position][1] for position in positions)))
+
+	def is_done(self) -> bool:
+		if len(self.results) >= self.max_results:
+			return True
+
+		if time.monotonic() > self.deadline:
+			self.timed_out = True
+			return True
+
+		return False
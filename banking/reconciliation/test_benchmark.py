@@ -0,0 +1,58 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from erpnext.accounts.doctype.bank_transaction.test_bank_transaction import (
+	create_gl_account,
+)
+from erpnext.buying.doctype.supplier.test_supplier import create_supplier
+
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.test_bank_reconciliation_tool_beta import (
+	create_bank,
+	create_bank_account,
+	create_customer,
+)
+from banking.reconciliation.benchmark import PREFIX, count_queries, run
+
+
+class TestBenchmark(FrappeTestCase):
+	def test_run(self):
+		"""Test that the benchmark runs on a small ledger and cleans up after itself."""
+		create_bank()
+		bank_account = create_bank_account(
+			bank_account_name="Benchmark Account",
+			gl_account=create_gl_account("_Test Bank Benchmark"),
+		)
+		customer = create_customer(customer_name="Benchmark Inc.")
+		supplier = create_supplier(supplier_name="Benchmark Supplies").name
+
+		# the test's transaction is rolled back, so nothing is left on the site
+		results = run(
+			bank_account, customer, supplier, sizes=[40], runs=3, commit=False
+		)
+
+		self.assertEqual(
+			[result["function"] for result in results],
+			[
+				"get_bank_transactions",
+				"get_linked_payments",
+				"auto_reconcile_vouchers",
+				"bulk_reconcile_vouchers",
+			],
+		)
+		for result in results:
+			self.assertEqual(result["runs"], 3)
+			self.assertGreater(result["queries"], 0)
+			self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+
+		self.assertFalse(
+			frappe.db.exists("Bank Transaction", {"name": ("like", f"{PREFIX}%")})
+		)
+
+	def test_count_queries(self):
+		with count_queries() as counter:
+			frappe.db.sql("SELECT 1")
+			frappe.db.sql("SELECT 2")
+
+		self.assertEqual(counter["count"], 2)
@@ -0,0 +1,41 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.test_bank_reconciliation_tool_beta import (
+	create_bank,
+	create_customer,
+)
+from banking.reconciliation.counterparty import get_counterparty_party, set_counterparty_party
+
+IBAN = "DE02120300000000202051"
+
+
+class TestCounterparty(FrappeTestCase):
+	def test_party_by_iban(self):
+		create_bank()
+		customer = create_customer(customer_name="Counterparty Inc.")
+		bank_account = frappe.get_doc(
+			{
+				"doctype": "Bank Account",
+				"account_name": "Counterparty Account",
+				"bank": "Citi Bank",
+				"iban": "DE02 1203 0000 0000 2020 51",
+				"party_type": "Customer",
+				"party": customer,
+				"is_company_account": 0,
+			}
+		).insert()
+
+		self.assertEqual(get_counterparty_party(IBAN.lower()), ("Customer", customer))
+		self.assertIsNone(get_counterparty_party("DE89370400440532013000"))
+
+		transaction = frappe._dict(bank_party_iban=IBAN)
+		set_counterparty_party(transaction)
+		self.assertEqual(transaction.party_type, "Customer")
+		self.assertEqual(transaction.party, customer)
+
+		# the cache is cleared along with the Bank Account
+		bank_account.delete()
+		self.assertIsNone(get_counterparty_party(IBAN))
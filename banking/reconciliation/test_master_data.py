@@ -0,0 +1,42 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from erpnext.accounts.doctype.bank_transaction.test_bank_transaction import (
+	create_gl_account,
+)
+
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.test_bank_reconciliation_tool_beta import (
+	create_bank,
+	create_bank_account,
+)
+from banking.reconciliation.benchmark import count_queries
+from banking.reconciliation.master_data import (
+	get_account_currency,
+	get_bank_account_details,
+	get_default_cost_center,
+	get_gl_account,
+	get_latest_period_closing_date,
+)
+
+
+class TestMasterData(FrappeTestCase):
+	def test_lookups_run_once_per_request(self):
+		create_bank()
+		gl_account = create_gl_account("_Test Bank Master Data")
+		bank_account = create_bank_account(
+			bank_account_name="Master Data Account", gl_account=gl_account
+		)
+		frappe.local.request_cache.clear()
+
+		with count_queries() as counter:
+			for _i in range(500):
+				self.assertEqual(get_gl_account(bank_account), gl_account)
+				self.assertEqual(get_bank_account_details(bank_account)[1], "_Test Company")
+				self.assertEqual(get_account_currency(gl_account), "INR")
+				get_default_cost_center("_Test Company")
+				get_latest_period_closing_date("_Test Company")
+
+		# Bank Account, Account, Period Closing Voucher, and maybe Company
+		self.assertLessEqual(counter["count"], 4)
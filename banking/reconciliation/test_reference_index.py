@@ -0,0 +1,67 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from banking.reconciliation.reference_index import (
+	find_references,
+	get_cache_key,
+	get_description_keys,
+	is_in_description,
+	normalize_reference,
+	update_reference_index,
+)
+
+
+class TestReferenceIndex(FrappeTestCase):
+	def test_normalize_reference(self):
+		self.assertEqual(
+			normalize_reference("ACC-SINV-2024-00012"), normalize_reference("acc sinv 2024/00012")
+		)
+		self.assertEqual(normalize_reference("RE-2024-0O1"), normalize_reference("RE 2024.001"))
+		self.assertEqual(normalize_reference("INV-10I5"), normalize_reference("INV 1015"))
+		self.assertNotEqual(normalize_reference("INV-1015"), normalize_reference("INV-1016"))
+		self.assertEqual(normalize_reference(None), "")
+
+	def test_description_keys(self):
+		keys = get_description_keys("Payment for ACC SINV 2024 00012, thank you")
+
+		self.assertIn(normalize_reference("ACC-SINV-2024-00012"), keys)
+		self.assertIn(normalize_reference("2024-00012"), keys)
+		# words without digits and short numbers are not looked up
+		self.assertNotIn(normalize_reference("thank"), keys)
+		self.assertNotIn(normalize_reference("2024"), keys)
+
+	def test_empty_description(self):
+		self.assertEqual(get_description_keys(None), set())
+		self.assertEqual(get_description_keys(""), set())
+
+	def test_is_in_description(self):
+		# like the case insensitive `Locate` of the matching queries
+		description = "RE ACC-SINV-2024-00012"
+		self.assertTrue(is_in_description(" acc-sinv-2024-00012 ", description))
+		self.assertFalse(is_in_description("ACC-SINV-2024-00013", description))
+		self.assertFalse(is_in_description("", description))
+		self.assertFalse(is_in_description("ACC-SINV-2024-00012", None))
+
+	def test_update_reference_index(self):
+		company = "_Test Company"
+		frappe.cache.delete_key(get_cache_key(company))
+		find_references(company, "ACC-SINV-2024-00012")  # builds the index
+
+		voucher = frappe._dict(
+			doctype="Payment Entry",
+			name="ACC-PAY-TEST-00001",
+			company=company,
+			reference_no="TRF 4711 0815",
+			docstatus=1,
+		)
+		update_reference_index(voucher)
+		self.assertEqual(
+			find_references(company, "Transfer TRF-4711-0815"),
+			{"Payment Entry": {"ACC-PAY-TEST-00001"}},
+		)
+
+		voucher.docstatus = 2
+		update_reference_index(voucher)
+		self.assertEqual(find_references(company, "Transfer TRF-4711-0815"), {})
@@ -0,0 +1,62 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+
+from banking.reconciliation.scoring import FEATURES, score_candidates
+
+TRANSACTIONS = [
+	{
+		"unallocated_amount": 100,
+		"date": "2024-01-10",
+		"reference_number": "INV-001",
+		"description": "Payment ACC-SINV-2024-0042",
+		"party_type": "Customer",
+		"party": "ABC Inc.",
+		"currency": "EUR",
+	},
+	{"unallocated_amount": 50, "date": "2024-01-01", "currency": "EUR"},
+]
+CANDIDATES = [
+	{
+		"paid_amount": 100,
+		"posting_date": "2024-01-10",
+		"reference_no": "INV 0O1",
+		"party_type": "Customer",
+		"party": "ABC Inc.",
+		"currency": "EUR",
+	},
+	{
+		"paid_amount": 90,
+		"reference_date": "2024-01-17",
+		"posting_date": "2024-01-03",
+		"reference_no": "ACC-SINV-2024-00042",
+		"currency": "USD",
+	},
+	{"paid_amount": 50, "posting_date": None, "reference_no": "ACC-SINV-2024-0042"},
+]
+
+
+class TestScoring(FrappeTestCase):
+	def test_scores(self):
+		scores = score_candidates(TRANSACTIONS, CANDIDATES, np.ones(len(FEATURES)))
+
+		self.assertEqual(scores.shape, (2, 3))
+		# everything matches, the reference number in a normalized form
+		self.assertAlmostEqual(scores[0, 0], 5.0)
+		# 90% of the amount, a week apart
+		self.assertAlmostEqual(scores[0, 1], 0.9 + 0.5)
+		# half the amount, no date, reference number in the description
+		self.assertAlmostEqual(scores[0, 2], 0.5 + 1.0)
+		# nine days apart, same currency
+		self.assertAlmostEqual(scores[1, 0], 1 / (1 + 9 / 7) + 1.0)
+
+	def test_weights(self):
+		weights = np.zeros(len(FEATURES))
+		weights[FEATURES.index("amount")] = 2.0
+		scores = score_candidates(TRANSACTIONS, CANDIDATES, weights)
+
+		np.testing.assert_allclose(scores, [[2.0, 1.8, 1.0], [0.0, 0.4, 2.0]])
+
+	def test_empty(self):
+		self.assertEqual(score_candidates(TRANSACTIONS, [], np.ones(5)).shape, (2, 0))
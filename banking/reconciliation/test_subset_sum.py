@@ -0,0 +1,55 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import random
+
+from frappe.tests.utils import FrappeTestCase
+
+from banking.reconciliation.subset_sum import SubsetSumSolver
+
+
+class TestSubsetSumSolver(FrappeTestCase):
+	def test_single_and_pair(self):
+		amounts = [5000, 12000, 7000, 3000]
+
+		self.assertEqual(SubsetSumSolver(amounts, 12000).solve()[:2], [(1,), (0, 2)])
+
+	def test_tolerance(self):
+		amounts = [10000, 4990, 3333]
+
+		self.assertEqual(SubsetSumSolver(amounts, 15000).solve(), [])
+		self.assertEqual(SubsetSumSolver(amounts, 15000, tolerance=10).solve(), [(0, 1)])
+
+	def test_meet_in_the_middle(self):
+		amounts = [1100, 2200, 3300, 4400, 5500, 6600, 7700, 8800, 9900, 123, 456, 789]
+		target = 1100 + 3300 + 123 + 456 + 789
+		results = SubsetSumSolver(amounts, target, max_results=20).solve()
+
+		self.assertIn((0, 2, 9, 10, 11), results)
+		for subset in results:
+			self.assertEqual(sum(amounts[i] for i in subset), target)
+
+	def test_many_amounts(self):
+		rng = random.Random(42)
+		amounts = [rng.randint(1000, 500000) for _ in range(500)]
+		target = amounts[17] + amounts[230] + amounts[401] + amounts[499]
+		solver = SubsetSumSolver(amounts, target, max_results=3, time_budget=2.0)
+		results = solver.solve()
+
+		self.assertTrue(results)
+		for subset in results:
+			self.assertEqual(sum(amounts[i] for i in subset), target)
+
+	def test_smallest_subsets_first(self):
+		"""A planted triple comes before the many subsets of five amounts."""
+		for count in (30, 300):
+			# 6000 and any four of the 1000s make up the target as well
+			amounts = [6000, 3334, 3333, 3333] + [1000] * (count - 4)
+			results = SubsetSumSolver(amounts, 10000, time_budget=2.0).solve()
+
+			self.assertEqual(results[0], (1, 2, 3))
+			self.assertEqual([len(subset) for subset in results], [3, 5, 5, 5, 5])
+
+	def test_no_solution(self):
+		self.assertEqual(SubsetSumSolver([300, 500], 100).solve(), [])
+		self.assertEqual(SubsetSumSolver([], 100).solve(), [])
+		self.assertEqual(SubsetSumSolver([100], 0).solve(), [])
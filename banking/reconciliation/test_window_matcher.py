@@ -0,0 +1,50 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+
+from banking.reconciliation.window_matcher import find_windows
+
+
+class TestWindowMatcher(FrappeTestCase):
+	def setUp(self):
+		self.dates = np.array(
+			["2024-01-01", "2024-01-05", "2024-01-10", "2024-01-12", "2024-03-01", "2024-03-02"],
+			dtype="datetime64[D]",
+		)
+		self.amounts = np.array([4000, 3000, 3000, 2500, 5000, 5000])
+
+	def test_windows(self):
+		self.assertEqual(find_windows(self.dates, self.amounts, 6000), [(1, 3)])
+		self.assertEqual(find_windows(self.dates, self.amounts, 10000), [(4, 6), (0, 3)])
+
+	def test_single_lines_are_skipped(self):
+		self.assertEqual(find_windows(self.dates, self.amounts, 4000), [])
+		self.assertEqual(find_windows(self.dates, self.amounts, 4000, min_lines=1), [(0, 1)])
+
+	def test_limits(self):
+		# spans from January to March
+		self.assertEqual(find_windows(self.dates, self.amounts, 7500), [])
+		self.assertEqual(find_windows(self.dates, self.amounts, 7500, max_days=60), [(3, 5)])
+		self.assertEqual(find_windows(self.dates, self.amounts, 10000, max_lines=2), [(4, 6)])
+
+	def test_tolerance(self):
+		self.assertEqual(find_windows(self.dates, self.amounts, 5490), [])
+		self.assertEqual(find_windows(self.dates, self.amounts, 5490, tolerance=10), [(2, 4)])
+
+	def test_shortest_run_too_short(self):
+		# the single line is within tolerance, the run of two lines as well
+		dates = np.array(["2024-01-01"] * 3, dtype="datetime64[D]")
+		amounts = np.array([100, 1, 99])
+
+		self.assertEqual(
+			find_windows(dates, amounts, 100, tolerance=1), [(0, 2), (1, 3)]
+		)
+
+	def test_many_lines(self):
+		rng = np.random.default_rng(7)
+		amounts = rng.integers(100, 100000, size=50000)
+		dates = np.sort(np.datetime64("2024-01-01") + rng.integers(0, 365, size=50000))
+		target = int(amounts[20000:20003].sum())
+
+		self.assertIn((20000, 20003), find_windows(dates, amounts, target))
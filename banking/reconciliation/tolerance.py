@@ -0,0 +1,48 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import datetime
+
+import frappe
+from frappe.utils import add_days, cint, flt, getdate
+
+
+def get_tolerances(amount: float) -> frappe._dict:
+	"""
+	Return how far the amount and date of a voucher may be off to still count as
+	matching a bank transaction of `amount`, as set in Banking Settings.
+	The amount tolerance is the larger of the absolute and the relative one.
+	"""
+	settings = frappe.get_cached_doc("Banking Settings")
+	return frappe._dict(
+		amount=max(
+			flt(settings.get("match_amount_tolerance")),
+			abs(flt(amount)) * flt(settings.get("match_amount_tolerance_percent")) / 100,
+		),
+		days=cint(settings.get("match_date_tolerance")),
+	)
+
+
+def amount_in_range(field, amount: float, tolerance: float = 0.0):
+	"""Criterion for `field` being `amount`, give or take `tolerance`."""
+	if not tolerance:
+		return field == amount
+
+	return field.between(flt(amount) - tolerance, flt(amount) + tolerance)
+
+
+def date_in_range(field, date: str | datetime.date, days: int = 0):
+	"""Criterion for `field` being `date`, give or take `days`."""
+	if not days:
+		return field == date
+
+	return field.between(add_days(date, -days), add_days(date, days))
+
+
+def is_amount_in_range(value: float, amount: float, tolerance: float = 0.0) -> bool:
+	"""Whether `value` is `amount`, give or take `tolerance`."""
+	return abs(flt(value) - flt(amount)) <= flt(tolerance)
+
+
+def is_date_in_range(value: str | datetime.date, date: str | datetime.date, days: int = 0) -> bool:
+	"""Whether `value` is `date`, give or take `days`."""
+	return abs((getdate(value) - getdate(date)).days) <= cint(days)
@@ -0,0 +1,58 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+from typing import List, Tuple
+
+import numpy as np
+
+MAX_WINDOW_DAYS = 31
+MAX_WINDOW_LINES = 10
+MIN_WINDOW_LINES = 2  # single lines are matched one to one already
+
+
+def find_windows(
+	dates: np.ndarray,
+	amounts: np.ndarray,
+	target: int,
+	tolerance: int = 0,
+	max_days: int = MAX_WINDOW_DAYS,
+	max_lines: int = MAX_WINDOW_LINES,
+	min_lines: int = MIN_WINDOW_LINES,
+) -> List[Tuple[int, int]]:
+	"""
+	Find runs of consecutive lines whose amounts add up to `target`, within
+	`tolerance`. Lines must be sorted by date. A run spans at most `max_days`
+	and has `min_lines` to `max_lines` lines.
+
+	Returns `(start, end)` pairs, so that `amounts[start:end]` is a run. Shorter
+	runs come first.
+
+	With prefix sums `p`, the run `[i, j)` sums to `p[j] - p[i]`. Amounts are
+	positive, so `p` is increasing and the `j` for each `i` is found with one
+	vectorized binary search over all lines.
+	"""
+	amounts = np.asarray(amounts, dtype=np.int64)
+	dates = np.asarray(dates, dtype="datetime64[D]")
+	if not len(amounts) or target <= 0:
+		return []
+
+	prefix = np.concatenate(([0], np.cumsum(amounts)))
+	starts = np.arange(len(amounts))
+
+	# first end whose sum reaches the lower bound, and first end beyond the upper bound
+	low = np.searchsorted(prefix, prefix[:-1] + target - tolerance, side="left")
+	high = np.searchsorted(prefix, prefix[:-1] + target + tolerance, side="right")
+
+	# within tolerance, take the shortest run of at least `min_lines` per start
+	ends = np.maximum(low, starts + max(min_lines, 1))
+	found = (ends < high) & (ends <= len(amounts))
+	ends = np.minimum(ends, len(amounts))
+
+	found &= (ends - starts) <= max_lines
+	last = np.maximum(ends - 1, 0)
+	found &= (dates[last] - dates[starts]).astype(np.int64) <= max_days
+
+	windows = sorted(
+		zip(starts[found].tolist(), ends[found].tolist()),
+		key=lambda window: (window[1] - window[0], window[0]),
+	)
+	return windows